@@ -19,20 +19,21 @@
 
 
 import datetime
+import json
 import logging
+import math
 
 try:
     from html import escape
 except ImportError:
     from cgi import escape
 
-from ckan import authz, model
+from ckan import model
 from ckan.lib import mailer
-from ckan.lib.redis import connect_to_redis
 from ckan.plugins import toolkit as tk
 from ckan.plugins.toolkit import h, config, current_user
 
-from . import common, constants, db, validator
+from . import common, constants, db, search, throttle, validator
 
 
 log = logging.getLogger(__name__)
@@ -40,9 +41,18 @@ log = logging.getLogger(__name__)
 # Avoid user_show lag
 USERS_CACHE = {}
 
-# Allow one request per account per five minutes
-CREATION_THROTTLE_EXPIRY = 300
-THROTTLE_ERROR = "Too many requests submitted, please wait {} minutes and try again"
+# Message shown when an account performs an action too often
+THROTTLE_ERRORS = {
+    constants.CREATE_DATAREQUEST: "Too many requests submitted, please wait {} minutes and try again",
+    constants.COMMENT_DATAREQUEST: "Too many comments posted, please wait {} minutes and try again",
+    constants.UPDATE_DATAREQUEST_COMMENT: "Too many comment edits, please wait {} minutes and try again",
+    constants.FOLLOW_DATAREQUEST: "Too many data requests followed, please wait {} minutes and try again",
+}
+
+# Notifications that cannot be delivered are retried with an exponential back-off
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_DELAY = 60
 
 
 def _get_user(user_id, keep_email=False):
@@ -73,13 +83,95 @@ def _get_package(package_id):
         log.warning(e)
 
 
-def _dictize_datarequest(datarequest, user_keep_email=False):
+# Fields of the dictized data requests that can be requested with 'fields'
+DATAREQUEST_FIELDS = [
+    'id', 'user_id', 'title', 'description', 'organization_id', 'open_time', 'accepted_dataset_id',
+    'close_time', 'closed', 'user', 'organization', 'accepted_dataset', 'followers', 'data_use_type',
+    'who_will_access_this_data', 'requesting_organisation', 'data_storage_environment', 'data_outputs_type',
+    'data_outputs_description', 'status', 'requested_dataset', 'close_circumstance', 'approx_publishing_date',
+    'metadata_modified'
+]
+
+# Statuses included in the status facet, in this order
+STATUS_FACET_VALUES = [
+    'Assigned',
+    'Processing',
+    'Finalised - Approved',
+    'Finalised - Not Approved',
+    'Assign to Internal Data Catalogue Support'
+]
+
+# Statuses of the data requests that have been finalised
+FINALISED_STATUSES = ['Finalised - Approved', 'Finalised - Not Approved']
+
+# Facets of the data request list
+LIST_FACETS = ['organization', 'status', 'data_use_type', 'requesting_organisation', 'open_month']
+
+# Fields whose changes are recorded in the revisions of a data request
+REVISION_FIELDS = [
+    'title', 'description', 'organization_id', 'data_use_type', 'who_will_access_this_data',
+    'requesting_organisation', 'data_storage_environment', 'data_outputs_type', 'data_outputs_description',
+    'status', 'requested_dataset'
+]
+
+REVISION_CLOSING_CIRCUMSTANCES_FIELDS = ['close_circumstance', 'approx_publishing_date']
+
+# Expanded fields, which are retrieved from other actions or tables, and the
+# flags that can be used to leave them out
+DATAREQUEST_EXPANSIONS = {
+    'user': 'include_user',
+    'organization': 'include_organization',
+    'accepted_dataset': 'include_dataset',
+    'followers': 'include_followers',
+}
+
+
+def _get_dictize_fields(data_dict):
+    '''
+    Returns the fields to be included in the dictized data requests according
+    to the 'fields' and 'include_*' parameters, or None to include them all.
+    '''
+    fields = data_dict.get('fields')
+    excluded = {field for field, flag in DATAREQUEST_EXPANSIONS.items()
+                if not tk.asbool(data_dict.get(flag, True))}
+
+    if not fields and not excluded:
+        return None
+
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = {field.strip() for field in fields if field.strip()}
+
+        unknown_fields = fields.difference(DATAREQUEST_FIELDS)
+        if unknown_fields:
+            raise tk.ValidationError({tk._('Fields'): [
+                tk._('Unknown fields: %s') % ', '.join(sorted(unknown_fields))]})
+
+        # The ID is always needed to refer to the data request
+        fields.add('id')
+    else:
+        fields = set(DATAREQUEST_FIELDS)
+
+    return fields - excluded
+
+
+def _dictize_datarequest(datarequest, user_keep_email=False, fields=None):
+    '''
+    Converts a data request into a dict. If fields is given, only those fields
+    are included and the expanded fields that are not included are not
+    retrieved.
+    '''
+    def included(field):
+        return fields is None or field in fields
+
     # Transform time
     open_time = str(datarequest.open_time)
     # Close time can be None and the transformation is only needed when the
     # fields contains a valid date
     close_time = datarequest.close_time
     close_time = str(close_time) if close_time else close_time
+    metadata_modified = datarequest.metadata_modified
 
     # Convert the data request into a dict
     data_dict = {
@@ -92,7 +184,7 @@ def _dictize_datarequest(datarequest, user_keep_email=False):
         'accepted_dataset_id': datarequest.accepted_dataset_id,
         'close_time': close_time,
         'closed': datarequest.closed,
-        'user': _get_user(datarequest.user_id, user_keep_email),
+        'user': None,
         'organization': None,
         'accepted_dataset': None,
         'followers': 0,
@@ -104,24 +196,71 @@ def _dictize_datarequest(datarequest, user_keep_email=False):
         'data_outputs_description': datarequest.data_outputs_description,
         'status': datarequest.status,
         'requested_dataset': datarequest.requested_dataset,
+        'metadata_modified': str(metadata_modified) if metadata_modified else metadata_modified,
     }
 
-    if datarequest.organization_id:
+    if included('user'):
+        data_dict['user'] = _get_user(datarequest.user_id, user_keep_email)
+
+    if datarequest.organization_id and included('organization'):
         data_dict['organization'] = _get_organization(datarequest.organization_id)
 
-    if datarequest.accepted_dataset_id:
+    if datarequest.accepted_dataset_id and included('accepted_dataset'):
         data_dict['accepted_dataset'] = _get_package(datarequest.accepted_dataset_id)
 
-    data_dict['followers'] = db.DataRequestFollower.get_datarequest_followers_number(
-        datarequest_id=datarequest.id)
+    if included('followers'):
+        data_dict['followers'] = db.DataRequestFollower.get_datarequest_followers_number(
+            datarequest_id=datarequest.id)
 
     if h.closing_circumstances_enabled:
         data_dict['close_circumstance'] = datarequest.close_circumstance
         data_dict['approx_publishing_date'] = datarequest.approx_publishing_date
 
+    if fields is not None:
+        data_dict = {key: value for key, value in data_dict.items() if key in fields}
+
     return data_dict
 
 
+def _dictize_datarequests(datarequests, fields=None):
+    '''
+    Converts many data requests into dicts. Each user, organization and
+    dataset is retrieved once, and the followers of all the data requests are
+    counted with a single query.
+    '''
+    def included(field):
+        return fields is None or field in fields
+
+    def get_all(get_function, ids):
+        return {id: get_function(id) for id in set(ids) if id}
+
+    users = get_all(_get_user, [datarequest.user_id for datarequest in datarequests]) \
+        if included('user') else {}
+    organizations = get_all(_get_organization, [datarequest.organization_id for datarequest in datarequests]) \
+        if included('organization') else {}
+    packages = get_all(_get_package, [datarequest.accepted_dataset_id for datarequest in datarequests]) \
+        if included('accepted_dataset') else {}
+    followers = db.DataRequestFollower.get_datarequests_followers_numbers(
+        [datarequest.id for datarequest in datarequests]) if included('followers') and datarequests else {}
+
+    basic_fields = set(fields if fields is not None else DATAREQUEST_FIELDS).difference(DATAREQUEST_EXPANSIONS)
+
+    result = []
+    for datarequest in datarequests:
+        data_dict = _dictize_datarequest(datarequest, fields=basic_fields)
+        if included('user'):
+            data_dict['user'] = users.get(datarequest.user_id)
+        if included('organization'):
+            data_dict['organization'] = organizations.get(datarequest.organization_id)
+        if included('accepted_dataset'):
+            data_dict['accepted_dataset'] = packages.get(datarequest.accepted_dataset_id)
+        if included('followers'):
+            data_dict['followers'] = followers.get(datarequest.id, 0)
+        result.append(data_dict)
+
+    return result
+
+
 def _undictize_datarequest_basic(datarequest, data_dict):
     datarequest.title = data_dict['title']
     datarequest.description = data_dict['description']
@@ -145,6 +284,68 @@ def _undictize_datarequest_closing_circumstances(datarequest, data_dict):
         datarequest.approx_publishing_date = data_dict.get('approx_publishing_date') or None
 
 
+def _get_revision_values(datarequest):
+    fields = REVISION_FIELDS + (REVISION_CLOSING_CIRCUMSTANCES_FIELDS if h.closing_circumstances_enabled else [])
+    return {field: getattr(datarequest, field) for field in fields}
+
+
+def _get_revision_changes(old_values, new_values):
+    '''
+    Returns the fields whose value has changed, as {field: [old, new]}
+    '''
+    def serialize(value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        # Empty values are stored as NULL or as empty strings
+        return value if value != '' else None
+
+    changes = {}
+    for field, old_value in old_values.items():
+        old_value, new_value = serialize(old_value), serialize(new_values.get(field))
+        if old_value != new_value:
+            changes[field] = [old_value, new_value]
+    return changes
+
+
+def _add_revision(session, datarequest_id, changes, context):
+    revision = db.DataRequestRevision()
+    revision.datarequest_id = datarequest_id
+    revision.actor_id = _get_actor_id(context)
+    revision.created = datetime.datetime.utcnow()
+    revision.changes = json.dumps(changes)
+    session.add(revision)
+    return revision
+
+
+def _add_revisions(session, changes, context):
+    '''
+    Stores the revisions of many data requests, given as
+    {datarequest_id: changes}, with a single INSERT
+    '''
+    now = datetime.datetime.utcnow()
+    actor_id = _get_actor_id(context)
+    rows = [{
+        'id': db.uuid4(),
+        'datarequest_id': datarequest_id,
+        'actor_id': actor_id,
+        'created': now,
+        'changes': json.dumps(datarequest_changes)
+    } for datarequest_id, datarequest_changes in changes.items()]
+
+    if rows:
+        session.execute(db.revisions_table.insert(), rows)
+
+
+def _dictize_revision(revision):
+    return {
+        'id': revision.id,
+        'datarequest_id': revision.datarequest_id,
+        'actor_id': revision.actor_id,
+        'created': str(revision.created),
+        'changes': json.loads(revision.changes or '{}')
+    }
+
+
 def _dictize_comment(comment):
 
     return {
@@ -162,25 +363,49 @@ def _undictize_comment_basic(comment, data_dict):
     comment.datarequest_id = data_dict.get('datarequest_id', '')
 
 
-def _get_datarequest_followers(context, datarequest_dict):
+def _get_actor_id(context):
+    actor = context.get('auth_user_obj') if context else None
+    return actor.id if actor else None
+
+
+def _get_datarequest_followers(context, datarequest_dict, follower_ids=None):
+    '''
+    Returns the followers of the data request to be notified. If
+    follower_ids is given, those users are notified instead of the ones
+    following the data request now.
+    '''
     datarequest_id = datarequest_dict['id']
+    actor_id = _get_actor_id(context)
+
+    if follower_ids is None:
+        follower_ids = [follower.user_id for follower in db.DataRequestFollower.get(datarequest_id=datarequest_id)]
 
     users = []
-    followers = db.DataRequestFollower.get(datarequest_id=datarequest_id)
-    for follower in followers:
-        if follower.user_id != context['auth_user_obj'].id:
-            follower.user = _get_user(follower.user_id, True)
-            if follower.user.get('email', None):
+    for follower_id in follower_ids:
+        if follower_id != actor_id:
+            user = _get_user(follower_id, True)
+            if user.get('email', None):
                 users.append({
-                    'email': follower.user['email'],
-                    'name': follower.user['name'] or follower.user['email'],
+                    'email': user['email'],
+                    'name': user['name'] or user['email'],
                 })
 
     return users
 
 
-def _send_mail(action_type, datarequest, job_title=None, context=None, comment=None):
+def _send_mail(action_type, datarequest, job_title=None, context=None, comment=None, delivered=None,
+               follower_ids=None):
+    '''
+    Sends the notification emails of the given action. The recipients whose
+    email is already included in the delivered set are skipped and the ones
+    that succeed are added to it, so a failed notification can be retried
+    without mailing anyone twice. Returns True if every recipient was reached.
+    The followers notified can be given in follower_ids (see
+    _get_datarequest_followers).
+    '''
     user_list = []
+    delivered = delivered if delivered is not None else set()
+    success = True
 
     def get_catalog_support_team():
         user_list.append({
@@ -209,7 +434,7 @@ def _send_mail(action_type, datarequest, job_title=None, context=None, comment=N
             })
 
     def get_datarequest_followers():
-        followers = _get_datarequest_followers(context, datarequest)
+        followers = _get_datarequest_followers(context, datarequest, follower_ids)
         user_list.extend(followers)
 
     match action_type:
@@ -219,7 +444,7 @@ def _send_mail(action_type, datarequest, job_title=None, context=None, comment=N
 
         case 'update_datarequest':
             get_catalog_support_team()
-            if current_user.id != datarequest['user_id']:
+            if _get_actor_id(context) != datarequest['user_id']:
                 get_datarequest_creator()
 
         case 'comment_datarequest':
@@ -247,6 +472,9 @@ def _send_mail(action_type, datarequest, job_title=None, context=None, comment=N
 
     # Sends the email to users.
     for user in user_list:
+        if not user['email'] or user['email'] in delivered:
+            continue
+
         try:
             extra_vars = {
                 'datarequest': datarequest,
@@ -259,9 +487,146 @@ def _send_mail(action_type, datarequest, job_title=None, context=None, comment=N
             subject = tk.render('emails/subjects/{0}.txt'.format(action_type), extra_vars)
             body = tk.render('emails/bodies/{0}.txt'.format(action_type), extra_vars)
 
-            tk.enqueue_job(mailer.mail_recipient, [user['name'], user['email'], subject, body], title=job_title)
+            mailer.mail_recipient(user['name'], user['email'], subject, body)
+            delivered.add(user['email'])
         except Exception:
-            log.exception("Error sending notification to {0}".format(user['email']))
+            success = False
+            log.exception("Error sending notification '{0}' to {1}".format(job_title, user['email']))
+
+    return success
+
+
+def _queue_notification(session, action_type, datarequest_id, job_title, context, comment_id=None):
+    '''
+    Stores a notification in the outbox. It must be called before committing
+    the session so the notification is only stored when the change is.
+    '''
+    notification = db.DataRequestNotification()
+    notification.action_type = action_type
+    notification.datarequest_id = datarequest_id
+    notification.comment_id = comment_id
+    notification.actor_id = _get_actor_id(context)
+    notification.job_title = job_title
+    notification.created = datetime.datetime.utcnow()
+    notification.next_attempt_time = notification.created
+    notification.attempts = 0
+    notification.delivered = u''
+
+    session.add(notification)
+
+    return notification
+
+
+def _queue_notifications(session, action_type, datarequest_ids, job_title, context, follower_ids=None):
+    '''
+    Stores the notifications of many data requests in the outbox with a single
+    INSERT. Returns the IDs of the new notifications. follower_ids can give
+    the followers to notify of every data request ({datarequest_id: [user_id]}),
+    when they will no longer be following it by the time it is delivered.
+    '''
+    now = datetime.datetime.utcnow()
+    actor_id = _get_actor_id(context)
+    rows = [{
+        'id': db.uuid4(),
+        'action_type': action_type,
+        'datarequest_id': datarequest_id,
+        'comment_id': None,
+        'actor_id': actor_id,
+        'job_title': job_title,
+        'created': now,
+        'next_attempt_time': now,
+        'attempts': 0,
+        'delivered': u'',
+        'follower_ids': u'\n'.join(follower_ids.get(datarequest_id, [])) if follower_ids is not None else None
+    } for datarequest_id in datarequest_ids]
+
+    if rows:
+        session.execute(db.notifications_table.insert(), rows)
+
+    return [row['id'] for row in rows]
+
+
+def _dispatch_notifications(notification_ids, job_title=None):
+    '''
+    Asks the background workers to deliver the given notifications as soon as
+    possible. If the job cannot be enqueued, the notifications remain in the
+    outbox and will be delivered by the send-notifications command.
+    '''
+    if not notification_ids:
+        return
+
+    try:
+        tk.enqueue_job(send_pending_notifications, [notification_ids], title=job_title)
+    except Exception:
+        log.exception("Unable to enqueue the delivery of notifications %s", notification_ids)
+
+
+def _deliver_notification(notification):
+    now = datetime.datetime.utcnow()
+    delivered = set(email for email in (notification.delivered or u'').split('\n') if email)
+    success = True
+
+    data_req = db.DataRequest.get_by_id(notification.datarequest_id)
+    comment = db.Comment.get(id=notification.comment_id) if notification.comment_id else None
+
+    if not data_req or (notification.comment_id and not comment):
+        # Nothing to notify about anymore
+        log.warning("Discarding notification %s, the data request or comment no longer exists", notification.id)
+    else:
+        actor = model.User.get(notification.actor_id) if notification.actor_id else None
+        context = {'model': model, 'session': model.Session, 'ignore_auth': True,
+                   'user': actor.name if actor else None, 'auth_user_obj': actor}
+        datarequest_dict = _dictize_datarequest(data_req, user_keep_email=True)
+        comment_dict = _dictize_comment(comment[0]) if comment else None
+        follower_ids = None
+        if notification.follower_ids is not None:
+            follower_ids = [follower_id for follower_id in notification.follower_ids.split('\n') if follower_id]
+
+        try:
+            success = _send_mail(notification.action_type, datarequest_dict, notification.job_title,
+                                 context, comment_dict, delivered, follower_ids)
+        except Exception as e:
+            log.exception("Error delivering notification %s", notification.id)
+            notification.last_error = str(e)
+            success = False
+
+    notification.attempts = (notification.attempts or 0) + 1
+    notification.delivered = u'\n'.join(sorted(delivered))
+
+    if success:
+        notification.sent_time = now
+        notification.last_error = None
+    else:
+        retry_delay = tk.asint(config.get('ckanext.datarequests.notification_retry_delay', NOTIFICATION_RETRY_DELAY))
+        notification.next_attempt_time = now + datetime.timedelta(seconds=retry_delay * 2 ** (notification.attempts - 1))
+        notification.last_error = notification.last_error or 'Some recipients could not be notified'
+
+
+def send_pending_notifications(notification_ids=None, batch_size=NOTIFICATION_BATCH_SIZE):
+    '''
+    Delivers the notifications of the outbox that are due, up to batch_size.
+    When notification_ids is given, only those notifications are considered.
+    Notifications being delivered by other workers are skipped. This function
+    is run by the background workers and by the send-notifications command.
+
+    :returns: The number of notifications processed
+    :rtype: int
+    '''
+    if notification_ids is not None and len(notification_ids) > batch_size:
+        return sum(send_pending_notifications(notification_ids[i:i + batch_size], batch_size)
+                   for i in range(0, len(notification_ids), batch_size))
+
+    max_attempts = tk.asint(config.get('ckanext.datarequests.notification_max_attempts', NOTIFICATION_MAX_ATTEMPTS))
+    notifications = db.DataRequestNotification.get_pending(ids=notification_ids, max_attempts=max_attempts,
+                                                           limit=batch_size)
+
+    for notification in notifications:
+        _deliver_notification(notification)
+        model.Session.add(notification)
+
+    model.Session.commit()
+
+    return len(notifications)
 
 
 def _get_admin_users_from_organisation(org_dict):
@@ -272,37 +637,21 @@ def _get_admin_users_from_organisation(org_dict):
         return {user['id'] for user in all_users if user.get('capacity') == 'admin'}
 
 
+def _throttle(action, user):
+    """ Reject the attempt if the account is performing the action too often.
+    This is checked before any validation or notification work is done.
+    """
+    retry_after = throttle.check(action, user)
+    if retry_after:
+        raise tk.ValidationError({"": [THROTTLE_ERRORS[action].format(int(math.ceil(retry_after / 60)))]})
+
+
 def throttle_datarequest(creator):
     """ Check that the account is not creating requests too quickly.
     This should happen after validation, so a request that fails
     validation can be immediately corrected and resubmitted.
     """
-    if creator.sysadmin or authz.has_user_permission_for_some_org(creator.name, 'create_dataset'):
-        # privileged users can skip the throttle
-        return
-
-    # check cache to see if there's a record of a recent creation
-    cache_key = '{}.ckanext.datarequest.creation_attempts.{}'.format(
-        tk.config.get('ckan.site_id'), creator.id)
-    redis_conn = connect_to_redis()
-    try:
-        creation_attempts = int(redis_conn.get(cache_key) or 0)
-    except ValueError:
-        # shouldn't happen but let's play it safe
-        creation_attempts = 0
-
-    if creation_attempts:
-        # Increase the delay every time someone tries too soon
-        expiry = creation_attempts * CREATION_THROTTLE_EXPIRY
-    else:
-        expiry = CREATION_THROTTLE_EXPIRY
-    log.debug("Account %s has submitted %s request(s) recently, next allowed in %s seconds",
-              creator.id, creation_attempts, expiry)
-    # put a cap on the maximum delay
-    recorded_attempts = creation_attempts if creation_attempts >= 100 else creation_attempts + 1
-    redis_conn.set(cache_key, recorded_attempts, ex=expiry)
-    if creation_attempts:
-        raise tk.ValidationError({"": [THROTTLE_ERROR.format(int(expiry / 60))]})
+    _throttle(constants.CREATE_DATAREQUEST, creator)
 
 
 def create_datarequest(context, data_dict):
@@ -350,13 +699,17 @@ def create_datarequest(context, data_dict):
     data_req.open_time = datetime.datetime.utcnow()
 
     session.add(data_req)
+    session.flush()
+
+    # When a data request is created, an email is sent to the Point Of Contact of the dataset and Internal Data Catalogue Support team.
+    notification = _queue_notification(session, 'new_datarequest', data_req.id, 'Data Request Created Email', context)
+
     session.commit()
+    _dispatch_notifications([notification.id], notification.job_title)
+    search.update_index([data_req.id])
 
     datarequest_dict = _dictize_datarequest(data_req)
 
-    # When a data request is created, an email is sent to the Point Of Contact of the dataset and Internal Data Catalogue Support team.
-    _send_mail('new_datarequest', datarequest_dict, 'Data Request Created Email', context)
-
     return datarequest_dict
 
 
@@ -372,6 +725,15 @@ def show_datarequest(context, data_dict):
     :param id: The id of the data request to be shown
     :type id: string
 
+    :param fields: The fields to be returned, as a list or a comma separated
+        string (optional, all the fields by default)
+    :type fields: list
+
+    :param include_user: Whether the creator of the data request has to be
+        included (True by default). The same applies to include_organization,
+        include_dataset (the accepted dataset) and include_followers.
+    :type include_user: bool
+
     :returns: A dict with the data request (id, user_id, title, description,
         organization_id, open_time, accepted_dataset, close_time, closed,
         followers)
@@ -386,17 +748,84 @@ def show_datarequest(context, data_dict):
     # Check access
     tk.check_access(constants.SHOW_DATAREQUEST, context, data_dict)
 
+    fields = _get_dictize_fields(data_dict)
+
     # Get the data request
     result = db.DataRequest.get(id=datarequest_id)
     if not result:
         raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
 
     data_req = result[0]
-    data_dict = _dictize_datarequest(data_req)
+    data_dict = _dictize_datarequest(data_req, fields=fields)
 
     return data_dict
 
 
+def show_many_datarequests(context, data_dict):
+    '''
+    Action to retrieve the information of many data requests at once. The data
+    requests are read with a single query and the access rights are checked
+    for all of them at once, so this is much cheaper than calling
+    show_datarequest for each one.
+
+    :param ids: The IDs of the data requests to be shown, as a list or a comma
+        separated string (100 at most)
+    :type ids: list
+
+    :param fields: The fields to be returned, as in show_datarequest
+    :type fields: list
+
+    :returns: A list with an entry for each of the given IDs, in the same
+        order. Each entry includes the id and either the data request
+        (datarequest) or the reason why it cannot be shown (error).
+    :rtype: list
+    '''
+
+    ids = data_dict.get('ids')
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    ids = [datarequest_id.strip() for datarequest_id in ids or [] if datarequest_id and datarequest_id.strip()]
+
+    if not ids:
+        raise tk.ValidationError({tk._('IDs'): [tk._('Data Request IDs have not been included')]})
+
+    if len(ids) > constants.SHOW_MANY_DATAREQUESTS_MAX_IDS:
+        raise tk.ValidationError({tk._('IDs'): [
+            tk._('No more than %d data requests can be shown at once') % constants.SHOW_MANY_DATAREQUESTS_MAX_IDS]})
+
+    # Check access
+    tk.check_access(constants.SHOW_MANY_DATAREQUESTS, context, data_dict)
+
+    fields = _get_dictize_fields(data_dict)
+
+    datarequests = {datarequest.id: datarequest for datarequest in db.DataRequest.get_many(set(ids))}
+
+    # Same rules as show_datarequest: sysadmins, creators and the members of
+    # the organization of the data request can see it
+    if not current_user.sysadmin:
+        user_id = current_user.id if current_user else None
+        readable_organization_ids = {org['id'] for org in h.organizations_available('read')}
+        forbidden_ids = {datarequest.id for datarequest in datarequests.values()
+                         if datarequest.user_id != user_id
+                         and datarequest.organization_id not in readable_organization_ids}
+    else:
+        forbidden_ids = set()
+
+    allowed = [datarequest for datarequest in datarequests.values() if datarequest.id not in forbidden_ids]
+    dictized = {data_req['id']: data_req for data_req in _dictize_datarequests(allowed, fields)}
+
+    result = []
+    for datarequest_id in ids:
+        if datarequest_id in dictized:
+            result.append({'id': datarequest_id, 'datarequest': dictized[datarequest_id]})
+        elif datarequest_id in forbidden_ids:
+            result.append({'id': datarequest_id, 'error': tk._('Not authorized to see this Data Request')})
+        else:
+            result.append({'id': datarequest_id, 'error': tk._('Data Request not found')})
+
+    return result
+
+
 def update_datarequest(context, data_dict):
     '''
     Action to update a data request. The function checks the access rights of
@@ -449,32 +878,93 @@ def update_datarequest(context, data_dict):
     validator.validate_datarequest(context, data_dict)
 
     # Track changes in the data request
-    has_changes = False
-    old_data_json = _dictize_datarequest(data_req)
-    for key, value in data_dict.items():
-        if old_data_json[key] != value:
-            has_changes = True
-            break
+    old_values = _get_revision_values(data_req)
 
     # Set the data provided by the user in the data_red
     _undictize_datarequest_basic(data_req, data_dict)
 
-    # Always force datarequest to active state when updating, some older dataset may be in null state
-    data_req.state = model.State.ACTIVE
-
     session.add(data_req)
-    session.commit()
 
-    datarequest_dict = _dictize_datarequest(data_req, user_keep_email=True)
+    changes = _get_revision_changes(old_values, _get_revision_values(data_req))
+    has_changes = bool(changes)
 
     # Send follower and email notifications if there is changes in the data request
+    notifications = []
     if has_changes:
-        _send_mail('update_datarequest', datarequest_dict, 'Data Request Status Change Email', context)
-        _send_mail('update_datarequest_follower', datarequest_dict, 'Data Request Updated Email', context)
+        _add_revision(session, data_req.id, changes, context)
+        notifications.append(_queue_notification(session, 'update_datarequest', data_req.id,
+                                                 'Data Request Status Change Email', context))
+        notifications.append(_queue_notification(session, 'update_datarequest_follower', data_req.id,
+                                                 'Data Request Updated Email', context))
+
+    session.commit()
+    _dispatch_notifications([notification.id for notification in notifications], 'Data Request Updated Email')
+    search.update_index([data_req.id])
+
+    datarequest_dict = _dictize_datarequest(data_req, user_keep_email=True)
 
     return datarequest_dict
 
 
+def bulk_update_datarequests_status(context, data_dict):
+    '''
+    Action to change the status of many data requests at once. The access
+    rights of the user are checked for all the data requests and a
+    NotAuthorized exception will be risen if the user is not allowed to update
+    any of them.
+
+    The new status is validated once and applied with a single query. The
+    notifications of every changed data request are delivered by a single
+    background job.
+
+    :param ids: The IDs of the data requests to be updated
+    :type ids: list
+
+    :param status: The new status of the data requests
+    :type status: string
+
+    :returns: A dict with two fields: ids (the IDs of the data requests whose
+        status has changed) and count (the number of changed data requests)
+    :rtype: dict
+    '''
+
+    session = context['session']
+    datarequest_ids = data_dict.get('ids', [])
+
+    if not datarequest_ids or not isinstance(datarequest_ids, list):
+        raise tk.ValidationError(tk._('Data Request IDs have not been included'))
+
+    # Check access
+    tk.check_access(constants.BULK_UPDATE_DATAREQUESTS_STATUS, context, data_dict)
+
+    # Validate data
+    validator.validate_datarequest_status(context, data_dict)
+
+    updated = db.DataRequest.update_status(datarequest_ids, data_dict['status'])
+    updated_ids = [datarequest_id for datarequest_id, _ in updated]
+
+    # Record the status change of every data request in the same transaction
+    _add_revisions(session, {
+        datarequest_id: _get_revision_changes({'status': previous_status}, {'status': data_dict['status']})
+        for datarequest_id, previous_status in updated
+    }, context)
+
+    # Send follower and email notifications of the data requests that have changed
+    notification_ids = _queue_notifications(session, 'update_datarequest', updated_ids,
+                                            'Data Request Status Change Email', context)
+    notification_ids += _queue_notifications(session, 'update_datarequest_follower', updated_ids,
+                                             'Data Request Updated Email', context)
+
+    session.commit()
+    _dispatch_notifications(notification_ids, 'Data Request Status Change Email')
+    search.update_index(updated_ids)
+
+    return {
+        'ids': updated_ids,
+        'count': len(updated_ids)
+    }
+
+
 def list_datarequests(context, data_dict):
     '''
     Returns a list with the existing data requests. Rights access will be
@@ -493,10 +983,32 @@ def list_datarequests(context, data_dict):
         the result by the data request status (open or closed)
     :type closed: bool
 
+    :param opened_after: This parameter is optional and allows users to
+        filter the results by the data requests opened on or after a date
+        (yyyy-mm-dd)
+    :type opened_after: string
+
+    :param opened_before: This parameter is optional and allows users to
+        filter the results by the data requests opened before a date
+        (yyyy-mm-dd)
+    :type opened_before: string
+
     :param q: This parameter is optional and allows users to filter
         datarequests based on a free text
     :type q: string
 
+    :param data_use_type: This parameter is optional and allows users to
+        filter the results by data use type
+    :type data_use_type: string
+
+    :param requesting_organisation: This parameter is optional and allows
+        users to filter the results by the ID of the requesting organisation
+    :type requesting_organisation: string
+
+    :param open_month: This parameter is optional and allows users to filter
+        the results by the month they were opened (yyyy-mm)
+    :type open_month: string
+
     :param sort: This parameter is optional and allows users to sort
         data requests. You can choose 'desc' for retrieving data requests
         in descending order or 'asc' for retrieving data requests in
@@ -511,9 +1023,19 @@ def list_datarequests(context, data_dict):
         default)
     :type limit: int
 
+    :param fields: The fields to be returned, as a list or a comma separated
+        string (optional, all the fields by default)
+    :type fields: list
+
+    :param include_user: Whether the creator of each data request has to be
+        included (True by default). The same applies to include_organization,
+        include_dataset (the accepted dataset) and include_followers.
+    :type include_user: bool
+
     :returns: A dict with three fields: result (a list of data requests),
-        facets (a list of the facets that can be used) and count (the total
-        number of existing data requests)
+        facets (a list of the facets that can be used: organization, status,
+        data_use_type, requesting_organisation and open_month) and count
+        (the total number of existing data requests)
     :rtype: dict
     '''
 
@@ -523,6 +1045,8 @@ def list_datarequests(context, data_dict):
     # Check access
     tk.check_access(constants.LIST_DATAREQUESTS, context, data_dict)
 
+    fields = _get_dictize_fields(data_dict)
+
     # Get the organization
     organization_id = data_dict.get('organization_id', None)
     if organization_id:
@@ -543,6 +1067,21 @@ def list_datarequests(context, data_dict):
     # Free text filter
     q = data_dict.get('q', None)
 
+    # Filter by open or closed
+    closed = validator.validate_closed_filter(context, data_dict)
+
+    # Filter by the values of the facets
+    data_use_type = data_dict.get('data_use_type') or None
+    requesting_organisation = data_dict.get('requesting_organisation') or None
+
+    # Filter by opening time. The month facet narrows the range further
+    dates = validator.validate_date_filters(context, data_dict)
+    opened_after, opened_before = dates['opened_after'], dates['opened_before']
+    month_start, month_end = validator.validate_open_month(context, data_dict)
+    if month_start is not None:
+        opened_after = max(opened_after, month_start) if opened_after else month_start
+        opened_before = min(opened_before, month_end) if opened_before else month_end
+
     # Sort. By default, data requests are returned in the order they are created
     # This is something new in version 0.3.0. In previous versions, requests were
     # returned in inverse order
@@ -550,64 +1089,103 @@ def list_datarequests(context, data_dict):
     if data_dict.get('sort', None) == 'desc':
         desc = True
 
-    # Call the function
-    db_datarequests = db.DataRequest.get_ordered_by_date(organization_id=organization_id,
-                                                         user_id=user_id, status=status,
-                                                         q=q, desc=desc, state=state)
+    offset = data_dict.get('offset', 0)
+    limit = data_dict.get('limit', constants.DATAREQUESTS_PER_PAGE)
+
+    filters = {
+        'organization_id': organization_id,
+        'user_id': user_id,
+        'closed': closed,
+        'status': status,
+        'state': state,
+        'q': q,
+        'data_use_type': data_use_type,
+        'requesting_organisation': requesting_organisation,
+        'opened_after': opened_after,
+        'opened_before': opened_before
+    }
+
+    if search.is_enabled():
+        # Search, sort, paginate and count the facets in Solr
+        visible_to = None
+        if not current_user.sysadmin:
+            visible_to = (current_user.id, [org['id'] for org in h.organizations_available('read')])
+
+        ids, count, facet_counts = search.search_datarequests(
+            desc=desc, offset=offset, limit=limit, visible_to=visible_to,
+            pinned_user_id=current_user.id if current_user else None, **filters)
+
+        db_datarequests = {data_req.id: data_req for data_req in db.DataRequest.get_many(ids, state=state)}
+        page = [db_datarequests[datarequest_id] for datarequest_id in ids if datarequest_id in db_datarequests]
+    else:
+        # Paginate, count and group the matching data requests in the database.
+        # The page and the count are read together
+        page, count = db.DataRequest.get_ordered_by_date(desc=desc, offset=offset, limit=limit, **filters)
+        facet_counts = db.DataRequest.get_facet_counts(LIST_FACETS, **filters)
 
     # Dictize the results
     datarequests = []
-    offset = data_dict.get('offset', 0)
-    limit = data_dict.get('limit', constants.DATAREQUESTS_PER_PAGE)
-    for data_req in db_datarequests[offset:offset + limit]:
-        datarequests.append(_dictize_datarequest(data_req))
-
-    # Facets
-    no_processed_organization_facet = {}
-    no_processed_status_facet = {
-        'Assigned': 0,
-        'Processing': 0,
-        'Finalised - Approved': 0,
-        'Finalised - Not Approved': 0,
-        'Assign to Internal Data Catalogue Support': 0
+    for data_req in page:
+        datarequests.append(_dictize_datarequest(data_req, fields=fields))
+
+    result = {
+        'count': count,
+        'facets': _format_list_facets(facet_counts),
+        'result': datarequests
     }
-    for data_req in db_datarequests:
-        organization_id = data_req.organization_id
-        status = data_req.status
 
-        if organization_id:
-            no_processed_organization_facet[organization_id] = no_processed_organization_facet.get(organization_id, 0) + 1
+    return result
 
-        if status in no_processed_status_facet:
-            no_processed_status_facet[status] += 1
 
-    # Format facets
+def _format_organization_facet(organization_counts, organization_show, by_id=False):
     organization_facet = []
-    for organization_id in no_processed_organization_facet:
+    for organization_id in organization_counts:
         try:
             organization = organization_show({'ignore_auth': True}, {'id': organization_id})
             organization_facet.append({
-                'name': organization.get('name'),
+                'name': organization_id if by_id else organization.get('name'),
                 'display_name': organization.get('display_name'),
-                'count': no_processed_organization_facet[organization_id]
+                'count': organization_counts[organization_id]
             })
         except Exception:
             pass
+    return organization_facet
+
+
+def _format_list_facets(facet_counts):
+    organization_show = tk.get_action('organization_show')
 
+    # Format facets
+    organization_facet = _format_organization_facet(facet_counts.get('organization', {}), organization_show)
+
+    status_counts = facet_counts.get('status', {})
     status_facet = []
-    for status in no_processed_status_facet:
-        if no_processed_status_facet[status]:
+    for status in STATUS_FACET_VALUES:
+        if status_counts.get(status):
             status_facet.append({
                 'name': status,
                 'display_name': tk._(status),
-                'count': no_processed_status_facet[status]
+                'count': status_counts[status]
             })
 
-    result = {
-        'count': len(db_datarequests),
-        'facets': {},
-        'result': datarequests
-    }
+    # The requesting organisations are stored by ID, which is also the filter value
+    requesting_organisation_facet = _format_organization_facet(
+        facet_counts.get('requesting_organisation', {}), organization_show, by_id=True)
+
+    data_use_type_counts = facet_counts.get('data_use_type', {})
+    data_use_type_facet = [
+        {'name': data_use_type, 'display_name': data_use_type, 'count': count}
+        for data_use_type, count in sorted(data_use_type_counts.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+    # Months are listed in chronological order, so they can be drawn as a histogram
+    open_month_counts = facet_counts.get('open_month', {})
+    open_month_facet = [
+        {'name': month, 'display_name': month, 'count': open_month_counts[month]}
+        for month in sorted(open_month_counts)
+    ]
+
+    facets = {}
 
     # Facets can only be included if they contain something
     if organization_facet:
@@ -617,12 +1195,95 @@ def list_datarequests(context, data_dict):
             user_orgs = {org['name'] for org in current_user_orgs}
             organization_facet = [org for org in organization_facet if org['name'] in user_orgs]
 
-        result['facets']['organization'] = {'items': organization_facet}
+        facets['organization'] = {'items': organization_facet}
 
     if status_facet:
-        result['facets']['status'] = {'items': status_facet}
+        facets['status'] = {'items': status_facet}
 
-    return result
+    if data_use_type_facet:
+        facets['data_use_type'] = {'items': data_use_type_facet}
+
+    if requesting_organisation_facet:
+        facets['requesting_organisation'] = {'items': requesting_organisation_facet}
+
+    if open_month_facet:
+        facets['open_month'] = {'items': open_month_facet}
+
+    return facets
+
+
+def list_datarequest_changes(context, data_dict):
+    '''
+    Action to retrieve the data requests created, updated or deleted since a
+    given time, so they can be synchronized incrementally. Only sysadmins and
+    the members of the given organization are allowed to list the changes.
+
+    :param since: Only the changes made at or after this time (ISO 8601) are
+        returned (optional)
+    :type since: string
+
+    :param cursor: The cursor returned by the previous call, to continue
+        after the last change already retrieved (optional)
+    :type cursor: string
+
+    :param organization_id: The ID or name of the organization (optional for
+        sysadmins)
+    :type organization_id: string
+
+    :param limit: The max number of changes to be returned (100 by default)
+    :type limit: int
+
+    :param fields: The fields of the data requests to be returned, as in
+        show_datarequest
+    :type fields: list
+
+    :returns: A dict with the changes, in the order they were made, the cursor
+        to retrieve the following ones and whether there are more changes
+        (has_more). Each change contains the id, metadata_modified and either
+        deleted (True) or the datarequest.
+    :rtype: dict
+    '''
+
+    # Check access
+    tk.check_access(constants.LIST_DATAREQUEST_CHANGES, context, data_dict)
+
+    params = validator.validate_changes_params(context, data_dict)
+    fields = _get_dictize_fields(data_dict)
+
+    organization_id = data_dict.get('organization_id') or None
+    if organization_id:
+        # Get organization ID (organization name is received sometimes)
+        organization = model.Group.get(organization_id)
+        if not organization:
+            raise tk.ObjectNotFound(tk._('Organization %s not found') % organization_id)
+        organization_id = organization.id
+
+    datarequests = db.DataRequest.get_changes(since=params['since'], after=params['after'],
+                                              organization_id=organization_id, limit=params['limit'])
+
+    upserts = _dictize_datarequests(
+        [datarequest for datarequest in datarequests if datarequest.state != model.State.DELETED], fields)
+    upserts = {datarequest['id']: datarequest for datarequest in upserts}
+
+    changes = []
+    for datarequest in datarequests:
+        change = {'id': datarequest.id, 'metadata_modified': str(datarequest.metadata_modified)}
+        if datarequest.id in upserts:
+            change['datarequest'] = upserts[datarequest.id]
+        else:
+            change['deleted'] = True
+        changes.append(change)
+
+    cursor = data_dict.get('cursor') or None
+    if datarequests:
+        last = datarequests[-1]
+        cursor = '{0} {1}'.format(last.metadata_modified.isoformat(), last.id)
+
+    return {
+        'changes': changes,
+        'cursor': cursor,
+        'has_more': len(datarequests) == params['limit']
+    }
 
 
 def delete_datarequest(context, data_dict):
@@ -657,11 +1318,15 @@ def delete_datarequest(context, data_dict):
 
     data_req = result[0]
     data_req.delete()
-    session.commit()
 
     # Send emails
+    notification = _queue_notification(session, 'delete_datarequest', data_req.id, 'Data Request Deletion Email', context)
+
+    session.commit()
+    _dispatch_notifications([notification.id], notification.job_title)
+    search.update_index([data_req.id])
+
     datarequest_dict = _dictize_datarequest(data_req)
-    _send_mail('delete_datarequest', datarequest_dict, 'Data Request Deletion Email', context)
 
     return datarequest_dict
 
@@ -696,28 +1361,32 @@ def close_datarequest(context, data_dict):
     # Check access
     tk.check_access(constants.CLOSE_DATAREQUEST, context, data_dict)
 
-    # Get the data request
-    result = db.DataRequest.get(id=datarequest_id)
-    if not result:
-        raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
-
     # Validate data
     validator.validate_datarequest_closing(context, data_dict)
 
-    data_req = result[0]
-
-    # Was the data request previously closed?
-    if data_req.closed:
+    values = {
+        'accepted_dataset_id': data_dict.get('accepted_dataset_id') or None,
+        'close_time': datetime.datetime.utcnow()
+    }
+    if h.closing_circumstances_enabled:
+        values['close_circumstance'] = data_dict.get('close_circumstance') or None
+        values['approx_publishing_date'] = data_dict.get('approx_publishing_date') or None
+
+    # Close the data request, only if it is still open, so concurrent closes
+    # cannot both succeed
+    data_req, previous_values = db.DataRequest.close(datarequest_id, **values)
+    if data_req is None:
+        if not db.DataRequest.get(id=datarequest_id):
+            raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
         raise tk.ValidationError([tk._('This Data Request is already closed')])
 
-    data_req.closed = True
-    data_req.accepted_dataset_id = data_dict.get('accepted_dataset_id') or None
-    data_req.close_time = datetime.datetime.utcnow()
-    _undictize_datarequest_closing_circumstances(data_req, data_dict)
+    values['closed'] = True
+    _add_revision(session, data_req.id, _get_revision_changes(previous_values, values), context)
 
-    session.add(data_req)
     session.commit()
+    search.update_index([data_req.id])
 
+    # The data request returned by the update is dictized, it is not read again
     datarequest_dict = _dictize_datarequest(data_req)
 
     return datarequest_dict
@@ -751,6 +1420,9 @@ def comment_datarequest(context, data_dict):
     # Check access
     tk.check_access(constants.COMMENT_DATAREQUEST, context, data_dict)
 
+    # Ensure account isn't commenting too fast
+    _throttle(constants.COMMENT_DATAREQUEST, context['auth_user_obj'])
+
     # Validate comment
     validator.validate_comment(context, data_dict)
 
@@ -761,14 +1433,17 @@ def comment_datarequest(context, data_dict):
     comment.time = datetime.datetime.utcnow()
 
     session.add(comment)
+    session.flush()
+
+    # Send emails
+    notification = _queue_notification(session, 'comment_datarequest', datarequest_id, 'Data Request Comment Email',
+                                       context, comment.id)
+
     session.commit()
+    _dispatch_notifications([notification.id], notification.job_title)
 
     comment_dict = _dictize_comment(comment)
 
-    # Send emails
-    datarequest_dict = _dictize_datarequest(db.DataRequest.get(id=datarequest_id)[0], user_keep_email=True)
-    _send_mail('comment_datarequest', datarequest_dict, 'Data Request Comment Email', context, comment_dict)
-
     return comment_dict
 
 
@@ -854,6 +1529,131 @@ def list_datarequest_comments(context, data_dict):
     return comments_list
 
 
+def list_datarequest_revisions(context, data_dict):
+    '''
+    Action to retrieve the revisions of a data request, newest first. Every
+    revision contains the fields changed by an update, with their old and new
+    values, the ID of the user who made it and when. Access rights will be
+    checked as in show_datarequest.
+
+    :param id: The ID of the data request
+    :type id: string
+
+    :param offset: The first revision to be returned (0 by default)
+    :type offset: int
+
+    :param limit: The max number of revisions to be returned (20 by default)
+    :type limit: int
+
+    :returns: A dict with the revisions (result) and the total number of
+        revisions of the data request (count)
+    :rtype: dict
+    '''
+
+    datarequest_id = data_dict.get('id', '')
+
+    if not datarequest_id:
+        raise tk.ValidationError(tk._('Data Request ID has not been included'))
+
+    # Check access
+    tk.check_access(constants.LIST_DATAREQUEST_REVISIONS, context, data_dict)
+
+    try:
+        offset = max(int(data_dict.get('offset', 0)), 0)
+        limit = min(max(int(data_dict.get('limit', constants.DATAREQUEST_REVISIONS_PER_PAGE)), 1),
+                    constants.DATAREQUEST_REVISIONS_MAX_PER_PAGE)
+    except ValueError:
+        raise tk.ValidationError({tk._('Limit'): [tk._('Offset and limit must be numbers')]})
+
+    revisions, count = db.DataRequestRevision.get_datarequest_revisions(datarequest_id, offset=offset, limit=limit)
+
+    return {
+        'count': count,
+        'result': [_dictize_revision(revision) for revision in revisions]
+    }
+
+
+def _get_median(value_counts):
+    # Median of the values repeated the given number of times, sorted by value
+    total = sum(count for _, count in value_counts)
+    if not total:
+        return None
+
+    middle = [(total - 1) // 2, total // 2]
+    values = []
+    position = 0
+    for value, count in value_counts:
+        while middle and middle[0] < position + count:
+            values.append(value)
+            middle.pop(0)
+        position += count
+
+    return sum(values) / 2.0
+
+
+def show_datarequest_stats(context, data_dict):
+    '''
+    Action to retrieve the number of data requests opened, closed and
+    finalised every day, by organization, and the median number of days it
+    took to close them. The figures are read from the daily counters rolled
+    up by the rollup-stats command, so they are as fresh as its last run. Only
+    sysadmins and the members of the given organization are allowed to see
+    the statistics.
+
+    :param organization_id: The ID or name of the organization (optional for
+        sysadmins)
+    :type organization_id: string
+
+    :param since: The first day (yyyy-mm-dd, 30 days ago by default)
+    :type since: string
+
+    :param until: The last day (yyyy-mm-dd, today by default)
+    :type until: string
+
+    :returns: A dict with since, until, the counters of every day and
+        organization with activity (days), their totals and
+        median_days_to_close (None if no data request was closed)
+    :rtype: dict
+    '''
+
+    # Check access
+    tk.check_access(constants.SHOW_DATAREQUEST_STATS, context, data_dict)
+
+    params = validator.validate_stats_params(context, data_dict)
+
+    organization_id = data_dict.get('organization_id') or None
+    if organization_id:
+        # Get organization ID (organization name is received sometimes)
+        organization = model.Group.get(organization_id)
+        if not organization:
+            raise tk.ObjectNotFound(tk._('Organization %s not found') % organization_id)
+        organization_id = organization.id
+
+    days = {}
+    totals = {'opened': 0, 'closed': 0, 'finalised': 0}
+    for day, day_organization_id, status, opened, closed in db.DataRequestStats.get_daily(
+            organization_id=organization_id, since=params['since'], until=params['until']):
+        key = (day, day_organization_id)
+        if key not in days:
+            days[key] = {'day': day.isoformat(), 'organization_id': day_organization_id or None,
+                         'opened': 0, 'closed': 0, 'finalised': 0}
+        counters = {'opened': opened, 'closed': closed, 'finalised': closed if status in FINALISED_STATUSES else 0}
+        for counter, value in counters.items():
+            days[key][counter] += value
+            totals[counter] += value
+
+    close_days = db.DataRequestStats.get_close_days(
+        organization_id=organization_id, since=params['since'], until=params['until'])
+
+    return {
+        'since': params['since'].isoformat(),
+        'until': params['until'].isoformat(),
+        'days': [days[key] for key in sorted(days)],
+        'totals': totals,
+        'median_days_to_close': _get_median(close_days)
+    }
+
+
 def update_datarequest_comment(context, data_dict):
     '''
     Action to update a comment of a data request. Access rights will be checked
@@ -880,6 +1680,9 @@ def update_datarequest_comment(context, data_dict):
     # Check access
     tk.check_access(constants.UPDATE_DATAREQUEST_COMMENT, context, data_dict)
 
+    # Ensure account isn't editing comments too fast
+    _throttle(constants.UPDATE_DATAREQUEST_COMMENT, context['auth_user_obj'])
+
     # Get the data request
     result = db.Comment.get(id=comment_id)
     if not result:
@@ -960,24 +1763,19 @@ def follow_datarequest(context, data_dict):
     # Check access
     tk.check_access(constants.FOLLOW_DATAREQUEST, context, data_dict)
 
+    # Ensure account isn't following too fast
+    _throttle(constants.FOLLOW_DATAREQUEST, context['auth_user_obj'])
+
     # Get the data request
     result = db.DataRequest.get(id=datarequest_id)
     if not result:
         raise tk.ObjectNotFound(tk._('Data Request %s not found in the data base') % datarequest_id)
 
-    # Is already following?
+    # Store the data, unless the user is already following the data request
     user_id = context['auth_user_obj'].id
-    result = db.DataRequestFollower.get(datarequest_id=datarequest_id, user_id=user_id)
-    if result:
+    if not db.DataRequestFollower.follow(datarequest_id, user_id, datetime.datetime.now()):
         raise tk.ValidationError([tk._('The user is already following the given Data Request')])
 
-    # Store the data
-    follower = db.DataRequestFollower()
-    follower.datarequest_id = datarequest_id
-    follower.user_id = user_id
-    follower.time = datetime.datetime.now()
-
-    session.add(follower)
     session.commit()
 
     return True
@@ -1008,15 +1806,11 @@ def unfollow_datarequest(context, data_dict):
     # Check access
     tk.check_access(constants.UNFOLLOW_DATAREQUEST, context, data_dict)
 
-    # Is already following?
+    # Remove the follower, if the user is following the data request
     user_id = context['auth_user_obj'].id
-    result = db.DataRequestFollower.get(datarequest_id=datarequest_id, user_id=user_id)
-    if not result:
+    if not db.DataRequestFollower.unfollow(datarequest_id, user_id):
         raise tk.ObjectNotFound([tk._('The user is not following the given Data Request')])
 
-    follower = result[0]
-
-    session.delete(follower)
     session.commit()
 
     return True
@@ -1025,11 +1819,54 @@ def unfollow_datarequest(context, data_dict):
 def purge_datarequests(context, data_dict):
     """ Delete all data requests associated with the specified account.
     This is intended for cleanup of spam.
+
+    All the data requests of the account are deleted with a single query,
+    and their comments and followers are removed as well. Deletion emails are
+    not sent unless notify is set.
+
+    :param user_id: The ID or name of the account
+    :type user_id: string
+
+    :param notify: Whether the deletion notifications have to be sent (False
+        by default)
+    :type notify: bool
+
+    :returns: A dict with the number of datarequests, comments and followers
+        removed
+    :rtype: dict
     """
+    session = context['session']
+    user_id = data_dict.get('user_id', '')
+
+    if not user_id:
+        raise tk.ValidationError([tk._('User ID has not been included')])
+
     tk.check_access(constants.PURGE_DATAREQUESTS, context, data_dict)
 
-    datarequests_list = tk.get_action(constants.LIST_DATAREQUESTS)(context, data_dict)
-    for target_datarequest in datarequests_list['result']:
-        tk.get_action(constants.DELETE_DATAREQUEST)(context, {'id': target_datarequest['id']})
+    # Get user ID (user name is received sometimes)
+    user = model.User.get(user_id)
+    if not user:
+        raise tk.ObjectNotFound(tk._('User %s not found') % user_id)
 
-    return True
+    deleted_ids, comments, follower_ids = db.DataRequest.purge_by_user(user.id)
+    followers = sum(len(datarequest_followers) for datarequest_followers in follower_ids.values())
+
+    # The followers are removed with the data requests, so the ones to notify
+    # are stored with the notifications
+    notification_ids = []
+    if tk.asbool(data_dict.get('notify', False)):
+        notification_ids = _queue_notifications(session, 'delete_datarequest', deleted_ids,
+                                                'Data Request Deletion Email', context, follower_ids=follower_ids)
+
+    session.commit()
+    _dispatch_notifications(notification_ids, 'Data Request Deletion Email')
+    search.update_index(deleted_ids)
+
+    log.info("Purged %s data request(s), %s comment(s) and %s follower(s) of user %s",
+             len(deleted_ids), comments, followers, user.id)
+
+    return {
+        'datarequests': len(deleted_ids),
+        'comments': comments,
+        'followers': followers
+    }
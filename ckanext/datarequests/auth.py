@@ -58,6 +58,12 @@ def show_datarequest(context, data_dict):
     return {'success': True}
 
 
+@auth_allow_anonymous_access
+def show_many_datarequests(context, data_dict):
+    # The data requests the user cannot see are reported one by one by the action
+    return {'success': True}
+
+
 def auth_if_creator(context, data_dict, show_function):
     # Sometimes data_dict only contains the 'id'
     if 'user_id' not in data_dict:
@@ -91,11 +97,39 @@ def update_datarequest(context, data_dict):
     return auth_if_editor_or_admin(context, data_dict, constants.SHOW_DATAREQUEST)
 
 
+def bulk_update_datarequests_status(context, data_dict):
+    # Only the editors and admins of the organizations of all the data requests
+    organization_ids = db.DataRequest.get_organization_ids(data_dict.get('ids') or [])
+    editable_organization_ids = {org['id'] for org in h.organizations_available('create_dataset')}
+    return {'success': bool(organization_ids) and organization_ids <= editable_organization_ids}
+
+
+def export_datarequests(context, data_dict):
+    # Only the editors and admins of the organization being exported
+    organization_id = data_dict.get('organization_id')
+    editable_organizations = h.organizations_available('create_dataset')
+    return {'success': bool(organization_id) and any(
+        organization_id in (org['id'], org['name']) for org in editable_organizations)}
+
+
 @auth_allow_anonymous_access
 def list_datarequests(context, data_dict):
     return {'success': True}
 
 
+def list_datarequest_changes(context, data_dict):
+    # Sysadmins, or the members of the organization whose changes are listed
+    organization_id = data_dict.get('organization_id')
+    readable_organizations = h.organizations_available('read')
+    return {'success': bool(organization_id) and any(
+        organization_id in (org['id'], org['name']) for org in readable_organizations)}
+
+
+def show_datarequest_stats(context, data_dict):
+    # Sysadmins, or the members of the organization whose statistics are shown
+    return list_datarequest_changes(context, data_dict)
+
+
 def delete_datarequest(context, data_dict):
     return auth_if_creator(context, data_dict, constants.SHOW_DATAREQUEST)
 
@@ -116,6 +150,11 @@ def list_datarequest_comments(context, data_dict):
     return show_datarequest(context, new_data_dict)
 
 
+@auth_allow_anonymous_access
+def list_datarequest_revisions(context, data_dict):
+    return show_datarequest(context, {'id': data_dict.get('id')})
+
+
 @auth_allow_anonymous_access
 def show_datarequest_comment(context, data_dict):
     return {'success': True}
@@ -2,7 +2,10 @@
 
 import click
 
-from . import db
+from ckan import model
+from ckan.plugins import toolkit as tk
+
+from . import actions, constants, db, export as datarequests_export, importer, search, sla
 
 # Click commands for CKAN 2.9 and above
 
@@ -29,5 +32,142 @@ def update_db():
     db.update_db()
 
 
+@datarequests.command()
+@click.option('--batch-size', default=actions.NOTIFICATION_BATCH_SIZE, show_default=True,
+              help='Number of notifications delivered per transaction.')
+def send_notifications(batch_size):
+    """ Deliver the data request notifications that are pending in the outbox.
+    This should be run periodically, eg from cron, to retry the notifications
+    that could not be delivered by the background workers.
+    """
+    total = 0
+    while True:
+        processed = actions.send_pending_notifications(batch_size=batch_size)
+        total += processed
+        if processed < batch_size:
+            break
+
+    click.echo('{0} notification(s) processed'.format(total))
+
+
+@datarequests.command()
+def rollup_stats():
+    """ Rebuild the daily counters read by show_datarequest_stats. This should
+    be run periodically, eg nightly from cron.
+    """
+    db.DataRequestStats.rollup()
+    model.Session.commit()
+    click.echo('Data request statistics updated')
+
+
+@datarequests.command()
+@click.option('--digest', is_flag=True, default=False,
+              help='Email the admins of every organization with overdue data requests a digest of them.')
+def sla_report(digest):
+    """ Compute the aging of the data requests waiting to be handled and cache
+    it in the summary table. This should be run periodically, eg nightly from
+    cron.
+    """
+    summary = sla.update_summary()
+
+    click.echo('organization,pending,0-7,8-30,31-90,90+,overdue,median_days_to_close')
+    for row in summary:
+        click.echo('{0},{1},{2},{3},{4},{5},{6},{7}'.format(
+            row.organization_id, row.pending, row.aged_0_7, row.aged_8_30, row.aged_31_90, row.aged_over_90,
+            row.overdue, '' if row.median_days_to_close is None else '{0:.1f}'.format(row.median_days_to_close)))
+
+    if digest:
+        click.echo('{0} digest(s) sent'.format(sla.send_digests(summary)))
+
+
+def _get_site_user_context():
+    site_user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
+    return {'model': model, 'session': model.Session, 'ignore_auth': True,
+            'user': site_user['name'], 'auth_user_obj': model.User.get(site_user['name'])}
+
+
+@datarequests.command()
+@click.argument('user_id')
+@click.option('--notify', is_flag=True, default=False,
+              help='Send the deletion notifications of the purged data requests.')
+def purge_user(user_id, notify):
+    """ Delete all the data requests of an account, with their comments
+    and followers. This is intended for cleanup of spam.
+    """
+    try:
+        result = tk.get_action(constants.PURGE_DATAREQUESTS)(
+            _get_site_user_context(), {'user_id': user_id, 'notify': notify})
+    except tk.ObjectNotFound as e:
+        raise click.ClickException(str(e))
+
+    click.echo('Deleted {datarequests} data request(s), {comments} comment(s) and {followers} follower(s)'.format(**result))
+
+
+@datarequests.command()
+@click.option('--format', 'output_format', type=click.Choice(sorted(datarequests_export.FORMATS)), default='csv',
+              show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='File to write to (stdout by default).')
+@click.option('--organization', 'organization_id', help='ID or name of the organization.')
+@click.option('--status', help='Status of the data requests.')
+@click.option('--state', help='State of the data requests (active by default).')
+@click.option('--opened-after', help='Only data requests opened on or after this date (yyyy-mm-dd).')
+@click.option('--opened-before', help='Only data requests opened before this date (yyyy-mm-dd).')
+def export(output_format, output, **filters):
+    """ Export data requests as CSV or JSON lines. Rows are streamed, so
+    exports of any size use a constant amount of memory.
+    """
+    data_dict = {key: value for key, value in filters.items() if value}
+    try:
+        datarequests = datarequests_export.iter_datarequests(_get_site_user_context(), data_dict)
+        for chunk in datarequests_export.serialize(datarequests, output_format):
+            output.write(chunk)
+    except (tk.ValidationError, tk.ObjectNotFound) as e:
+        raise click.ClickException(str(e))
+
+
+@datarequests.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'input_format', type=click.Choice(sorted(importer.FORMATS)), default='csv',
+              show_default=True)
+@click.option('--user', 'user_name', help='Account that opens the rows without a user_id (the site user by default).')
+@click.option('--notify', is_flag=True, default=False,
+              help='Send the creation notifications of the imported data requests.')
+@click.option('--batch-size', default=importer.BATCH_SIZE, show_default=True,
+              help='Number of rows validated and inserted per transaction.')
+@click.option('--errors', 'error_report', type=click.File('w'),
+              help='CSV file to write the rejected rows to (stderr by default).')
+def import_datarequests(source, input_format, user_name, notify, batch_size, error_report):
+    """ Import data requests from a CSV or JSON lines file. The columns are
+    the fields of create_datarequest, plus optional user_id and open_time.
+    """
+    context = _get_site_user_context()
+    user = model.User.get(user_name) if user_name else context['auth_user_obj']
+    if not user:
+        raise click.ClickException('User {0} not found'.format(user_name))
+
+    imported, failures = importer.import_datarequests(
+        context, importer.read_rows(source, input_format), user.id, notify=notify, batch_size=batch_size)
+
+    if failures:
+        importer.write_error_report(failures, error_report or click.get_text_stream('stderr'))
+
+    click.echo('Imported {0} data request(s), {1} row(s) rejected'.format(imported, len(failures)))
+
+
+@datarequests.command()
+@click.option('--batch-size', default=search.BATCH_SIZE, show_default=True,
+              help='Number of data requests sent to Solr at a time.')
+def rebuild_index(batch_size):
+    """ Index all the data requests in Solr again. This must be run once
+    after enabling ckanext.datarequests.solr, and can be run at any time to
+    repair the index.
+    """
+    if not search.is_enabled():
+        raise click.ClickException('Data request indexing is disabled (ckanext.datarequests.solr)')
+
+    total = search.rebuild_index(batch_size=batch_size)
+    click.echo('Indexed {0} data request(s)'.format(total))
+
+
 def get_commands():
     return [datarequests]
@@ -20,8 +20,12 @@
 DATAREQUESTS_MAIN_PATH = 'datarequest'
 CREATE_DATAREQUEST = 'create_datarequest'
 SHOW_DATAREQUEST = 'show_datarequest'
+SHOW_MANY_DATAREQUESTS = 'show_many_datarequests'
 UPDATE_DATAREQUEST = 'update_datarequest'
 LIST_DATAREQUESTS = 'list_datarequests'
+LIST_DATAREQUEST_CHANGES = 'list_datarequest_changes'
+LIST_DATAREQUEST_REVISIONS = 'list_datarequest_revisions'
+SHOW_DATAREQUEST_STATS = 'show_datarequest_stats'
 DELETE_DATAREQUEST = 'delete_datarequest'
 CLOSE_DATAREQUEST = 'close_datarequest'
 COMMENT_DATAREQUEST = 'comment_datarequest'
@@ -32,9 +36,21 @@ DELETE_DATAREQUEST_COMMENT = 'delete_datarequest_comment'
 FOLLOW_DATAREQUEST = 'follow_datarequest'
 UNFOLLOW_DATAREQUEST = 'unfollow_datarequest'
 PURGE_DATAREQUESTS = 'purge_datarequests'
+BULK_UPDATE_DATAREQUESTS_STATUS = 'bulk_update_datarequests_status'
+EXPORT_DATAREQUESTS = 'export_datarequests'
 NAME_MAX_LENGTH = 1000
 DESCRIPTION_MAX_LENGTH = 1000
 COMMENT_MAX_LENGTH = DESCRIPTION_MAX_LENGTH
 DATAREQUESTS_PER_PAGE = 10
+SHOW_MANY_DATAREQUESTS_MAX_IDS = 100
+DATAREQUEST_CHANGES_PER_PAGE = 100
+DATAREQUEST_CHANGES_MAX_PER_PAGE = 1000
+DATAREQUEST_REVISIONS_PER_PAGE = 20
+DATAREQUEST_REVISIONS_MAX_PER_PAGE = 100
+DATASET_AUTOCOMPLETE_LIMIT = 10
+DATASET_AUTOCOMPLETE_MAX_LIMIT = 50
+SIMILAR_DATAREQUESTS_LIMIT = 5
+DATAREQUEST_STATS_DAYS = 30
+DATAREQUEST_SLA_DAYS = 30
 CLOSE_CIRCUMSTANCE_MAX_LENGTH = 255
 MAX_LENGTH_255 = 255
@@ -12,7 +12,9 @@ from ckan.lib import helpers, captcha
 from ckan.plugins import toolkit as tk
 from ckan.plugins.toolkit import c, h, request, _, current_user
 
-from ckanext.datarequests import constants, request_helpers
+from flask import Response, jsonify, stream_with_context
+
+from ckanext.datarequests import constants, db, export, request_helpers
 
 _link = re.compile(r'(?:(https?://)|(www\.))(\S+\b/?)([!"#$%&\'()*+,\-./:;<=>?@[\\\]^_`{|}~]*)(\s|$)', re.I)
 
@@ -58,15 +60,20 @@ def _get_context():
             'user': c.user, 'auth_user_obj': c.userobj}
 
 
+# Query parameters passed to list_datarequests as filters, including the
+# facets, which filter the list with a parameter of the same name
+LIST_FILTERS = ['status', 'data_use_type', 'requesting_organisation', 'open_month', 'closed', 'opened_after',
+                'opened_before']
+
+
 def _show_index(user_id, organization_id, include_organization_facet, url_func, file_to_render, extra_vars=None):
-    def pager_url(status=None, sort=None, q=None, page=None):
+    def pager_url(filters=None, sort=None, q=None, page=None):
         params = []
 
         if q:
             params.append(('q', q))
 
-        if status is not None:
-            params.append(('status', status))
+        params.extend(filters or [])
 
         params.append(('sort', sort))
         params.append(('page', page))
@@ -78,11 +85,16 @@ def _show_index(user_id, organization_id, include_organization_facet, url_func,
         page = int(request_helpers.get_first_query_param('page', 1))
         limit = constants.DATAREQUESTS_PER_PAGE
         offset = (page - 1) * constants.DATAREQUESTS_PER_PAGE
-        data_dict = {'offset': offset, 'limit': limit}
+        # The list only displays the creator of each data request
+        data_dict = {'offset': offset, 'limit': limit, 'include_organization': False,
+                     'include_dataset': False, 'include_followers': False}
 
-        status = request_helpers.get_first_query_param('status', None)
-        if status:
-            data_dict['status'] = status
+        filters = []
+        for filter_name in LIST_FILTERS:
+            value = request_helpers.get_first_query_param(filter_name, None)
+            if value:
+                data_dict[filter_name] = value
+                filters.append((filter_name, value))
 
         q = request_helpers.get_first_query_param('q', '')
         if q:
@@ -106,14 +118,14 @@ def _show_index(user_id, organization_id, include_organization_facet, url_func,
         c.sort = sort
         c.q = q
         c.organization = organization_id
-        c.status = status
+        c.status = data_dict.get('status')
         c.datarequest_count = datarequests_list['count']
         c.datarequests = datarequests_list['result']
         c.search_facets = datarequests_list['facets']
         c.page = helpers.Page(
             collection=datarequests_list['result'],
             page=page,
-            url=functools.partial(pager_url, status, sort),
+            url=functools.partial(pager_url, filters, sort),
             item_count=datarequests_list['count'],
             items_per_page=limit
         )
@@ -125,6 +137,10 @@ def _show_index(user_id, organization_id, include_organization_facet, url_func,
         if include_organization_facet is True:
             c.facet_titles['organization'] = tk._('Organizations')
 
+        c.facet_titles['data_use_type'] = tk._('Data use type')
+        c.facet_titles['requesting_organisation'] = tk._('Requesting organisation')
+        c.facet_titles['open_month'] = tk._('Month opened')
+
         if not extra_vars:
             extra_vars = {}
         extra_vars['filters'] = c.filters
@@ -147,6 +163,9 @@ def _show_index(user_id, organization_id, include_organization_facet, url_func,
         # This exception should only occur if the page value is not valid
         log.warning(e)
         return tk.abort(400, tk._('"page" parameter must be an integer'))
+    except tk.ValidationError as e:
+        log.warning(e)
+        return tk.abort(400, tk._('Invalid filter: %s') % ', '.join(_get_errors_summary(e.error_dict).values()))
     except tk.NotAuthorized as e:
         log.warning(e)
         return tk.abort(403, tk._('Unauthorized to list Data Requests'))
@@ -157,6 +176,37 @@ def index():
                        'datarequests/index.html')
 
 
+def export_datarequests():
+    context = _get_context()
+
+    output_format = request_helpers.get_first_query_param('format', 'csv')
+    if output_format not in export.FORMATS:
+        return tk.abort(400, tk._('"format" parameter must be one of: %s') % ', '.join(export.FORMATS))
+
+    data_dict = {}
+    for field_name in ['organization_id', 'status', 'state', 'opened_after', 'opened_before']:
+        value = request_helpers.get_first_query_param(field_name, None)
+        if value:
+            data_dict[field_name] = value
+
+    try:
+        datarequests = export.iter_datarequests(context, data_dict)
+        return Response(
+            stream_with_context(export.serialize(datarequests, output_format)),
+            mimetype=export.FORMATS[output_format],
+            headers={'Content-Disposition': 'attachment; filename="datarequests.{0}"'.format(output_format)}
+        )
+    except tk.ValidationError as e:
+        log.warning(e)
+        return tk.abort(400, ', '.join(_get_errors_summary(e.error_dict).values()))
+    except tk.ObjectNotFound as e:
+        log.warning(e)
+        return tk.abort(404, tk._('Organization %s not found') % data_dict.get('organization_id'))
+    except tk.NotAuthorized as e:
+        log.warning(e)
+        return tk.abort(403, tk._('Unauthorized to export Data Requests'))
+
+
 def _process_post(action, context):
     # If the user has submitted the form, the data request must be created
     if request_helpers.get_post_params():
@@ -252,6 +302,41 @@ def new():
         return tk.abort(403, tk._('Unauthorized to create a Data Request'))
 
 
+def similar():
+    """ Returns the open data requests, visible to the user, for the dataset
+    being requested or with a similar title, so the user can find out whether
+    the data has already been requested before creating a new request.
+    """
+    context = _get_context()
+
+    try:
+        tk.check_access(constants.CREATE_DATAREQUEST, context, None)
+    except tk.NotAuthorized as e:
+        log.warning(e)
+        return tk.abort(403, tk._('Unauthorized to create a Data Request'))
+
+    requested_dataset = request_helpers.get_first_query_param('requested_dataset', '').strip()
+    title = request_helpers.get_first_query_param('title', '').strip()
+
+    # Same rules as show_datarequest: sysadmins, creators and the members of
+    # the organization of the data request can see it
+    organization_ids = None
+    if not current_user.sysadmin:
+        organization_ids = [org['id'] for org in h.organizations_available('read')]
+
+    datarequests = db.DataRequest.get_similar(requested_dataset=requested_dataset or None, title=title or None,
+                                              user_id=current_user.id, organization_ids=organization_ids,
+                                              limit=constants.SIMILAR_DATAREQUESTS_LIMIT)
+
+    return jsonify({'result': [{
+        'id': datarequest_id,
+        'title': datarequest_title,
+        'status': status,
+        'open_time': str(open_time),
+        'url': tk.url_for('datarequest.show', id=datarequest_id)
+    } for datarequest_id, datarequest_title, status, open_time in datarequests]})
+
+
 def show(id):
     data_dict = {'id': id}
     context = _get_context()
@@ -355,27 +440,10 @@ def close(id):
     def _return_page(errors=None, errors_summary=None):
         errors = errors or {}
         errors_summary = errors_summary or {}
-        # Get datasets (if the data req belongs to an organization,
-        # only the ones that belong to the organization are shown)
-        # FIXME: At this time, only the 500 last modified/created datasets are retrieved.
-        # We assume that a user will close their data request with a recently added or modified dataset
-        # In the future, we should fix this with an autocomplete form...
-        search_data_dict = {'rows': 500}
-        organization_id = c.datarequest.get('organization_id', '')
-        if organization_id:
-            log.debug("Loading datasets for organisation %s", organization_id)
-            search_data_dict['q'] = 'owner_org:' + organization_id
-        else:
-            # Expected for CKAN 2.3
-            log.debug("Loading first 500 datasets...")
-        base_datasets = tk.get_action('package_search')({'ignore_auth': True}, search_data_dict)['results']
-
-        log.debug("Dataset candidates for closing data request: %s", base_datasets)
-        c.datasets = []
+        # The datasets are retrieved by the form as the user types (see dataset_autocomplete)
         c.errors = errors
         c.errors_summary = errors_summary
-        for dataset in base_datasets:
-            c.datasets.append({'name': dataset.get('name'), 'title': dataset.get('title')})
+        c.accepted_dataset_id = request_helpers.get_first_post_param('accepted_dataset_id', '')
 
         if h.closing_circumstances_enabled:
             # This is required so the form can set the currently selected close_circumstance option in the select dropdown
@@ -416,6 +484,44 @@ def close(id):
         return tk.abort(403, tk._('You are not authorized to close the Data Request %s' % id))
 
 
+def dataset_autocomplete(id):
+    """ Returns the datasets of the organization of the data request whose
+    name or title start with the 'q' parameter, to pick the one that fulfils
+    the data request when closing it.
+    """
+    context = _get_context()
+    data_dict = {'id': id}
+
+    try:
+        tk.check_access(constants.CLOSE_DATAREQUEST, context, data_dict)
+        datarequest = tk.get_action(constants.SHOW_DATAREQUEST)(
+            context, {'id': id, 'fields': ['organization_id']})
+    except tk.ObjectNotFound as e:
+        log.warning(e)
+        return tk.abort(404, tk._('Data Request %s not found') % id)
+    except tk.NotAuthorized as e:
+        log.warning(e)
+        return tk.abort(403, tk._('You are not authorized to close the Data Request %s' % id))
+
+    q = request_helpers.get_first_query_param('q', '').strip()
+    try:
+        offset = max(int(request_helpers.get_first_query_param('offset', 0)), 0)
+        limit = min(max(int(request_helpers.get_first_query_param('limit', constants.DATASET_AUTOCOMPLETE_LIMIT)), 1),
+                    constants.DATASET_AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        return tk.abort(400, tk._('"offset" and "limit" parameters must be numbers'))
+
+    # Ask for one more dataset to know whether there are more pages
+    datasets = db.get_dataset_candidates(datarequest.get('organization_id'), q, offset, limit + 1)
+
+    return jsonify({
+        'ResultSet': {
+            'Result': [{'name': name, 'title': title or name} for name, title in datasets[:limit]]
+        },
+        'has_more': len(datasets) > limit
+    })
+
+
 def comment(id):
     try:
         context = _get_context()
@@ -17,15 +17,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import json
 import sqlalchemy as sa
 import uuid
 import logging
 
 from ckan import model
-from ckan.plugins.toolkit import current_user, h
+from ckan.plugins.toolkit import config, current_user, h
 from ckanext.datarequests import constants
 
 from sqlalchemy import func, MetaData, DDL
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import case
 from sqlalchemy.sql.expression import or_
 
@@ -44,47 +47,60 @@ class DataRequest(model.core.StatefulObjectMixin, model.DomainObject):
     def get(cls, **kw):
         '''Finds all the instances required.'''
         query = model.Session.query(cls).autoflush(False)
-        query = query.filter(or_(cls.state == model.core.State.ACTIVE, cls.state is None))
+        query = query.filter(cls.state == model.core.State.ACTIVE)
         return query.filter_by(**kw).all()
 
+    @classmethod
+    def get_by_id(cls, id):
+        '''Returns the data request with the given ID, whatever its state is'''
+        query = model.Session.query(cls).autoflush(False)
+        return query.filter_by(id=id).first()
+
     @classmethod
     def datarequest_exists(cls, title):
         '''Returns true if there is a Data Request with the same title (case insensitive)'''
         query = model.Session.query(cls).autoflush(False)
-        query = query.filter(or_(cls.state == model.core.State.ACTIVE, cls.state is None))
+        query = query.filter(cls.state == model.core.State.ACTIVE)
         return query.filter(func.lower(cls.title) == func.lower(title)).first() is not None
 
     @classmethod
-    def get_ordered_by_date(cls, organization_id=None, user_id=None, closed=None, q=None, desc=False, status=None, state=None):
-        '''Personalized query'''
-        query = model.Session.query(cls).autoflush(False)
+    def _filter_list_query(cls, query, organization_id=None, user_id=None, closed=None, q=None, status=None, state=None,
+                           data_use_type=None, requesting_organisation=None, opened_after=None, opened_before=None):
+        '''Applies the filters of the data request list, and the visibility rules of the current user'''
         if state is None:
-            query = query.filter(or_(cls.state == model.core.State.ACTIVE, cls.state is None))
+            query = query.filter(cls.state == model.core.State.ACTIVE)
         else:
-            query = query.filter_by(state=state)
-
-        params = {}
+            query = query.filter(cls.state == state)
 
         if organization_id is not None:
-            params['organization_id'] = organization_id
+            query = query.filter(cls.organization_id == organization_id)
 
         if user_id is not None:
-            params['user_id'] = user_id
+            query = query.filter(cls.user_id == user_id)
 
         if closed is not None:
-            params['closed'] = closed
+            # Rendered as a literal so the planner can match idx_datarequests_open_active
+            query = query.filter(cls.closed == (sa.true() if closed else sa.false()))
 
         if status is not None:
-            params['status'] = status
+            query = query.filter(cls.status == status)
+
+        if data_use_type is not None:
+            query = query.filter(cls.data_use_type == data_use_type)
+
+        if requesting_organisation is not None:
+            query = query.filter(cls.requesting_organisation == requesting_organisation)
+
+        if opened_after is not None:
+            query = query.filter(cls.open_time >= opened_after)
+
+        if opened_before is not None:
+            query = query.filter(cls.open_time < opened_before)
 
         if q is not None:
             search_expr = '%{0}%'.format(q)
             query = query.filter(or_(cls.title.ilike(search_expr), cls.description.ilike(search_expr)))
 
-        query = query.filter_by(**params)
-
-        order_by_filter = cls.open_time.desc() if desc else cls.open_time.asc()
-
         # For sysadmins, we show all the data requests.
         restricted_org_id = None
 
@@ -110,24 +126,311 @@ class DataRequest(model.core.StatefulObjectMixin, model.DomainObject):
                     # show the data requests created by the current user or all data request within selected organization.
                     query = query.filter(or_(cls.user_id == current_user.id, cls.organization_id == organization_id))
 
+        return query
+
+    @classmethod
+    def _get_page(cls, query, offset, limit, with_count=True):
+        '''
+        Returns the data requests of a page of the query and the number of
+        matches of the query, which is computed in the same execution by a
+        window function. The number is None when it is not requested or when
+        the page is past the end of the matches.
+        '''
+        if with_count:
+            query = query.add_columns(func.count(cls.id).over())
+
+        if offset:
+            query = query.offset(offset)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        rows = query.all()
+        if not with_count:
+            return rows, None
+
+        return [row[0] for row in rows], rows[0][1] if rows else None
+
+    @staticmethod
+    def _estimate_count(query):
+        '''
+        Returns the number of rows that the planner expects the query to
+        return, if it exceeds the ckanext.datarequests.count_estimate_threshold
+        setting. Otherwise (or if the estimation is disabled) returns None, so
+        the matches are counted.
+        '''
+        threshold = int(config.get('ckanext.datarequests.count_estimate_threshold', 0) or 0)
+        if threshold <= 0:
+            return None
+
+        try:
+            statement = query.statement.compile(dialect=model.Session.get_bind().dialect,
+                                                compile_kwargs={'render_postcompile': True})
+            with model.Session.begin_nested():
+                cursor = model.Session.connection().connection.cursor()
+                try:
+                    cursor.execute('EXPLAIN (FORMAT JSON) ' + str(statement), statement.params)
+                    plan = cursor.fetchone()[0]
+                finally:
+                    cursor.close()
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except Exception:
+            log.warning('Unable to estimate the number of data requests, counting them', exc_info=True)
+            return None
+
+        return estimate if estimate > threshold else None
+
+    @classmethod
+    def get_ordered_by_date(cls, desc=False, offset=0, limit=None, **filters):
+        '''
+        Returns a page of the data requests that match the filters (see
+        _filter_list_query), by opening time, and the number of matches. The
+        data requests of the current user come first.
+
+        The page and the number of matches are read by a single query, which
+        counts the matches with a window function. They are only counted
+        separately when the page is past the end of the matches. When the
+        planner expects more matches than the
+        ckanext.datarequests.count_estimate_threshold setting, its estimate is
+        returned instead, so counting never dominates the listing.
+        '''
+        query = cls._filter_list_query(model.Session.query(cls).autoflush(False), **filters)
+
+        order_by_filter = cls.open_time.desc() if desc else cls.open_time.asc()
+
+        estimate = cls._estimate_count(query)
+        with_count = estimate is None
+
+        # Pinned the datarequest to the top of the list if current user is the author.
         current_user_id = current_user.id if current_user else None
         if current_user_id:
-            # Pinned the datarequest to the top of the list if current user is the author.
-            current_user_order = case(
-                [(cls.user_id == current_user_id, 1)],
-                else_=0
-            ).label('current_user_order')
+            ordered = query.order_by(case([(cls.user_id == current_user_id, 0)], else_=1), order_by_filter)
+        else:
+            ordered = query.order_by(order_by_filter)
+
+        datarequests, total = cls._get_page(ordered, offset, limit, with_count)
+        if not with_count:
+            return datarequests, estimate
+        if total is None:
+            # The window function has nothing to count past the end of the matches
+            total = query.order_by(None).count() if offset else 0
+
+        return datarequests, total
+
+    @classmethod
+    def get_facet_counts(cls, facets, **filters):
+        '''
+        Returns the number of data requests that match the filters (see
+        _filter_list_query) for each value of the given facets, as a dict
+        {facet: {value: count}}. Months are returned as yyyy-mm.
+        '''
+        facet_counts = {}
+        for facet in facets:
+            column = LIST_FACET_COLUMNS[facet]
+            if facet == 'open_month':
+                column = func.date_trunc('month', column)
+
+            query = model.Session.query(column, func.count(cls.id)).autoflush(False)
+            query = cls._filter_list_query(query, **filters)
+            query = query.filter(column.isnot(None)).group_by(column)
+
+            counts = {}
+            for value, count in query:
+                if facet == 'open_month':
+                    value = value.strftime('%Y-%m')
+                if value:
+                    counts[value] = count
+            facet_counts[facet] = counts
+
+        return facet_counts
 
-            query = query.order_by(current_user_order.desc(), order_by_filter)
+    @classmethod
+    def get_for_export(cls, fields, organization_id=None, status=None, state=None, opened_after=None, opened_before=None,
+                       batch_size=1000):
+        '''
+        Returns the given fields of the matching data requests, ordered by
+        opening time. Rows are fetched batch_size at a time from a server side
+        cursor, so they are not loaded in memory all at once.
+        '''
+        table = datarequests_table
+        query = model.Session.query(*[table.c[field] for field in fields]).autoflush(False)
+
+        if state is None:
+            query = query.filter(table.c.state == model.core.State.ACTIVE)
         else:
-            query = query.order_by(order_by_filter)
+            query = query.filter(table.c.state == state)
 
-        return query.all()
+        if organization_id is not None:
+            query = query.filter(table.c.organization_id == organization_id)
+
+        if status is not None:
+            query = query.filter(table.c.status == status)
+
+        if opened_after is not None:
+            query = query.filter(table.c.open_time >= opened_after)
+
+        if opened_before is not None:
+            query = query.filter(table.c.open_time < opened_before)
+
+        return query.order_by(table.c.open_time.asc()).yield_per(batch_size)
+
+    @classmethod
+    def get_many(cls, ids, state=None):
+        '''Returns the data requests with the given IDs (active ones by default), in any order'''
+        query = model.Session.query(cls).autoflush(False)
+        if state is None:
+            query = query.filter(cls.state == model.core.State.ACTIVE)
+        else:
+            query = query.filter_by(state=state)
+        return query.filter(cls.id.in_(ids)).all()
+
+    @classmethod
+    def get_changes(cls, since=None, after=None, organization_id=None, limit=100):
+        '''
+        Returns the data requests modified since the given time, whatever their
+        state is, ordered by modification time and ID. after is the
+        (metadata_modified, id) of the last data request already seen.
+        '''
+        query = model.Session.query(cls).autoflush(False)
+
+        if since is not None:
+            query = query.filter(cls.metadata_modified >= since)
+
+        if after is not None:
+            query = query.filter(sa.tuple_(cls.metadata_modified, cls.id) > sa.tuple_(*after))
+
+        if organization_id is not None:
+            query = query.filter(cls.organization_id == organization_id)
+
+        return query.order_by(cls.metadata_modified.asc(), cls.id.asc()).limit(limit).all()
+
+    @classmethod
+    def get_similar(cls, requested_dataset=None, title=None, user_id=None, organization_ids=None, limit=5):
+        '''
+        Returns the (id, title, status, open_time) of the open data requests
+        for the same dataset or with a similar title, the ones for the same
+        dataset first. Titles are only compared when pg_trgm is available.
+        Unless organization_ids is None, only the data requests of those
+        organizations or created by user_id are returned.
+        '''
+        same_dataset = cls.requested_dataset == requested_dataset if requested_dataset else None
+        similar_title = cls.title.op('%')(title) if title and trigram_available() else None
+        conditions = [condition for condition in (same_dataset, similar_title) if condition is not None]
+        if not conditions:
+            return []
+
+        query = model.Session.query(cls.id, cls.title, cls.status, cls.open_time).autoflush(False).filter(
+            or_(*conditions),
+            cls.closed.is_(False),
+            cls.state == model.core.State.ACTIVE
+        )
+
+        if organization_ids is not None:
+            query = query.filter(or_(cls.user_id == user_id, cls.organization_id.in_(organization_ids)))
+
+        order_by = []
+        if same_dataset is not None:
+            order_by.append(case([(same_dataset, 0)], else_=1))
+        if similar_title is not None:
+            order_by.append(func.similarity(cls.title, title).desc())
+        order_by.append(cls.open_time.desc())
+
+        return query.order_by(*order_by).limit(limit).all()
+
+    @classmethod
+    def get_organization_ids(cls, ids):
+        '''Returns the organizations of the given data requests'''
+        query = model.Session.query(cls.organization_id).autoflush(False).filter(cls.id.in_(ids))
+        return {organization_id for (organization_id,) in query.distinct()}
+
+    @classmethod
+    def update_status(cls, ids, status):
+        '''
+        Sets the status of the given data requests with a single UPDATE. Returns
+        the (ID, previous status) of the data requests whose status has
+        actually changed.
+        '''
+        table = datarequests_table
+        # The previous values are read, and locked, by the same statement
+        previous = sa.select([table.c.id, table.c.status]).where(
+            table.c.id.in_(ids)
+        ).where(
+            table.c.state == model.core.State.ACTIVE
+        ).where(
+            or_(table.c.status != status, table.c.status.is_(None))
+        ).with_for_update().alias('previous')
+
+        statement = table.update().where(
+            table.c.id == previous.c.id
+        ).values(status=status).returning(table.c.id, previous.c.status)
+
+        return [(datarequest_id, previous_status) for (datarequest_id, previous_status) in model.Session.execute(statement)]
+
+    @classmethod
+    def close(cls, id, **values):
+        '''
+        Closes the data request with a single UPDATE, setting the given values,
+        unless it is already closed. Returns the closed data request, read from
+        the updated row, and the previous values of the updated fields as a
+        dict, or (None, None) if there is no open data request with the ID.
+        '''
+        table = datarequests_table
+        fields = ['closed'] + list(values)
+        # The previous values are read, and locked, by the same statement
+        previous = sa.select([table.c.id] + [table.c[field] for field in fields]).where(
+            table.c.id == id
+        ).where(
+            table.c.state == model.core.State.ACTIVE
+        ).where(
+            table.c.closed == sa.false()
+        ).with_for_update().alias('previous')
+
+        statement = table.update().where(
+            table.c.id == previous.c.id
+        ).values(closed=True, **values).returning(
+            *(list(table.c) + [previous.c[field].label('previous_' + field) for field in fields]))
+
+        row = model.Session.execute(statement).first()
+        if row is None:
+            return None, None
+
+        return row, {field: row['previous_' + field] for field in fields}
+
+    @classmethod
+    def purge_by_user(cls, user_id):
+        '''
+        Soft deletes all the data requests of the user with a single UPDATE and
+        removes their comments and followers. Returns the IDs of the deleted
+        data requests, the number of comments removed and the IDs of the
+        followers removed from every data request, so they can still be
+        notified of the deletion.
+        '''
+        table = datarequests_table
+        statement = table.update().where(
+            table.c.user_id == user_id
+        ).where(
+            table.c.state == model.core.State.ACTIVE
+        ).values(state=model.core.State.DELETED).returning(table.c.id)
+        deleted_ids = [datarequest_id for (datarequest_id,) in model.Session.execute(statement)]
+
+        user_datarequests = sa.select([table.c.id]).where(table.c.user_id == user_id)
+        comments = model.Session.execute(
+            comments_table.delete().where(comments_table.c.datarequest_id.in_(user_datarequests)))
+        followers = {}
+        removed_followers = model.Session.execute(
+            followers_table.delete().where(followers_table.c.datarequest_id.in_(user_datarequests)).returning(
+                followers_table.c.datarequest_id, followers_table.c.user_id))
+        for datarequest_id, follower_id in removed_followers:
+            followers.setdefault(datarequest_id, []).append(follower_id)
+
+        return deleted_ids, comments.rowcount, followers
 
     @classmethod
     def get_open_datarequests_number(cls):
         '''Returns the number of data requests that are open'''
-        return model.Session.query(func.count(cls.id)).filter_by(closed=False).filter(or_(cls.state == model.core.State.ACTIVE, cls.state is None)).scalar()
+        return model.Session.query(func.count(cls.id)).filter_by(closed=False).filter(cls.state == model.core.State.ACTIVE).scalar()
 
 
 class Comment(model.DomainObject):
@@ -168,6 +471,295 @@ class DataRequestFollower(model.DomainObject):
         '''
         return model.Session.query(func.count(cls.id)).filter_by(**kw).scalar()
 
+    @classmethod
+    def get_datarequests_followers_numbers(cls, datarequest_ids):
+        '''
+        Returns a dict with the number of followers of each of the given data
+        requests, counted with a single query. Data requests without followers
+        are not included.
+        '''
+        query = model.Session.query(cls.datarequest_id, func.count(cls.id)).filter(
+            cls.datarequest_id.in_(datarequest_ids)).group_by(cls.datarequest_id)
+        return dict(query)
+
+    @classmethod
+    def follow(cls, datarequest_id, user_id, time):
+        '''
+        Adds the user to the followers of the data request with a single
+        INSERT, which does nothing if the user is already following it.
+        Returns whether the follower has been added.
+        '''
+        statement = postgresql.insert(followers_table).values(
+            id=uuid4(), datarequest_id=datarequest_id, user_id=user_id, time=time
+        ).on_conflict_do_nothing(index_elements=['datarequest_id', 'user_id'])
+        return model.Session.execute(statement).rowcount > 0
+
+    @classmethod
+    def unfollow(cls, datarequest_id, user_id):
+        '''
+        Removes the user from the followers of the data request with a single
+        DELETE. Returns whether the user was following it.
+        '''
+        table = followers_table
+        statement = table.delete().where(
+            table.c.datarequest_id == datarequest_id
+        ).where(
+            table.c.user_id == user_id
+        ).returning(table.c.id)
+        return model.Session.execute(statement).first() is not None
+
+
+class DataRequestRevision(model.DomainObject):
+
+    @classmethod
+    def get(cls, **kw):
+        '''Finds all the instances required.'''
+        query = model.Session.query(cls).autoflush(False)
+        return query.filter_by(**kw).all()
+
+    @classmethod
+    def get_datarequest_revisions(cls, datarequest_id, offset=0, limit=None):
+        '''
+        Returns the revisions of a data request, newest first, and the total
+        number of revisions
+        '''
+        query = model.Session.query(cls).autoflush(False).filter_by(datarequest_id=datarequest_id)
+        count = query.count()
+        revisions = query.order_by(cls.created.desc(), cls.id.desc()).offset(offset).limit(limit).all()
+        return revisions, count
+
+
+class DataRequestNotification(model.DomainObject):
+
+    @classmethod
+    def get(cls, **kw):
+        '''Finds all the instances required.'''
+        query = model.Session.query(cls).autoflush(False)
+        return query.filter_by(**kw).all()
+
+    @classmethod
+    def get_pending(cls, ids=None, max_attempts=None, limit=None):
+        '''
+        Returns the notifications that are due to be delivered, locking them so
+        concurrent workers skip the rows that are already being processed
+        '''
+        query = model.Session.query(cls).autoflush(False)
+        query = query.filter(cls.sent_time.is_(None), cls.next_attempt_time <= datetime.datetime.utcnow())
+
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+
+        if max_attempts is not None:
+            query = query.filter(cls.attempts < max_attempts)
+
+        query = query.order_by(cls.created.asc()).with_for_update(skip_locked=True)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return query.all()
+
+
+class DataRequestStats(model.DomainObject):
+
+    @classmethod
+    def _get_rollup_source(cls, time_column, opened, closed):
+        # Data requests by day, organization and status of the given time
+        table = datarequests_table
+        day = sa.cast(time_column, sa.Date)
+        return sa.select([
+            day.label('day'),
+            func.coalesce(table.c.organization_id, u'').label('organization_id'),
+            func.coalesce(table.c.status, u'').label('status'),
+            sa.literal(opened).label('opened'),
+            sa.literal(closed).label('closed'),
+        ]).where(sa.and_(
+            time_column.isnot(None),
+            table.c.state == model.core.State.ACTIVE
+        ))
+
+    @classmethod
+    def rollup(cls):
+        '''
+        Rebuilds the daily counters from the data requests, in the current
+        transaction: the number of data requests opened and closed every day,
+        by organization and current status, and the number of days it took
+        to close them.
+        '''
+        table = datarequests_table
+        events = sa.union_all(
+            cls._get_rollup_source(table.c.open_time, 1, 0),
+            cls._get_rollup_source(table.c.close_time, 0, 1).where(table.c.closed.is_(True))
+        ).alias('events')
+        daily = sa.select([
+            events.c.day, events.c.organization_id, events.c.status,
+            func.sum(events.c.opened), func.sum(events.c.closed)
+        ]).group_by(events.c.day, events.c.organization_id, events.c.status)
+
+        close_day = sa.cast(table.c.close_time, sa.Date)
+        days_to_close = (close_day - sa.cast(table.c.open_time, sa.Date)).label('days_to_close')
+        organization_id = func.coalesce(table.c.organization_id, u'')
+        close_days = sa.select([
+            close_day, organization_id, days_to_close, func.count(table.c.id)
+        ]).where(sa.and_(
+            table.c.closed.is_(True),
+            table.c.open_time.isnot(None),
+            table.c.close_time.isnot(None),
+            table.c.state == model.core.State.ACTIVE
+        )).group_by(close_day, organization_id, days_to_close)
+
+        session = model.Session
+        session.execute(stats_table.delete())
+        session.execute(stats_table.insert().from_select(
+            ['day', 'organization_id', 'status', 'opened', 'closed'], daily))
+        session.execute(close_stats_table.delete())
+        session.execute(close_stats_table.insert().from_select(
+            ['day', 'organization_id', 'days_to_close', 'closed'], close_days))
+
+    @classmethod
+    def _filter_stats_query(cls, query, table, organization_id=None, since=None, until=None):
+        if organization_id is not None:
+            query = query.filter(table.c.organization_id == organization_id)
+
+        if since is not None:
+            query = query.filter(table.c.day >= since)
+
+        if until is not None:
+            query = query.filter(table.c.day <= until)
+
+        return query
+
+    @classmethod
+    def get_daily(cls, organization_id=None, since=None, until=None):
+        '''
+        Returns the (day, organization ID, status, opened, closed) counters
+        between the given days (both included), ordered by day
+        '''
+        table = stats_table
+        query = model.Session.query(table.c.day, table.c.organization_id, table.c.status,
+                                    table.c.opened, table.c.closed).autoflush(False)
+        query = cls._filter_stats_query(query, table, organization_id, since, until)
+        return query.order_by(table.c.day, table.c.organization_id, table.c.status).all()
+
+    @classmethod
+    def get_close_days(cls, organization_id=None, since=None, until=None):
+        '''
+        Returns how many of the data requests closed between the given days
+        took each number of days to close, as (days to close, count) ordered
+        by days to close
+        '''
+        table = close_stats_table
+        query = model.Session.query(table.c.days_to_close, func.sum(table.c.closed)).autoflush(False)
+        query = cls._filter_stats_query(query, table, organization_id, since, until)
+        return query.group_by(table.c.days_to_close).order_by(table.c.days_to_close).all()
+
+
+class DataRequestSLASummary(model.DomainObject):
+
+    @classmethod
+    def refresh(cls, statuses, sla_days, now=None):
+        '''
+        Replaces the cached summary, in the current transaction, with the
+        figures of every organization computed in a single query: how many
+        open data requests in the given statuses have been waiting for 0-7,
+        8-30, 31-90 and more than 90 days, how many are past the SLA, the
+        oldest one and the median number of days it took to close the
+        closed ones.
+        '''
+        now = now or datetime.datetime.utcnow()
+        table = datarequests_table
+        pending = sa.and_(table.c.closed.isnot(True), table.c.status.in_(statuses))
+
+        def opened_days_ago(days):
+            return now - datetime.timedelta(days=days)
+
+        def aged(min_days, max_days=None):
+            condition = sa.and_(pending, table.c.open_time <= opened_days_ago(min_days))
+            if max_days is not None:
+                condition = sa.and_(condition, table.c.open_time > opened_days_ago(max_days + 1))
+            return func.count(table.c.id).filter(condition)
+
+        days_to_close = case(
+            [(table.c.closed.is_(True), func.date_part('epoch', table.c.close_time - table.c.open_time) / 86400.0)],
+            else_=None
+        )
+        organization_id = func.coalesce(table.c.organization_id, u'')
+
+        summary = sa.select([
+            organization_id,
+            func.count(table.c.id).filter(pending),
+            aged(0, 7),
+            aged(8, 30),
+            aged(31, 90),
+            aged(91),
+            func.count(table.c.id).filter(sa.and_(pending, table.c.open_time <= opened_days_ago(sla_days))),
+            func.min(table.c.open_time).filter(pending),
+            func.percentile_cont(0.5).within_group(days_to_close),
+            sa.literal(now, sa.types.DateTime),
+        ]).where(
+            table.c.state == model.core.State.ACTIVE
+        ).group_by(organization_id)
+
+        session = model.Session
+        session.execute(sla_summary_table.delete())
+        session.execute(sla_summary_table.insert().from_select(
+            ['organization_id', 'pending', 'aged_0_7', 'aged_8_30', 'aged_31_90', 'aged_over_90', 'overdue',
+             'oldest_open_time', 'median_days_to_close', 'updated'], summary))
+
+    @classmethod
+    def get_summary(cls, organization_id=None):
+        '''Returns the cached summary of every organization, or the given one'''
+        query = model.Session.query(cls).autoflush(False)
+        if organization_id is not None:
+            query = query.filter(cls.organization_id == organization_id)
+        return query.order_by(cls.overdue.desc(), cls.organization_id).all()
+
+    @classmethod
+    def get_overdue(cls, organization_id, statuses, opened_before, limit=None):
+        '''Returns the open data requests of an organization in the given statuses opened before a time, oldest first'''
+        query = model.Session.query(DataRequest).autoflush(False).filter(
+            DataRequest.state == model.core.State.ACTIVE,
+            DataRequest.closed.isnot(True),
+            DataRequest.status.in_(statuses),
+            DataRequest.open_time <= opened_before,
+            func.coalesce(DataRequest.organization_id, u'') == organization_id
+        )
+        return query.order_by(DataRequest.open_time.asc()).limit(limit).all()
+
+
+_trigram_available = None
+
+
+def trigram_available():
+    '''Returns whether the pg_trgm extension is installed, checking it once'''
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = model.Session.execute(
+            sa.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    return _trigram_available
+
+
+def get_dataset_candidates(organization_id=None, q='', offset=0, limit=10):
+    '''
+    Returns the (name, title) of the active datasets whose name or title start
+    with q, ordered by title. Used to pick the dataset that fulfils a data
+    request, so only the datasets of its organization are considered.
+    '''
+    query = model.Session.query(model.Package.name, model.Package.title).autoflush(False).filter(
+        model.Package.state == model.core.State.ACTIVE,
+        model.Package.type == 'dataset'
+    )
+
+    if organization_id:
+        query = query.filter(model.Package.owner_org == organization_id)
+
+    if q:
+        prefix = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(or_(model.Package.name.ilike(prefix, escape='\\'),
+                                 model.Package.title.ilike(prefix, escape='\\')))
+
+    return query.order_by(model.Package.title, model.Package.name).offset(offset).limit(limit).all()
+
 
 closing_circumstances_enabled = common.get_config_bool_value('ckan.datarequests.enable_closing_circumstances', False)
 
@@ -175,7 +767,7 @@ closing_circumstances_enabled = common.get_config_bool_value('ckan.datarequests.
 datarequests_table = sa.Table('datarequests', model.meta.metadata,
                               sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
                               sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
-                              sa.Column('title', sa.types.Unicode(constants.NAME_MAX_LENGTH), primary_key=True, default=u''),
+                              sa.Column('title', sa.types.Unicode(constants.NAME_MAX_LENGTH), primary_key=False, default=u''),
                               sa.Column('description', sa.types.Unicode(constants.DESCRIPTION_MAX_LENGTH), primary_key=False, default=u''),
                               sa.Column('organization_id', sa.types.UnicodeText, primary_key=False, default=None),
                               sa.Column('open_time', sa.types.DateTime, primary_key=False, default=None),
@@ -192,35 +784,158 @@ datarequests_table = sa.Table('datarequests', model.meta.metadata,
                               sa.Column('data_outputs_description', sa.types.Unicode(constants.DESCRIPTION_MAX_LENGTH), primary_key=False, default=u''),
                               sa.Column('status', sa.types.Unicode(constants.MAX_LENGTH_255), primary_key=False, default=u'Assigned'),
                               sa.Column('requested_dataset', sa.types.Unicode(constants.MAX_LENGTH_255), primary_key=False, default=u''),
-                              sa.Column('state', sa.types.UnicodeText, default=model.core.State.ACTIVE),
+                              sa.Column('state', sa.types.UnicodeText, nullable=False, default=model.core.State.ACTIVE,
+                                        server_default=model.core.State.ACTIVE),
+                              sa.Column('metadata_modified', sa.types.DateTime, primary_key=False,
+                                        default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow),
                               extend_existing=True
                               )
 
+# Columns whose values are counted in the facets of the data request list
+LIST_FACET_COLUMNS = {
+    'organization': datarequests_table.c.organization_id,
+    'status': datarequests_table.c.status,
+    'data_use_type': datarequests_table.c.data_use_type,
+    'requesting_organisation': datarequests_table.c.requesting_organisation,
+    'open_month': datarequests_table.c.open_time,
+}
+
+# The facets of the data request list are counted grouping by these columns
+sa.Index('idx_datarequests_data_use_type', datarequests_table.c.data_use_type)
+sa.Index('idx_datarequests_requesting_organisation', datarequests_table.c.requesting_organisation)
+sa.Index('idx_datarequests_open_time', datarequests_table.c.open_time)
+
+# The data requests of the current user are listed first, by opening time
+sa.Index('idx_datarequests_user_open_time', datarequests_table.c.user_id, datarequests_table.c.open_time)
+
+# Most listings only show the open data requests, so keep them apart from the closed history
+sa.Index('idx_datarequests_open_active', datarequests_table.c.open_time,
+         postgresql_where=sa.and_(datarequests_table.c.closed == sa.false(),
+                                  datarequests_table.c.state == model.core.State.ACTIVE))
+
+# The change feed pages through the data requests in modification order
+sa.Index('idx_datarequests_metadata_modified', datarequests_table.c.metadata_modified, datarequests_table.c.id)
+
+# Similar requests are looked up by requested dataset as the new request form is filled
+sa.Index('idx_datarequests_requested_dataset', datarequests_table.c.requested_dataset)
+
 model.meta.mapper(DataRequest, datarequests_table)
 
-# FIXME: References to the other tables...
+# The comments and the followers are removed together with their data request
 comments_table = sa.Table('datarequests_comments', model.meta.metadata,
                           sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
                           sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
-                          sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=True, default=uuid4),
-                          sa.Column('time', sa.types.DateTime, primary_key=True, default=u''),
+                          sa.Column('datarequest_id', sa.types.UnicodeText,
+                                    sa.ForeignKey('datarequests.id', ondelete='CASCADE'), nullable=False),
+                          sa.Column('time', sa.types.DateTime, primary_key=False, default=u''),
                           sa.Column('comment', sa.types.Unicode(constants.COMMENT_MAX_LENGTH), primary_key=False, default=u''),
                           extend_existing=True
                           )
 
+# The comments of a data request are listed by time
+sa.Index('idx_datarequests_comments_datarequest', comments_table.c.datarequest_id, comments_table.c.time)
+
 model.meta.mapper(Comment, comments_table,)
 
-# FIXME: References to the other tables...
 followers_table = sa.Table('datarequests_followers', model.meta.metadata,
                            sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
                            sa.Column('user_id', sa.types.UnicodeText, primary_key=False, default=u''),
-                           sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=True, default=uuid4),
-                           sa.Column('time', sa.types.DateTime, primary_key=True, default=u''),
+                           sa.Column('datarequest_id', sa.types.UnicodeText,
+                                     sa.ForeignKey('datarequests.id', ondelete='CASCADE'), nullable=False),
+                           sa.Column('time', sa.types.DateTime, primary_key=False, default=u''),
                            extend_existing=True
                            )
 
+# A user follows a data request once at most
+sa.Index('idx_datarequests_followers_datarequest_user', followers_table.c.datarequest_id, followers_table.c.user_id,
+         unique=True)
+
 model.meta.mapper(DataRequestFollower, followers_table,)
 
+# Append only log of the fields changed by every update of a data request,
+# stored as a JSON object {field: [old value, new value]}
+revisions_table = sa.Table('datarequests_revisions', model.meta.metadata,
+                           sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
+                           sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=False, default=u''),
+                           sa.Column('actor_id', sa.types.UnicodeText, primary_key=False, default=None),
+                           sa.Column('created', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+                           sa.Column('changes', sa.types.UnicodeText, primary_key=False, default=u'{}'),
+                           extend_existing=True
+                           )
+
+sa.Index('idx_datarequests_revisions_datarequest', revisions_table.c.datarequest_id, revisions_table.c.created)
+
+model.meta.mapper(DataRequestRevision, revisions_table,)
+
+# Notifications are written in the same transaction as the data request change
+# and delivered afterwards by a background job or the send-notifications command
+notifications_table = sa.Table('datarequests_notifications', model.meta.metadata,
+                               sa.Column('id', sa.types.UnicodeText, primary_key=True, default=uuid4),
+                               sa.Column('action_type', sa.types.UnicodeText, primary_key=False, default=u''),
+                               sa.Column('datarequest_id', sa.types.UnicodeText, primary_key=False, default=u''),
+                               sa.Column('comment_id', sa.types.UnicodeText, primary_key=False, default=None),
+                               sa.Column('actor_id', sa.types.UnicodeText, primary_key=False, default=None),
+                               sa.Column('job_title', sa.types.UnicodeText, primary_key=False, default=None),
+                               sa.Column('created', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+                               sa.Column('next_attempt_time', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+                               sa.Column('attempts', sa.types.Integer, primary_key=False, default=0),
+                               sa.Column('sent_time', sa.types.DateTime, primary_key=False, default=None),
+                               sa.Column('delivered', sa.types.UnicodeText, primary_key=False, default=u''),
+                               sa.Column('last_error', sa.types.UnicodeText, primary_key=False, default=None),
+                               # Followers to notify, one ID per line, when they are no longer stored
+                               # with the data request. NULL to notify the current followers
+                               sa.Column('follower_ids', sa.types.UnicodeText, primary_key=False, default=None),
+                               extend_existing=True
+                               )
+
+# Only undelivered notifications are looked up, so keep the index small
+sa.Index('idx_datarequests_notifications_pending', notifications_table.c.next_attempt_time,
+         postgresql_where=notifications_table.c.sent_time.is_(None))
+
+model.meta.mapper(DataRequestNotification, notifications_table,)
+
+# Daily counters rolled up from the data requests by the rollup-stats command,
+# so the statistics do not depend on the number of data requests.
+# Data requests without organization are counted under ''
+stats_table = sa.Table('datarequests_daily_stats', model.meta.metadata,
+                       sa.Column('day', sa.types.Date, primary_key=True),
+                       sa.Column('organization_id', sa.types.UnicodeText, primary_key=True, default=u''),
+                       sa.Column('status', sa.types.Unicode(constants.MAX_LENGTH_255), primary_key=True, default=u''),
+                       sa.Column('opened', sa.types.Integer, primary_key=False, default=0),
+                       sa.Column('closed', sa.types.Integer, primary_key=False, default=0),
+                       extend_existing=True
+                       )
+
+model.meta.mapper(DataRequestStats, stats_table,)
+
+# Number of data requests closed every day by the days it took to close them,
+# to compute the median time to close
+close_stats_table = sa.Table('datarequests_daily_close_stats', model.meta.metadata,
+                             sa.Column('day', sa.types.Date, primary_key=True),
+                             sa.Column('organization_id', sa.types.UnicodeText, primary_key=True, default=u''),
+                             sa.Column('days_to_close', sa.types.Integer, primary_key=True),
+                             sa.Column('closed', sa.types.Integer, primary_key=False, default=0),
+                             extend_existing=True
+                             )
+
+# Aging of the open data requests of every organization, cached by the
+# sla-report command. Data requests without organization are counted under ''
+sla_summary_table = sa.Table('datarequests_sla_summary', model.meta.metadata,
+                             sa.Column('organization_id', sa.types.UnicodeText, primary_key=True, default=u''),
+                             sa.Column('pending', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('aged_0_7', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('aged_8_30', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('aged_31_90', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('aged_over_90', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('overdue', sa.types.Integer, primary_key=False, default=0),
+                             sa.Column('oldest_open_time', sa.types.DateTime, primary_key=False, default=None),
+                             sa.Column('median_days_to_close', sa.types.Float, primary_key=False, default=None),
+                             sa.Column('updated', sa.types.DateTime, primary_key=False, default=datetime.datetime.utcnow),
+                             extend_existing=True
+                             )
+
+model.meta.mapper(DataRequestSLASummary, sla_summary_table,)
+
 
 def init_db(deprecated_model=None):
 
@@ -235,6 +950,81 @@ def init_db(deprecated_model=None):
     # Create the table only if it does not exist
     followers_table.create(checkfirst=True)
 
+    # Create the table only if it does not exist
+    notifications_table.create(checkfirst=True)
+
+    # Create the table only if it does not exist
+    revisions_table.create(checkfirst=True)
+
+    # Create the tables only if they do not exist
+    stats_table.create(checkfirst=True)
+    close_stats_table.create(checkfirst=True)
+    sla_summary_table.create(checkfirst=True)
+
+
+def _create_title_trigram_index():
+    '''
+    Similar titles are only suggested when pg_trgm is available, since
+    creating the extension may require privileges CKAN does not have.
+    '''
+    try:
+        DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_title_trgm" ON "datarequests" USING gin ("title" gin_trgm_ops)').execute(model.Session.get_bind())
+    except sa.exc.SQLAlchemyError as e:
+        log.warning("DataRequests-UpdateDB: unable to create the title trigram index, similar titles will not be suggested: %s", e)
+
+
+def _use_id_primary_key(inspector, table_name):
+    '''Older tables have a composite primary key, only the ID is needed'''
+    primary_key = inspector.get_pk_constraint(table_name)
+    if primary_key.get('constrained_columns') == ['id']:
+        return
+
+    log.info("DataRequests-UpdateDB: '%s' primary key is not the id, changing...", table_name)
+    if primary_key.get('name'):
+        DDL('ALTER TABLE "{0}" DROP CONSTRAINT "{1}"'.format(table_name, primary_key['name'])).execute(model.Session.get_bind())
+    DDL('ALTER TABLE "{0}" ADD PRIMARY KEY ("id")'.format(table_name)).execute(model.Session.get_bind())
+
+
+def _add_datarequest_foreign_key(inspector, table_name):
+    '''
+    References the data request from the rows of the table, so they are
+    removed with it. The rows of the data requests that no longer exist are
+    removed first.
+    '''
+    if any(foreign_key['referred_table'] == 'datarequests' for foreign_key in inspector.get_foreign_keys(table_name)):
+        return
+
+    log.info("DataRequests-UpdateDB: '%s' does not reference the data requests, adding the foreign key...", table_name)
+    DDL('DELETE FROM "{0}" WHERE NOT EXISTS (SELECT 1 FROM "datarequests" WHERE "datarequests"."id" = "{0}"."datarequest_id")'
+        .format(table_name)).execute(model.Session.get_bind())
+    DDL('ALTER TABLE "{0}" ADD CONSTRAINT "{0}_datarequest_id_fkey" FOREIGN KEY ("datarequest_id") '
+        'REFERENCES "datarequests" ("id") ON DELETE CASCADE'.format(table_name)).execute(model.Session.get_bind())
+
+
+def _require_datarequest_id(inspector, table_name):
+    '''Older rows may not reference any data request, they are removed'''
+    if not any(column['name'] == 'datarequest_id' and column['nullable'] for column in inspector.get_columns(table_name)):
+        return
+
+    log.info("DataRequests-UpdateDB: '%s' datarequest_id field is nullable, removing the rows without it and making it required...", table_name)
+    DDL('DELETE FROM "{0}" WHERE "datarequest_id" IS NULL'.format(table_name)).execute(model.Session.get_bind())
+    DDL('ALTER TABLE "{0}" ALTER COLUMN "datarequest_id" SET NOT NULL'.format(table_name)).execute(model.Session.get_bind())
+
+
+def _add_unique_follower_index(inspector):
+    '''Older tables may have the same follower twice, only the first one is kept'''
+    if any(index['name'] == 'idx_datarequests_followers_datarequest_user' for index in inspector.get_indexes('datarequests_followers')):
+        return
+
+    log.info("DataRequests-UpdateDB: followers are not unique, removing the duplicated ones and adding the unique index...")
+    DDL('DELETE FROM "datarequests_followers" duplicated USING "datarequests_followers" first '
+        'WHERE duplicated."datarequest_id" = first."datarequest_id" AND duplicated."user_id" = first."user_id" '
+        'AND (duplicated."time", duplicated."id") > (first."time", first."id")').execute(model.Session.get_bind())
+    DDL('CREATE UNIQUE INDEX IF NOT EXISTS "idx_datarequests_followers_datarequest_user" '
+        'ON "datarequests_followers" ("datarequest_id", "user_id")').execute(model.Session.get_bind())
+    DDL('DROP INDEX IF EXISTS "idx_datarequests_followers_datarequest"').execute(model.Session.get_bind())
+
 
 def update_db(deprecated_model=None):
     '''
@@ -296,4 +1086,45 @@ def update_db(deprecated_model=None):
 
         if 'state' not in meta.tables['datarequests'].columns:
             log.info("DataRequests-UpdateDB: 'state' field does not exist, adding...")
-            DDL('ALTER TABLE "datarequests" ADD COLUMN "state" text COLLATE pg_catalog."default";').execute(model.Session.get_bind())
+            DDL('ALTER TABLE "datarequests" ADD COLUMN "state" text COLLATE pg_catalog."default" NOT NULL DEFAULT \'active\';').execute(model.Session.get_bind())
+        elif meta.tables['datarequests'].columns['state'].nullable:
+            # Older data requests have no state, they are active
+            log.info("DataRequests-UpdateDB: 'state' field is nullable, setting the missing states and making it required...")
+            DDL('UPDATE "datarequests" SET "state" = \'active\' WHERE "state" IS NULL').execute(model.Session.get_bind())
+            DDL('ALTER TABLE "datarequests" ALTER COLUMN "state" SET DEFAULT \'active\'').execute(model.Session.get_bind())
+            DDL('ALTER TABLE "datarequests" ALTER COLUMN "state" SET NOT NULL').execute(model.Session.get_bind())
+
+        if 'metadata_modified' not in meta.tables['datarequests'].columns:
+            log.info("DataRequests-UpdateDB: 'metadata_modified' field does not exist, adding...")
+            DDL('ALTER TABLE "datarequests" ADD COLUMN "metadata_modified" timestamp NULL').execute(model.Session.get_bind())
+            DDL('UPDATE "datarequests" SET "metadata_modified" = COALESCE("close_time", "open_time", now() at time zone \'utc\')').execute(model.Session.get_bind())
+            DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_metadata_modified" ON "datarequests" ("metadata_modified", "id")').execute(model.Session.get_bind())
+
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_requested_dataset" ON "datarequests" ("requested_dataset")').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_data_use_type" ON "datarequests" ("data_use_type")').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_requesting_organisation" ON "datarequests" ("requesting_organisation")').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_open_time" ON "datarequests" ("open_time")').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_user_open_time" ON "datarequests" ("user_id", "open_time")').execute(model.Session.get_bind())
+        DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_open_active" ON "datarequests" ("open_time") '
+            'WHERE "closed" = false AND "state" = \'active\'').execute(model.Session.get_bind())
+        _create_title_trigram_index()
+
+        inspector = sa.inspect(model.Session.get_bind())
+        _use_id_primary_key(inspector, 'datarequests')
+
+        if 'datarequests_comments' in meta.tables:
+            _use_id_primary_key(inspector, 'datarequests_comments')
+            _add_datarequest_foreign_key(inspector, 'datarequests_comments')
+            _require_datarequest_id(inspector, 'datarequests_comments')
+            DDL('CREATE INDEX IF NOT EXISTS "idx_datarequests_comments_datarequest" ON "datarequests_comments" ("datarequest_id", "time")').execute(model.Session.get_bind())
+
+        if 'datarequests_followers' in meta.tables:
+            _use_id_primary_key(inspector, 'datarequests_followers')
+            _add_datarequest_foreign_key(inspector, 'datarequests_followers')
+            _require_datarequest_id(inspector, 'datarequests_followers')
+            _add_unique_follower_index(inspector)
+
+    if 'datarequests_notifications' in meta.tables:
+        if 'follower_ids' not in meta.tables['datarequests_notifications'].columns:
+            log.info("DataRequests-UpdateDB: 'follower_ids' field does not exist in the notifications, adding...")
+            DDL('ALTER TABLE "datarequests_notifications" ADD COLUMN "follower_ids" text NULL').execute(model.Session.get_bind())
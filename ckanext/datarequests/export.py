@@ -0,0 +1,107 @@
+# encoding: utf-8
+""" Streaming export of data requests.
+
+Rows are read from a server side cursor and serialized as soon as they are
+fetched, so the memory used does not depend on the number of data requests
+exported.
+"""
+
+import csv
+import datetime
+import io
+import json
+
+from ckan import model
+from ckan.plugins import toolkit as tk
+
+from . import constants, db, validator
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Rows fetched from the database at a time
+BATCH_SIZE = 1000
+
+FIELDS = [
+    'id', 'user_id', 'title', 'description', 'organization_id', 'open_time', 'accepted_dataset_id',
+    'close_time', 'closed', 'data_use_type', 'who_will_access_this_data', 'requesting_organisation',
+    'data_storage_environment', 'data_outputs_type', 'data_outputs_description', 'status',
+    'requested_dataset', 'state', 'metadata_modified'
+]
+
+CLOSING_CIRCUMSTANCES_FIELDS = ['close_circumstance', 'approx_publishing_date']
+
+
+def get_fields():
+    if db.closing_circumstances_enabled:
+        return FIELDS + CLOSING_CIRCUMSTANCES_FIELDS
+    return FIELDS
+
+
+def iter_datarequests(context, data_dict):
+    """ Checks the access rights and the filters, then returns an iterator
+    over the matching data requests (as dicts), ordered by opening time.
+
+    :param organization_id: The ID or name of the organization (optional)
+    :param status: The status of the data requests (optional)
+    :param state: The state of the data requests (active by default)
+    :param opened_after: Only data requests opened on or after this date
+    :param opened_before: Only data requests opened before this date
+    """
+    tk.check_access(constants.EXPORT_DATAREQUESTS, context, data_dict)
+
+    organization_id = data_dict.get('organization_id') or None
+    if organization_id:
+        # Get organization ID (organization name is received sometimes)
+        organization = model.Group.get(organization_id)
+        if not organization:
+            raise tk.ObjectNotFound(tk._('Organization %s not found') % organization_id)
+        organization_id = organization.id
+
+    dates = validator.validate_date_filters(context, data_dict)
+    fields = get_fields()
+    rows = db.DataRequest.get_for_export(fields, organization_id=organization_id,
+                                         status=data_dict.get('status') or None,
+                                         state=data_dict.get('state') or None,
+                                         opened_after=dates['opened_after'],
+                                         opened_before=dates['opened_before'],
+                                         batch_size=BATCH_SIZE)
+
+    return (dict(zip(fields, row)) for row in rows)
+
+
+def _serialize_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def to_csv(datarequests, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+
+    writer.writeheader()
+    for datarequest in datarequests:
+        writer.writerow({key: _serialize_value(value) for key, value in datarequest.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Only the header is pending when there are no data requests
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_jsonl(datarequests):
+    for datarequest in datarequests:
+        yield json.dumps({key: _serialize_value(value) for key, value in datarequest.items()}) + '\n'
+
+
+def serialize(datarequests, output_format):
+    """ Returns an iterator over the chunks of text of the export.
+    """
+    if output_format == 'jsonl':
+        return to_jsonl(datarequests)
+    return to_csv(datarequests, get_fields())
@@ -0,0 +1,34 @@
+jQuery(document).ready(function () {
+
+  var container = jQuery('#similar-datarequests');
+  if (!container.length) {
+    return;
+  }
+
+  // The requested dataset and the title cannot be edited in the form, so the
+  // suggestions are only asked for once
+  function search() {
+    var query = jQuery.param({
+      requested_dataset: jQuery('input[name="requested_dataset"]').val() || '',
+      title: jQuery('#field-title').val() || ''
+    });
+
+    jQuery.getJSON(container.data('source') + '?' + query, function (data) {
+      render(data.result || []);
+    });
+  }
+
+  function render(datarequests) {
+    var list = container.find('ul').empty();
+    jQuery.each(datarequests, function (index, datarequest) {
+      jQuery('<li>')
+        .append(jQuery('<a>').attr('href', datarequest.url).text(datarequest.title))
+        .append(document.createTextNode(' (' + datarequest.status + ')'))
+        .appendTo(list);
+    });
+    container.toggle(datarequests.length > 0);
+  }
+
+  search();
+
+});
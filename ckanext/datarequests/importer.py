@@ -0,0 +1,239 @@
+# encoding: utf-8
+""" Bulk import of data requests, eg from a legacy request tracker.
+
+Rows are processed in batches. The datasets, organizations and accounts
+referenced by a batch are resolved with one query each, and the valid rows
+are stored with a single multi-row INSERT, so the cost of an import depends
+on the number of batches rather than the number of rows.
+"""
+
+import csv
+import datetime
+import itertools
+import json
+import logging
+
+from ckan import model
+from sqlalchemy import or_
+
+from . import actions, db, export, search, validator
+
+log = logging.getLogger(__name__)
+
+FORMATS = export.FORMATS
+
+# Rows validated and inserted per transaction
+BATCH_SIZE = 1000
+
+DATAREQUEST_FIELDS = [
+    'title', 'description', 'organization_id', 'data_use_type', 'who_will_access_this_data',
+    'requesting_organisation', 'data_storage_environment', 'data_outputs_type', 'data_outputs_description',
+    'status', 'requested_dataset'
+]
+
+FIELDS = DATAREQUEST_FIELDS + ['user_id', 'open_time']
+
+
+def read_rows(source, input_format):
+    """ Returns an iterator over the (line number, row) of the file. The row
+    is None if the line cannot be parsed.
+    """
+    if input_format == 'jsonl':
+        return _read_jsonl(source)
+    return _read_csv(source)
+
+
+def _read_csv(source):
+    reader = csv.DictReader(source)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _read_jsonl(source):
+    for line_number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def _add_error(errors, field_name, message):
+    errors.setdefault(field_name, []).append(message)
+
+
+def _clean_row(row):
+    # Empty values are treated as missing, so the defaults apply to them
+    cleaned = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if value is None:
+            continue
+        value = str(value).strip()
+        if value:
+            cleaned[field] = value
+    return cleaned
+
+
+def _resolve_packages(references):
+    packages = {}
+    if references:
+        query = model.Session.query(
+            model.Package.id, model.Package.name, model.Package.title, model.Package.owner_org
+        ).filter(
+            or_(model.Package.id.in_(references), model.Package.name.in_(references)),
+            model.Package.state == model.State.ACTIVE
+        )
+        for package_id, name, title, owner_org in query:
+            packages[package_id] = packages[name] = (title, owner_org)
+    return packages
+
+
+def _resolve_organizations(references):
+    organizations = {}
+    if references:
+        query = model.Session.query(model.Group.id, model.Group.name).filter(
+            or_(model.Group.id.in_(references), model.Group.name.in_(references)),
+            model.Group.is_organization.is_(True),
+            model.Group.state == model.State.ACTIVE
+        )
+        for organization_id, name in query:
+            organizations[organization_id] = organizations[name] = organization_id
+    return organizations
+
+
+def _resolve_users(references):
+    users = {}
+    if references:
+        query = model.Session.query(model.User.id, model.User.name).filter(
+            or_(model.User.id.in_(references), model.User.name.in_(references)),
+            model.User.state == model.State.ACTIVE
+        )
+        for user_id, name in query:
+            users[user_id] = users[name] = user_id
+    return users
+
+
+def _validate_batch(context, batch, default_user_id):
+    """ Validates a batch of (line number, row). Returns the records to insert
+    and the (line number, errors) of the invalid rows.
+    """
+    rows = [(line_number, _clean_row(row) if row is not None else None) for line_number, row in batch]
+    parsed = [row for _, row in rows if row is not None]
+
+    packages = _resolve_packages({row['requested_dataset'] for row in parsed if 'requested_dataset' in row})
+    # Rows without organization take the one of their dataset
+    organization_references = {owner_org for _, owner_org in packages.values() if owner_org}
+    organization_references.update(
+        row[field] for row in parsed for field in ('organization_id', 'requesting_organisation') if field in row)
+    organizations = _resolve_organizations(organization_references)
+    users = _resolve_users({row['user_id'] for row in parsed if 'user_id' in row})
+
+    now = datetime.datetime.utcnow()
+    records = []
+    failures = []
+    for line_number, row in rows:
+        if row is None:
+            failures.append((line_number, {'Row': ['Unable to parse the row']}))
+            continue
+
+        errors = {}
+        default_title = ''
+        default_org_id = ''
+
+        requested_dataset = row.get('requested_dataset')
+        if not requested_dataset:
+            _add_error(errors, 'Requested dataset', 'Requested dataset cannot be empty')
+        elif requested_dataset not in packages:
+            _add_error(errors, 'Requested dataset', 'Requested dataset not found')
+        else:
+            default_title, default_org_id = packages[requested_dataset]
+
+        validator.validate_datarequest_fields(context, row, errors, default_title, default_org_id or '',
+                                              organizations.__contains__)
+
+        user_id = default_user_id
+        if 'user_id' in row:
+            user_id = users.get(row['user_id'])
+            if not user_id:
+                _add_error(errors, 'User', 'User not found')
+
+        open_time = now
+        if 'open_time' in row:
+            try:
+                open_time = datetime.datetime.fromisoformat(row['open_time'])
+            except ValueError:
+                _add_error(errors, 'Open time', 'Open time must be a date in ISO 8601 format')
+
+        if errors:
+            failures.append((line_number, errors))
+            continue
+
+        record = {field: row.get(field, u'') for field in DATAREQUEST_FIELDS}
+        record.update({
+            'id': db.uuid4(),
+            'user_id': user_id,
+            'open_time': open_time,
+            'organization_id': organizations[row['organization_id']],
+            'requesting_organisation': organizations[row['requesting_organisation']],
+            'closed': False,
+            'state': model.State.ACTIVE,
+        })
+        records.append(record)
+
+    return records, failures
+
+
+def import_datarequests(context, rows, default_user_id, notify=False, batch_size=BATCH_SIZE):
+    """ Imports the given (line number, row) into the database. Every batch
+    is committed on its own, so the rows imported before a failure are kept.
+
+    :param default_user_id: The ID of the account that opens the data requests
+        without a user_id
+    :param notify: Whether the creation notifications should be sent
+    :returns: The number of data requests imported and the (line number,
+        errors) of the rows that were not
+    :rtype: tuple
+    """
+    session = context['session']
+    rows = iter(rows)
+    imported = 0
+    failures = []
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+
+        records, batch_failures = _validate_batch(context, batch, default_user_id)
+        failures.extend(batch_failures)
+        if not records:
+            continue
+
+        session.execute(db.datarequests_table.insert(), records)
+
+        notification_ids = []
+        if notify:
+            notification_ids = actions._queue_notifications(
+                session, 'new_datarequest', [record['id'] for record in records],
+                'Data Request Created Email', context)
+
+        session.commit()
+        actions._dispatch_notifications(notification_ids, 'Data Request Created Email')
+        search.update_index([record['id'] for record in records])
+
+        imported += len(records)
+        log.info("Imported %s data request(s), %s row(s) rejected so far", imported, len(failures))
+
+    return imported, failures
+
+
+def write_error_report(failures, output):
+    writer = csv.writer(output)
+    writer.writerow(['line', 'field', 'error'])
+    for line_number, errors in failures:
+        for field, messages in errors.items():
+            for message in messages:
+                writer.writerow([line_number, field, message])
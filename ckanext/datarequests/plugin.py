@@ -59,13 +59,18 @@ class DataRequestsPlugin(MixinPlugin, p.SingletonPlugin):
         additional_actions = {
             constants.CREATE_DATAREQUEST: actions.create_datarequest,
             constants.SHOW_DATAREQUEST: actions.show_datarequest,
+            constants.SHOW_MANY_DATAREQUESTS: actions.show_many_datarequests,
             constants.UPDATE_DATAREQUEST: actions.update_datarequest,
             constants.LIST_DATAREQUESTS: actions.list_datarequests,
+            constants.LIST_DATAREQUEST_CHANGES: actions.list_datarequest_changes,
+            constants.LIST_DATAREQUEST_REVISIONS: actions.list_datarequest_revisions,
+            constants.SHOW_DATAREQUEST_STATS: actions.show_datarequest_stats,
             constants.DELETE_DATAREQUEST: actions.delete_datarequest,
             constants.CLOSE_DATAREQUEST: actions.close_datarequest,
             constants.FOLLOW_DATAREQUEST: actions.follow_datarequest,
             constants.UNFOLLOW_DATAREQUEST: actions.unfollow_datarequest,
             constants.PURGE_DATAREQUESTS: actions.purge_datarequests,
+            constants.BULK_UPDATE_DATAREQUESTS_STATUS: actions.bulk_update_datarequests_status,
         }
 
         if self.comments_enabled:
@@ -85,13 +90,20 @@ class DataRequestsPlugin(MixinPlugin, p.SingletonPlugin):
         auth_functions = {
             constants.CREATE_DATAREQUEST: auth.create_datarequest,
             constants.SHOW_DATAREQUEST: auth.show_datarequest,
+            constants.SHOW_MANY_DATAREQUESTS: auth.show_many_datarequests,
             constants.UPDATE_DATAREQUEST: auth.update_datarequest,
             constants.LIST_DATAREQUESTS: auth.list_datarequests,
+            constants.LIST_DATAREQUEST_CHANGES: auth.list_datarequest_changes,
+            constants.LIST_DATAREQUEST_REVISIONS: auth.list_datarequest_revisions,
+            constants.SHOW_DATAREQUEST_STATS: auth.show_datarequest_stats,
             constants.DELETE_DATAREQUEST: auth.delete_datarequest,
             constants.CLOSE_DATAREQUEST: auth.close_datarequest,
             constants.FOLLOW_DATAREQUEST: auth.follow_datarequest,
             constants.UNFOLLOW_DATAREQUEST: auth.unfollow_datarequest,
             constants.PURGE_DATAREQUESTS: auth.purge_datarequests,
+            constants.BULK_UPDATE_DATAREQUESTS_STATUS: auth.bulk_update_datarequests_status,
+            # Exports are streamed by the export view and command, not returned by an action
+            constants.EXPORT_DATAREQUESTS: auth.export_datarequests,
         }
 
         if self.comments_enabled:
@@ -24,12 +24,24 @@ class MixinPlugin(p.SingletonPlugin):
                 controller_functions.index,
                 ('GET',),
             ),
+            (
+                "/{}/export".format(constants.DATAREQUESTS_MAIN_PATH),
+                "export",
+                controller_functions.export_datarequests,
+                ('GET',),
+            ),
             (
                 "/{}/new".format(constants.DATAREQUESTS_MAIN_PATH),
                 "new",
                 controller_functions.new,
                 ('GET', 'POST',),
             ),
+            (
+                "/{}/similar".format(constants.DATAREQUESTS_MAIN_PATH),
+                "similar",
+                controller_functions.similar,
+                ('GET',),
+            ),
             (
                 "/{}/<id>".format(constants.DATAREQUESTS_MAIN_PATH),
                 "show",
@@ -54,6 +66,12 @@ class MixinPlugin(p.SingletonPlugin):
                 controller_functions.close,
                 ('GET', 'POST',),
             ),
+            (
+                "/{}/close/<id>/datasets".format(constants.DATAREQUESTS_MAIN_PATH),
+                "dataset_autocomplete",
+                controller_functions.dataset_autocomplete,
+                ('GET',),
+            ),
             (
                 "/{}/follow/<id>".format(constants.DATAREQUESTS_MAIN_PATH),
                 "follow",
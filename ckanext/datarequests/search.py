@@ -0,0 +1,216 @@
+# encoding: utf-8
+""" Indexing of data requests in the Solr core used by CKAN for datasets.
+
+Data requests are stored as documents with their own entity_type, so they
+never show up in dataset searches. The data request fields are indexed in
+the dr_* dynamic fields of the CKAN schema, which are not stored: searches
+only return the IDs of the matching data requests, which are then read from
+the database.
+
+Indexing is disabled by default. Once 'ckanext.datarequests.solr' is
+enabled, the index must be filled with 'ckan datarequests rebuild-index'.
+"""
+
+import hashlib
+import logging
+
+from ckan import model
+from ckan.plugins import toolkit as tk
+
+from . import db
+
+log = logging.getLogger(__name__)
+
+ENTITY_TYPE = 'datarequest'
+
+# Data requests read from the database and sent to Solr at a time
+BATCH_SIZE = 1000
+
+# Solr facet fields for the facets of list_datarequests
+FACET_FIELDS = {
+    'organization': 'dr_organization_id',
+    'status': 'dr_status',
+    'data_use_type': 'dr_data_use_type',
+    'requesting_organisation': 'dr_requesting_organisation',
+    'open_month': 'dr_open_month',
+}
+
+# Free text searches look for the terms in these fields
+TEXT_FIELDS = [
+    'title', 'description', 'data_use_type', 'who_will_access_this_data', 'data_storage_environment',
+    'data_outputs_type', 'data_outputs_description'
+]
+
+
+def is_enabled():
+    return tk.asbool(tk.config.get('ckanext.datarequests.solr', False))
+
+
+def _make_connection():
+    from ckan.lib.search.common import make_connection
+    return make_connection()
+
+
+def _get_site_id():
+    return tk.config.get('ckan.site_id')
+
+
+def _literal(value):
+    return u'"{0}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _solr_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ') if value else None
+
+
+def to_document(datarequest):
+    site_id = _get_site_id()
+    document = {
+        'id': datarequest.id,
+        'index_id': hashlib.md5(u'{0}{1}{2}'.format(ENTITY_TYPE, datarequest.id, site_id).encode('utf-8')).hexdigest(),
+        'site_id': site_id,
+        'entity_type': ENTITY_TYPE,
+        'name': datarequest.id,
+        'title': datarequest.title,
+        'text': [getattr(datarequest, field) for field in TEXT_FIELDS if getattr(datarequest, field, None)],
+        'metadata_created': _solr_date(datarequest.open_time),
+        'metadata_modified': _solr_date(datarequest.metadata_modified),
+        'dr_user_id': datarequest.user_id,
+        'dr_organization_id': datarequest.organization_id,
+        'dr_requesting_organisation': datarequest.requesting_organisation,
+        'dr_requested_dataset': datarequest.requested_dataset,
+        'dr_data_use_type': datarequest.data_use_type,
+        'dr_open_month': datarequest.open_time.strftime('%Y-%m') if datarequest.open_time else None,
+        'dr_status': datarequest.status,
+        'dr_closed': 'true' if datarequest.closed else 'false',
+        'dr_state': datarequest.state,
+    }
+    return {key: value for key, value in document.items() if value not in (None, '', [])}
+
+
+def index_datarequests(datarequests, commit=True):
+    documents = [to_document(datarequest) for datarequest in datarequests]
+    if documents:
+        _make_connection().add(documents, commit=commit)
+    return len(documents)
+
+
+def _entity_query(ids=None):
+    query = u'+entity_type:{0} +site_id:{1}'.format(ENTITY_TYPE, _literal(_get_site_id()))
+    if ids is not None:
+        query += u' +id:({0})'.format(' OR '.join(_literal(datarequest_id) for datarequest_id in ids))
+    return query
+
+
+def update_index(ids):
+    """ Indexes the given data requests again after they have been written.
+    The ones that no longer exist in the database are removed from the index.
+
+    Indexing problems are logged instead of raised, since the changes have
+    already been committed. rebuild-index fixes any inconsistency.
+    """
+    ids = list(set(ids))
+    if not ids or not is_enabled():
+        return
+
+    try:
+        datarequests = model.Session.query(db.DataRequest).autoflush(False).filter(
+            db.DataRequest.id.in_(ids)).all()
+        index_datarequests(datarequests, commit=False)
+
+        removed_ids = set(ids) - {datarequest.id for datarequest in datarequests}
+        connection = _make_connection()
+        if removed_ids:
+            connection.delete(q=_entity_query(removed_ids), commit=False)
+        connection.commit(softCommit=True)
+    except Exception:
+        log.exception("Unable to index the data requests %s", ids)
+
+
+def rebuild_index(batch_size=BATCH_SIZE):
+    """ Removes every data request from the index and indexes them all again.
+    Returns the number of data requests indexed.
+    """
+    connection = _make_connection()
+    connection.delete(q=_entity_query(), commit=False)
+
+    total = 0
+    batch = []
+    query = model.Session.query(db.DataRequest).autoflush(False).order_by(db.DataRequest.id)
+    for datarequest in query.yield_per(batch_size):
+        batch.append(datarequest)
+        if len(batch) >= batch_size:
+            total += index_datarequests(batch, commit=False)
+            batch = []
+    total += index_datarequests(batch, commit=False)
+
+    connection.commit()
+    return total
+
+
+def search_datarequests(q=None, organization_id=None, user_id=None, closed=None, status=None, state=None,
+                        data_use_type=None, requesting_organisation=None, opened_after=None, opened_before=None,
+                        desc=False, offset=0, limit=10, visible_to=None, pinned_user_id=None):
+    """ Searches the data requests with the same filters as
+    DataRequest.get_ordered_by_date.
+
+    :param visible_to: (user ID, organization IDs) whose data requests are
+        the only ones returned, or None to return them all
+    :param pinned_user_id: The data requests of this user are returned first
+    :returns: The IDs of the matching data requests in the requested page,
+        the total number of matches and the counts of every facet
+    :rtype: tuple
+    """
+    filters = [_entity_query(), u'+dr_state:{0}'.format(_literal(state or model.State.ACTIVE))]
+
+    if organization_id is not None:
+        filters.append(u'+dr_organization_id:{0}'.format(_literal(organization_id)))
+    if user_id is not None:
+        filters.append(u'+dr_user_id:{0}'.format(_literal(user_id)))
+    if closed is not None:
+        filters.append(u'+dr_closed:{0}'.format('true' if closed else 'false'))
+    if status is not None:
+        filters.append(u'+dr_status:{0}'.format(_literal(status)))
+    if data_use_type is not None:
+        filters.append(u'+dr_data_use_type:{0}'.format(_literal(data_use_type)))
+    if requesting_organisation is not None:
+        filters.append(u'+dr_requesting_organisation:{0}'.format(_literal(requesting_organisation)))
+    if opened_after is not None or opened_before is not None:
+        filters.append(u'+metadata_created:[{0} TO {1}}}'.format(
+            _solr_date(opened_after) or '*', _solr_date(opened_before) or '*'))
+
+    if visible_to is not None:
+        visible_user_id, visible_organization_ids = visible_to
+        conditions = [u'dr_user_id:{0}'.format(_literal(visible_user_id))]
+        if visible_organization_ids:
+            conditions.append(u'dr_organization_id:({0})'.format(
+                ' OR '.join(_literal(org_id) for org_id in visible_organization_ids)))
+        filters.append(u'+({0})'.format(' OR '.join(conditions)))
+
+    sort = u'metadata_created {0}'.format('desc' if desc else 'asc')
+    if pinned_user_id:
+        sort = u'termfreq(dr_user_id,{0}) desc, {1}'.format(_literal(pinned_user_id), sort)
+
+    params = {
+        'fq': filters,
+        'fl': 'id',
+        'sort': sort,
+        'start': offset,
+        'rows': limit,
+        'facet': 'true',
+        'facet.field': list(FACET_FIELDS.values()),
+        'facet.mincount': 1,
+        'facet.limit': -1,
+    }
+    if q:
+        params.update({'defType': 'edismax', 'qf': 'title^2 text', 'q.op': 'AND'})
+
+    results = _make_connection().search(q or '*:*', **params)
+
+    facet_counts = {}
+    solr_facets = results.facets.get('facet_fields', {})
+    for facet, field in FACET_FIELDS.items():
+        values = solr_facets.get(field, [])
+        facet_counts[facet] = dict(zip(values[::2], values[1::2]))
+
+    return [document['id'] for document in results.docs], results.hits, facet_counts
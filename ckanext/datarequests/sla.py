@@ -0,0 +1,95 @@
+# encoding: utf-8
+""" Aging report of the data requests waiting to be handled.
+
+The figures of every organization are computed with a single query and
+cached in a summary table by the sla-report command, which should be run
+periodically (eg nightly from cron). Optionally, the admins of the
+organizations with data requests past the SLA get one digest each.
+"""
+
+import datetime
+import logging
+
+from ckan import model
+from ckan.lib import mailer
+from ckan.plugins import toolkit as tk
+
+from . import actions, constants, db
+
+log = logging.getLogger(__name__)
+
+# Statuses of the data requests that are waiting to be handled
+SLA_STATUSES = ['Assigned', 'Processing']
+
+# Overdue data requests listed in every digest
+DIGEST_MAX_DATAREQUESTS = 20
+
+
+def get_sla_days():
+    return tk.asint(tk.config.get('ckanext.datarequests.sla_days', constants.DATAREQUEST_SLA_DAYS))
+
+
+def update_summary(now=None):
+    """ Computes the aging of the open data requests again and replaces the
+    cached summary. Returns the new summary.
+    """
+    db.DataRequestSLASummary.refresh(SLA_STATUSES, get_sla_days(), now=now)
+    model.Session.commit()
+    return db.DataRequestSLASummary.get_summary()
+
+
+def _get_admin_recipients(organization_id):
+    organization = tk.get_action('organization_show')(
+        {'ignore_auth': True}, {'id': organization_id, 'include_users': True})
+
+    recipients = []
+    for member in organization.get('users', []):
+        if member.get('capacity') != 'admin':
+            continue
+        user = actions._get_user(member['id'], keep_email=True)
+        if user and user.get('email'):
+            recipients.append({'email': user['email'], 'name': user.get('display_name') or user['name']})
+
+    return organization, recipients
+
+
+def send_digests(summary, now=None):
+    """ Emails the admins of every organization with overdue data requests a
+    digest of them. Returns the number of emails sent.
+    """
+    sla_days = get_sla_days()
+    opened_before = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=sla_days)
+    sent = 0
+
+    for row in summary:
+        if not row.overdue or not row.organization_id:
+            continue
+
+        try:
+            organization, recipients = _get_admin_recipients(row.organization_id)
+        except tk.ObjectNotFound:
+            log.warning("Organization %s not found, skipping its SLA digest", row.organization_id)
+            continue
+
+        datarequests = db.DataRequestSLASummary.get_overdue(
+            row.organization_id, SLA_STATUSES, opened_before, limit=DIGEST_MAX_DATAREQUESTS)
+
+        for recipient in recipients:
+            extra_vars = {
+                'organization': organization,
+                'summary': row,
+                'datarequests': datarequests,
+                'sla_days': sla_days,
+                'user': recipient,
+                'site_title': tk.config.get('ckan.site_title'),
+                'site_url': tk.config.get('ckan.site_url')
+            }
+            try:
+                subject = tk.render('emails/subjects/sla_digest.txt', extra_vars)
+                body = tk.render('emails/bodies/sla_digest.txt', extra_vars)
+                mailer.mail_recipient(recipient['name'], recipient['email'], subject, body)
+                sent += 1
+            except Exception:
+                log.exception("Error sending the SLA digest of %s to %s", row.organization_id, recipient['email'])
+
+    return sent
@@ -19,9 +19,10 @@
 
 from ckanext.datarequests import actions, constants
 import datetime
+import json
 import unittest
 
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 from parameterized import parameterized
 
 from . import test_actions_data as test_data
@@ -43,10 +44,17 @@ class ActionsTest(unittest.TestCase):
 
         self._validator = actions.validator
         actions.validator = MagicMock()
+        actions.validator.validate_open_month.return_value = (None, None)
+        actions.validator.validate_date_filters.return_value = {'opened_after': None, 'opened_before': None}
+        actions.validator.validate_closed_filter.side_effect = self._validator.validate_closed_filter
 
         self._datetime = actions.datetime
         actions.datetime = MagicMock()
 
+        self._search = actions.search
+        actions.search = MagicMock()
+        actions.search.is_enabled.return_value = False
+
         self.context = {
             'user': 'example_usr',
             'auth_user_obj': MagicMock(),
@@ -60,6 +68,7 @@ class ActionsTest(unittest.TestCase):
         actions.db = self._db
         actions.validator = self._validator
         actions.datetime = self._datetime
+        actions.search = self._search
 
     def _check_comment(self, comment, response, user):
         assert comment.id == response['id']
@@ -288,6 +297,95 @@ class ActionsTest(unittest.TestCase):
         toolkit_mock.render.assert_any_call('emails/bodies/{0}.txt'.format(action_type), extra_args)
         toolkit_mock.enqueue_job.assert_any_call(mailer_mock.mail_user, [user, subject, body], title=None)
 
+    ######################################################################
+    ############################ NOTIFICATIONS ###########################
+    ######################################################################
+
+    def test_queue_notification(self):
+        session = self.context['session']
+
+        notification = actions._queue_notification(session, 'new_datarequest', 'dr1', 'TITLE', self.context, 'c1')
+
+        assert actions.db.DataRequestNotification.return_value == notification
+        session.add.assert_called_once_with(notification)
+        session.commit.assert_not_called()
+        assert 'new_datarequest' == notification.action_type
+        assert 'dr1' == notification.datarequest_id
+        assert 'c1' == notification.comment_id
+        assert self.context['auth_user_obj'].id == notification.actor_id
+        assert 0 == notification.attempts
+
+    def test_dispatch_notifications_enqueue_error_not_risen(self):
+        actions.tk.enqueue_job.side_effect = Exception()
+
+        actions._dispatch_notifications(['n1', 'n2'], 'TITLE')
+
+        actions.tk.enqueue_job.assert_called_once_with(actions.send_pending_notifications, [['n1', 'n2']],
+                                                       title='TITLE')
+
+    @parameterized.expand([
+        (True,),
+        (False,)
+    ])
+    @patch('ckanext.datarequests.actions.model')
+    @patch('ckanext.datarequests.actions._dictize_datarequest')
+    @patch('ckanext.datarequests.actions._send_mail')
+    def test_send_pending_notifications(self, sent, send_mail_mock, dictize_mock, model_mock):
+        current_time = self._datetime.datetime.utcnow()
+        actions.datetime.datetime.utcnow = MagicMock(return_value=current_time)
+        actions.datetime.timedelta = self._datetime.timedelta
+        actions.tk.asint = int
+        send_mail_mock.return_value = sent
+
+        notification = MagicMock(comment_id=None, attempts=1, delivered=u'a@example.com', sent_time=None,
+                                 follower_ids=None)
+        actions.db.DataRequestNotification.get_pending.return_value = [notification]
+
+        result = actions.send_pending_notifications(['n1'], batch_size=10)
+
+        assert 1 == result
+        actions.db.DataRequestNotification.get_pending.assert_called_once_with(
+            ids=['n1'], max_attempts=actions.NOTIFICATION_MAX_ATTEMPTS, limit=10)
+        send_mail_mock.assert_called_once()
+        assert {'a@example.com'} == send_mail_mock.call_args[0][5]
+        # The current followers are notified
+        self.assertIsNone(send_mail_mock.call_args[0][6])
+        assert 2 == notification.attempts
+        model_mock.Session.commit.assert_called_once_with()
+
+        if sent:
+            assert current_time == notification.sent_time
+        else:
+            self.assertIsNone(notification.sent_time)
+            assert current_time + self._datetime.timedelta(seconds=actions.NOTIFICATION_RETRY_DELAY * 2) == \
+                notification.next_attempt_time
+
+    @patch('ckanext.datarequests.actions.config')
+    @patch('ckanext.datarequests.actions.mailer')
+    @patch('ckanext.datarequests.actions.model')
+    @patch('ckanext.datarequests.actions._get_user')
+    @patch('ckanext.datarequests.actions._dictize_datarequest')
+    def test_send_pending_notifications_purged_followers(self, dictize_mock, get_user_mock, model_mock, mailer_mock,
+                                                         config_mock):
+        actions.datetime.datetime.utcnow = self._datetime.datetime.utcnow
+        config_mock.get.return_value = None
+        dictize_mock.return_value = {'id': 'dr1', 'user_id': 'spammer'}
+        get_user_mock.side_effect = lambda user_id, keep_email: {'name': user_id, 'email': user_id + '@example.com'}
+        model_mock.User.get.return_value = None
+
+        # The followers were removed when the data request was purged
+        actions.db.DataRequestFollower.get.return_value = []
+        notification = MagicMock(action_type='delete_datarequest', comment_id=None, attempts=0, delivered=u'',
+                                 follower_ids=u'follower1\nfollower2')
+        actions.db.DataRequestNotification.get_pending.return_value = [notification]
+
+        actions.send_pending_notifications(['n1'])
+
+        # The followers stored with the notification are notified anyway
+        recipients = [call[0][1] for call in mailer_mock.mail_recipient.call_args_list]
+        assert ['follower1@example.com', 'follower2@example.com'] == recipients
+        assert 0 == actions.db.DataRequestFollower.get.call_count
+
     ######################################################################
     ################################# NEW ################################
     ######################################################################
@@ -423,6 +521,75 @@ class ActionsTest(unittest.TestCase):
 
         self._test_show_datarequest_found(datarequest, org_checked, pkg_checked)
 
+    def test_show_datarequest_fields(self):
+        datarequest = test_data._generate_basic_datarequest()
+        actions.db.DataRequest.get.return_value = [datarequest]
+        actions.tk.asbool = self._tk.asbool
+        test_data._initialize_basic_actions(actions, {'user': 3}, {'org': 2}, {'pkg': 1})
+        request_data = dict(test_data.show_request_data, fields='title,organization', include_organization='false')
+
+        result = actions.show_datarequest(self.context, request_data)
+
+        assert {'id': datarequest.id, 'title': datarequest.title} == result
+        assert 0 == actions.tk.get_action.call_count
+        assert 0 == actions.db.DataRequestFollower.get_datarequest_followers_number.call_count
+
+    def test_show_datarequest_unknown_fields(self):
+        actions.tk.asbool = self._tk.asbool
+        request_data = dict(test_data.show_request_data, fields=['title', 'password'])
+
+        with self.assertRaises(self._tk.ValidationError):
+            actions.show_datarequest(self.context, request_data)
+
+        assert 0 == actions.db.DataRequest.get.call_count
+
+    ######################################################################
+    ############################## SHOW MANY #############################
+    ######################################################################
+
+    def test_show_many_datarequests_no_ids(self):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.show_many_datarequests(self.context, {'ids': ' , '})
+
+        assert 0 == actions.tk.check_access.call_count
+
+    def test_show_many_datarequests_too_many_ids(self):
+        ids = ['id{}'.format(i) for i in range(constants.SHOW_MANY_DATAREQUESTS_MAX_IDS + 1)]
+
+        with self.assertRaises(self._tk.ValidationError):
+            actions.show_many_datarequests(self.context, {'ids': ids})
+
+        assert 0 == actions.db.DataRequest.get_many.call_count
+
+    @patch('ckanext.datarequests.actions.h')
+    @patch('ckanext.datarequests.actions.current_user')
+    def test_show_many_datarequests(self, current_user_mock, h_mock):
+        current_user_mock.sysadmin = False
+        current_user_mock.id = 'example_uuidv4_user'
+        h_mock.closing_circumstances_enabled = False
+        h_mock.organizations_available.return_value = [{'id': 'org1'}]
+        actions.tk.asbool = self._tk.asbool
+        test_data._initialize_basic_actions(actions, {'user': 3}, {'org': 2}, {'pkg': 1})
+
+        own = test_data._generate_basic_datarequest(id='dr1', organization_id='other_org')
+        member = test_data._generate_basic_datarequest(id='dr2', user_id='other_user', organization_id='org1')
+        forbidden = test_data._generate_basic_datarequest(id='dr3', user_id='other_user', organization_id='other_org')
+        actions.db.DataRequest.get_many.return_value = [forbidden, member, own]
+        actions.db.DataRequestFollower.get_datarequests_followers_numbers.return_value = {'dr2': 4}
+
+        result = actions.show_many_datarequests(self.context, {'ids': 'dr2,missing,dr3,dr1'})
+
+        actions.db.DataRequest.get_many.assert_called_once_with({'dr1', 'dr2', 'dr3', 'missing'})
+        assert ['dr2', 'missing', 'dr3', 'dr1'] == [entry['id'] for entry in result]
+        assert 4 == result[0]['datarequest']['followers']
+        assert {'org': 2} == result[0]['datarequest']['organization']
+        assert 'error' in result[1] and 'error' in result[2]
+        assert 0 == result[3]['datarequest']['followers']
+
+        # Followers are counted with one query
+        actions.db.DataRequestFollower.get_datarequests_followers_numbers.assert_called_once()
+        assert 0 == actions.db.DataRequestFollower.get_datarequest_followers_number.call_count
+
     ######################################################################
     ############################### UPDATE ###############################
     ######################################################################
@@ -493,6 +660,139 @@ class ActionsTest(unittest.TestCase):
         pkg = default_pkg if accepted_dataset_id else None
         self._check_basic_response(datarequest, result, default_user, org, pkg)
 
+    ######################################################################
+    ############################## REVISIONS #############################
+    ######################################################################
+
+    def test_get_revision_changes(self):
+        # The dates are recognised with the real datetime module
+        actions.datetime = self._datetime
+        old_values = {'title': 'Old title', 'description': 'Same', 'organization_id': None,
+                      'approx_publishing_date': datetime.datetime(2020, 1, 2)}
+        new_values = {'title': 'New title', 'description': 'Same', 'organization_id': '',
+                      'approx_publishing_date': None}
+
+        changes = actions._get_revision_changes(old_values, new_values)
+
+        assert {'title': ['Old title', 'New title'],
+                'approx_publishing_date': ['2020-01-02T00:00:00', None]} == changes
+
+    def test_list_datarequest_revisions_no_id(self):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.list_datarequest_revisions(self.context, {})
+
+        assert 0 == actions.tk.check_access.call_count
+
+    def test_list_datarequest_revisions(self):
+        revision = MagicMock(id='rev1', datarequest_id='dr1', actor_id='user1', changes='{"status": ["Assigned", "Processing"]}',
+                             created=datetime.datetime(2020, 1, 2))
+        actions.db.DataRequestRevision.get_datarequest_revisions.return_value = ([revision], 21)
+
+        result = actions.list_datarequest_revisions(self.context, {'id': 'dr1', 'offset': '20', 'limit': '500'})
+
+        actions.tk.check_access.assert_called_once_with(constants.LIST_DATAREQUEST_REVISIONS, self.context,
+                                                        {'id': 'dr1', 'offset': '20', 'limit': '500'})
+        actions.db.DataRequestRevision.get_datarequest_revisions.assert_called_once_with(
+            'dr1', offset=20, limit=constants.DATAREQUEST_REVISIONS_MAX_PER_PAGE)
+        assert {'count': 21, 'result': [{
+            'id': 'rev1', 'datarequest_id': 'dr1', 'actor_id': 'user1', 'created': '2020-01-02 00:00:00',
+            'changes': {'status': ['Assigned', 'Processing']}
+        }]} == result
+
+    ######################################################################
+    ################################ STATS ###############################
+    ######################################################################
+
+    @parameterized.expand([
+        ([], None),
+        ([(3, 1)], 3),
+        ([(1, 1), (4, 1)], 2.5),
+        ([(0, 2), (5, 1), (9, 4)], 9),
+    ])
+    def test_get_median(self, value_counts, median):
+        assert median == actions._get_median(value_counts)
+
+    def test_show_datarequest_stats_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.show_datarequest_stats(self.context, {})
+
+        assert 0 == actions.db.DataRequestStats.get_daily.call_count
+
+    def test_show_datarequest_stats(self):
+        since, until = datetime.date(2020, 1, 1), datetime.date(2020, 1, 31)
+        actions.validator.validate_stats_params.return_value = {'since': since, 'until': until}
+        actions.db.DataRequestStats.get_daily.return_value = [
+            (datetime.date(2020, 1, 2), 'org1', 'Assigned', 2, 0),
+            (datetime.date(2020, 1, 2), 'org1', 'Finalised - Approved', 1, 1),
+            (datetime.date(2020, 1, 3), '', 'Processing', 0, 1),
+        ]
+        actions.db.DataRequestStats.get_close_days.return_value = [(1, 1), (6, 1)]
+
+        result = actions.show_datarequest_stats(self.context, {'since': '2020-01-01', 'until': '2020-01-31'})
+
+        actions.tk.check_access.assert_called_once_with(
+            constants.SHOW_DATAREQUEST_STATS, self.context, {'since': '2020-01-01', 'until': '2020-01-31'})
+        actions.db.DataRequestStats.get_daily.assert_called_once_with(organization_id=None, since=since, until=until)
+        assert {
+            'since': '2020-01-01',
+            'until': '2020-01-31',
+            'days': [
+                {'day': '2020-01-02', 'organization_id': 'org1', 'opened': 3, 'closed': 1, 'finalised': 1},
+                {'day': '2020-01-03', 'organization_id': None, 'opened': 0, 'closed': 1, 'finalised': 0},
+            ],
+            'totals': {'opened': 3, 'closed': 2, 'finalised': 1},
+            'median_days_to_close': 3.5
+        } == result
+
+    ######################################################################
+    ############################# BULK UPDATE ############################
+    ######################################################################
+
+    def test_bulk_update_status_no_ids(self):
+        with self.assertRaises(self._tk.ValidationError):
+            actions.bulk_update_datarequests_status(self.context, {'status': 'Processing'})
+
+        assert 0 == actions.tk.check_access.call_count
+        assert 0 == actions.db.DataRequest.update_status.call_count
+
+    def test_bulk_update_status_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+        data_dict = {'ids': ['dr1', 'dr2'], 'status': 'Processing'}
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.bulk_update_datarequests_status(self.context, data_dict)
+
+        actions.tk.check_access.assert_called_once_with(constants.BULK_UPDATE_DATAREQUESTS_STATUS, self.context, data_dict)
+        assert 0 == actions.db.DataRequest.update_status.call_count
+
+    @patch('ckanext.datarequests.actions._dispatch_notifications')
+    @patch('ckanext.datarequests.actions._queue_notifications')
+    def test_bulk_update_status(self, queue_notifications_mock, dispatch_notifications_mock):
+        data_dict = {'ids': ['dr1', 'dr2', 'dr3'], 'status': 'Processing'}
+        actions.db.DataRequest.update_status.return_value = [('dr1', 'Assigned'), ('dr3', None)]
+        queue_notifications_mock.side_effect = [['n1', 'n2'], ['n3', 'n4']]
+
+        result = actions.bulk_update_datarequests_status(self.context, data_dict)
+
+        assert {'ids': ['dr1', 'dr3'], 'count': 2} == result
+        actions.validator.validate_datarequest_status.assert_called_once_with(self.context, data_dict)
+        actions.db.DataRequest.update_status.assert_called_once_with(['dr1', 'dr2', 'dr3'], 'Processing')
+        queue_notifications_mock.assert_any_call(self.context['session'], 'update_datarequest', ['dr1', 'dr3'],
+                                                 'Data Request Status Change Email', self.context)
+        self.context['session'].commit.assert_called_once_with()
+
+        # The status change of every data request is recorded with a single insert, before the commit
+        self.context['session'].execute.assert_called_once_with(actions.db.revisions_table.insert.return_value, ANY)
+        rows = self.context['session'].execute.call_args[0][1]
+        assert {
+            'dr1': {'status': ['Assigned', 'Processing']},
+            'dr3': {'status': [None, 'Processing']}
+        } == {row['datarequest_id']: json.loads(row['changes']) for row in rows}
+        assert all(row['actor_id'] == self.context['auth_user_obj'].id for row in rows)
+        dispatch_notifications_mock.assert_called_once_with(['n1', 'n2', 'n3', 'n4'], 'Data Request Status Change Email')
+
     ######################################################################
     ################################ LIST ################################
     ######################################################################
@@ -526,14 +826,22 @@ class ActionsTest(unittest.TestCase):
         expected_response = test_case['expected_response']
         _organization_show = test_case['organization_show_func']
 
-        # Set the mocks
-        actions.db.DataRequest.get_ordered_by_date.return_value = ddbb_response
+        # Set the mocks. The page, the count and the facets come from the database
+        offset = content.get('offset', 0)
+        limit = content.get('limit', constants.DATAREQUESTS_PER_PAGE)
+        organization_counts = {}
+        for datarequest in ddbb_response:
+            if datarequest.organization_id:
+                organization_counts[datarequest.organization_id] = organization_counts.get(datarequest.organization_id, 0) + 1
+        actions.db.DataRequest.get_ordered_by_date.return_value = (ddbb_response[offset:offset + limit], len(ddbb_response))
+        actions.db.DataRequest.get_facet_counts.return_value = {'organization': organization_counts}
         actions.db.DataRequestFollower.get_datarequest_followers_number.return_value = test_data.DEFAULT_FOLLOWERS
         default_pkg = {'pkg': 1}
         default_org = {'org': 2}
         default_user = {'user': 3, 'id': test_data.user_default_id}
         test_data._initialize_basic_actions(actions, default_user, default_org, default_pkg)
         actions.tk._ = lambda x: x
+        actions.tk.asbool = self._tk.asbool
 
         # Modify the default behaviour of 'organization_show'
         organization_show = actions.tk.get_action('organization_show')
@@ -544,7 +852,12 @@ class ActionsTest(unittest.TestCase):
 
         # Assertions
         actions.tk.check_access.assert_called_once_with(constants.LIST_DATAREQUESTS, self.context, content)
-        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(**expected_ddbb_params)
+        expected_filters = dict(expected_ddbb_params, status=None, state=None, data_use_type=None,
+                                requesting_organisation=None, opened_after=None, opened_before=None)
+        desc = expected_filters.pop('desc')
+        actions.db.DataRequest.get_ordered_by_date.assert_called_once_with(
+            desc=desc, offset=offset, limit=limit, **expected_filters)
+        actions.db.DataRequest.get_facet_counts.assert_called_once_with(actions.LIST_FACETS, **expected_filters)
 
         # Expected organizations_show  calls
         expected_organization_show_calls = 0
@@ -598,6 +911,93 @@ class ActionsTest(unittest.TestCase):
             for item in items:
                 self.assertIn(item, response['facets'][facet]['items'])
 
+    def test_list_datarequests_date_filters(self):
+        actions.tk.asbool = self._tk.asbool
+        actions.validator.validate_date_filters.return_value = {
+            'opened_after': datetime.datetime(2020, 1, 15), 'opened_before': datetime.datetime(2020, 6, 1)}
+        actions.validator.validate_open_month.return_value = (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1))
+        actions.db.DataRequest.get_ordered_by_date.return_value = ([], 0)
+        actions.db.DataRequest.get_facet_counts.return_value = {}
+
+        actions.list_datarequests(self.context, {'closed': 'false', 'opened_after': '2020-01-15',
+                                                 'opened_before': '2020-06-01', 'open_month': '2020-01'})
+
+        # The range is the intersection of the dates and the month
+        filters = actions.db.DataRequest.get_ordered_by_date.call_args[1]
+        assert filters['closed'] is False
+        assert datetime.datetime(2020, 1, 15) == filters['opened_after']
+        assert datetime.datetime(2020, 2, 1) == filters['opened_before']
+
+    @patch('ckanext.datarequests.actions.h')
+    @patch('ckanext.datarequests.actions.current_user')
+    def test_list_datarequests_solr(self, current_user_mock, h_mock):
+        current_user_mock.sysadmin = False
+        current_user_mock.id = 'example_uuidv4_user'
+        h_mock.closing_circumstances_enabled = False
+        h_mock.organizations_available.return_value = [{'id': 'org1', 'name': 'org1'}]
+        test_data._initialize_basic_actions(actions, {'user': 3}, {'org': 2}, {'pkg': 1})
+        actions.tk._ = lambda x: x
+        actions.tk.get_action('organization_show').side_effect = lambda context, data_dict: {
+            'id': data_dict['id'], 'name': data_dict['id'], 'display_name': data_dict['id']}
+
+        first = test_data._generate_basic_datarequest(id='dr1', organization_id='org1')
+        second = test_data._generate_basic_datarequest(id='dr2', organization_id='org1')
+        actions.search.is_enabled.return_value = True
+        actions.search.search_datarequests.return_value = (
+            ['dr2', 'dr1'], 12, {'organization': {'org1': 12}, 'status': {'Assigned': 12}})
+        actions.db.DataRequest.get_many.return_value = [first, second]
+
+        response = actions.list_datarequests(self.context, {'q': 'roads', 'offset': 10, 'limit': 2})
+
+        actions.search.search_datarequests.assert_called_once_with(
+            q='roads', organization_id=None, user_id=None, closed=None, status=None, state=None, data_use_type=None,
+            requesting_organisation=None, opened_after=None, opened_before=None, desc=False, offset=10, limit=2,
+            visible_to=('example_uuidv4_user', ['org1']), pinned_user_id='example_uuidv4_user')
+        actions.db.DataRequest.get_many.assert_called_once_with(['dr2', 'dr1'], state=None)
+        assert 0 == actions.db.DataRequest.get_ordered_by_date.call_count
+
+        # The page keeps the order of the search results
+        assert ['dr2', 'dr1'] == [datarequest['id'] for datarequest in response['result']]
+        assert 12 == response['count']
+        assert [{'name': 'org1', 'display_name': 'org1', 'count': 12}] == response['facets']['organization']['items']
+        assert [{'name': 'Assigned', 'display_name': 'Assigned', 'count': 12}] == response['facets']['status']['items']
+
+    ######################################################################
+    ############################### CHANGES ##############################
+    ######################################################################
+
+    def test_list_datarequest_changes_not_authorized(self):
+        actions.tk.check_access = MagicMock(side_effect=self._tk.NotAuthorized)
+
+        with self.assertRaises(self._tk.NotAuthorized):
+            actions.list_datarequest_changes(self.context, {})
+
+        assert 0 == actions.db.DataRequest.get_changes.call_count
+
+    @patch('ckanext.datarequests.actions._dictize_datarequests')
+    def test_list_datarequest_changes(self, dictize_mock):
+        actions.tk.asbool = self._tk.asbool
+        since = datetime.datetime(2020, 1, 1)
+        updated = test_data._generate_basic_datarequest(id='dr1')
+        updated.metadata_modified = datetime.datetime(2020, 1, 2)
+        deleted = test_data._generate_basic_datarequest(id='dr2')
+        deleted.metadata_modified = datetime.datetime(2020, 1, 3)
+        deleted.state = 'deleted'
+        actions.db.DataRequest.get_changes.return_value = [updated, deleted]
+        actions.validator.validate_changes_params.return_value = {'since': since, 'after': None, 'limit': 2}
+        dictize_mock.return_value = [{'id': 'dr1'}]
+
+        result = actions.list_datarequest_changes(self.context, {'since': '2020-01-01'})
+
+        actions.db.DataRequest.get_changes.assert_called_once_with(since=since, after=None, organization_id=None, limit=2)
+        dictize_mock.assert_called_once_with([updated], None)
+        assert [
+            {'id': 'dr1', 'metadata_modified': '2020-01-02 00:00:00', 'datarequest': {'id': 'dr1'}},
+            {'id': 'dr2', 'metadata_modified': '2020-01-03 00:00:00', 'deleted': True}
+        ] == result['changes']
+        assert '2020-01-03T00:00:00 dr2' == result['cursor']
+        assert result['has_more']
+
     ######################################################################
     ############################### DELETE ###############################
     ######################################################################
@@ -656,11 +1056,24 @@ class ActionsTest(unittest.TestCase):
         self._test_no_id(actions.close_datarequest)
 
     def test_close_datarequest_not_found_no_accepted_ds(self):
+        actions.db.DataRequest.close.return_value = (None, None)
         self._test_not_found(actions.close_datarequest, constants.CLOSE_DATAREQUEST, test_data.close_request_data)
 
     def test_close_datarequest_not_found_accepted_ds(self):
+        actions.db.DataRequest.close.return_value = (None, None)
         self._test_not_found(actions.close_datarequest, constants.CLOSE_DATAREQUEST, test_data.close_request_data_accepted_ds)
 
+    def test_close_datarequest_already_closed(self):
+        # The data request exists, but it was not open
+        actions.db.DataRequest.close.return_value = (None, None)
+        actions.db.DataRequest.get.return_value = [test_data._generate_basic_datarequest()]
+
+        with self.assertRaises(self._tk.ValidationError):
+            actions.close_datarequest(self.context, test_data.close_request_data)
+
+        self.context['session'].commit.assert_not_called()
+        self.context['session'].add.assert_not_called()
+
     @parameterized.expand([
         (test_data.close_request_data, False, None),
         (test_data.close_request_data_accepted_ds, True, None),
@@ -673,8 +1086,11 @@ class ActionsTest(unittest.TestCase):
         actions.datetime.datetime.utcnow = MagicMock(return_value=current_time)
         datarequest = test_data._generate_basic_datarequest()
         datarequest.organization_id = organization_id
-        datarequest.accepted_dataset_id = None
-        actions.db.DataRequest.get.return_value = [datarequest]
+        datarequest.accepted_dataset_id = data.get('accepted_dataset_id')
+        datarequest.closed = True
+        datarequest.close_time = current_time
+        previous_values = {'closed': False, 'accepted_dataset_id': None, 'close_time': None}
+        actions.db.DataRequest.close.return_value = (datarequest, previous_values)
 
         send_mail_patch = patch('ckanext.datarequests.actions._send_mail')
         send_mail_mock = send_mail_patch.start()
@@ -696,16 +1112,25 @@ class ActionsTest(unittest.TestCase):
 
         # Assertions
         actions.tk.check_access.assert_called_once_with(constants.CLOSE_DATAREQUEST, self.context, expected_data_dict)
-        self.context['session'].add.assert_called_once_with(datarequest)
         self.context['session'].commit.assert_called_once_with()
 
-        # The data object returned by the database has been modified appropriately
-        self.assertTrue(datarequest.closed)
-        assert datarequest.close_time == current_time
+        # The data request is closed with a single update, and it is not read again
+        close_args, close_values = actions.db.DataRequest.close.call_args
+        assert (data['id'],) == close_args
+        assert close_values['close_time'] == current_time
         if expected_accepted_ds:
-            assert datarequest.accepted_dataset_id == data['accepted_dataset_id']
+            assert close_values['accepted_dataset_id'] == data['accepted_dataset_id']
         else:
-            self.assertIsNone(datarequest.accepted_dataset_id)
+            self.assertIsNone(close_values['accepted_dataset_id'])
+        assert 0 == actions.db.DataRequest.get.call_count
+
+        # The closing is recorded as a revision of the data request
+        expected_changes = {'closed': [False, True], 'close_time': [None, current_time.isoformat()]}
+        if expected_accepted_ds:
+            expected_changes['accepted_dataset_id'] = [None, data['accepted_dataset_id']]
+        assert datarequest.id == actions.db.DataRequestRevision.return_value.datarequest_id
+        self.context['session'].add.assert_called_once_with(actions.db.DataRequestRevision.return_value)
+        assert expected_changes == json.loads(actions.db.DataRequestRevision.return_value.changes)
 
         org = default_org if organization_id else None
         pkg = default_pkg if expected_accepted_ds else None
@@ -954,39 +1379,31 @@ class ActionsTest(unittest.TestCase):
 
     def test_follow_already_following(self):
         # Configure the mock
-        follower = MagicMock()
-        actions.db.DataRequestFollower.get.return_value = [follower]
+        actions.db.DataRequestFollower.follow.return_value = False
 
         with self.assertRaises(self._tk.ValidationError):
             actions.follow_datarequest(self.context, test_data.follow_data_request_data)
 
         # Assertions
-        self.context['session'].add.assert_not_called()
         self.context['session'].commit.assert_not_called()
 
     def test_follow(self):
         # Configure the mock
         current_time = self._datetime.datetime.now()
         actions.datetime.datetime.now = MagicMock(return_value=current_time)
-        actions.db.DataRequestFollower.get.return_value = []
+        actions.db.DataRequestFollower.follow.return_value = True
 
         # Call the function
         result = actions.follow_datarequest(self.context, test_data.follow_data_request_data)
 
         # Assertions
-        follower = actions.db.DataRequestFollower.return_value
-
         actions.tk.check_access.assert_called_once_with(constants.FOLLOW_DATAREQUEST, self.context, test_data.follow_data_request_data)
-        actions.db.DataRequestFollower.assert_called_once()
 
-        self.context['session'].add.assert_called_once_with(follower)
+        # The follower is stored with a single statement
+        actions.db.DataRequestFollower.follow.assert_called_once_with(
+            test_data.follow_data_request_data['id'], self.context['auth_user_obj'].id, current_time)
         self.context['session'].commit.assert_called_once()
 
-        # Check the object stored in the database
-        assert self.context['auth_user_obj'].id == follower.user_id
-        assert test_data.comment_request_data['datarequest_id'] == follower.datarequest_id
-        assert current_time == follower.time
-
         self.assertTrue(result)
 
     ######################################################################
@@ -1001,19 +1418,17 @@ class ActionsTest(unittest.TestCase):
 
     def test_unfollow_not_following(self):
         # Configure the mock
-        actions.db.DataRequestFollower.get.return_value = []
+        actions.db.DataRequestFollower.unfollow.return_value = False
 
         with self.assertRaises(self._tk.ObjectNotFound):
             actions.unfollow_datarequest(self.context, test_data.follow_data_request_data)
 
         # Assertions
-        self.context['session'].delete.assert_not_called()
         self.context['session'].commit.assert_not_called()
 
     def test_unfollow(self):
         # Configure the mock
-        follower = MagicMock()
-        actions.db.DataRequestFollower.get.return_value = [follower]
+        actions.db.DataRequestFollower.unfollow.return_value = True
 
         # Call the function
         result = actions.unfollow_datarequest(self.context, test_data.follow_data_request_data)
@@ -1021,7 +1436,70 @@ class ActionsTest(unittest.TestCase):
         # Assertions
         actions.tk.check_access.assert_called_once_with(constants.UNFOLLOW_DATAREQUEST, self.context, test_data.follow_data_request_data)
 
-        self.context['session'].delete.assert_called_once_with(follower)
+        actions.db.DataRequestFollower.unfollow.assert_called_once_with(
+            test_data.follow_data_request_data['id'], self.context['auth_user_obj'].id)
         self.context['session'].commit.assert_called_once()
 
         self.assertTrue(result)
+
+    @parameterized.expand([
+        (constants.CREATE_DATAREQUEST, 'Too many requests submitted, please wait 2 minutes and try again'),
+        (constants.COMMENT_DATAREQUEST, 'Too many comments posted, please wait 2 minutes and try again'),
+        (constants.UPDATE_DATAREQUEST_COMMENT, 'Too many comment edits, please wait 2 minutes and try again'),
+        (constants.FOLLOW_DATAREQUEST, 'Too many data requests followed, please wait 2 minutes and try again'),
+    ])
+    @patch('ckanext.datarequests.actions.throttle')
+    def test_throttle(self, action, message, throttle_mock):
+        throttle_mock.check.return_value = 90
+
+        with self.assertRaises(self._tk.ValidationError) as c:
+            actions._throttle(action, self.context['auth_user_obj'])
+
+        # Every action has its own message
+        assert {'': [message]} == c.exception.error_dict
+        throttle_mock.check.assert_called_once_with(action, self.context['auth_user_obj'])
+
+    ######################################################################
+    ################################ PURGE ###############################
+    ######################################################################
+
+    def test_purge_user_not_found(self):
+        with patch('ckanext.datarequests.actions.model') as model_mock:
+            model_mock.User.get.return_value = None
+
+            with self.assertRaises(self._tk.ObjectNotFound):
+                actions.purge_datarequests(self.context, {'user_id': 'spammer'})
+
+        assert 0 == actions.db.DataRequest.purge_by_user.call_count
+
+    @parameterized.expand([
+        (False,),
+        (True,)
+    ])
+    @patch('ckanext.datarequests.actions._dispatch_notifications')
+    @patch('ckanext.datarequests.actions._queue_notifications')
+    @patch('ckanext.datarequests.actions.model')
+    def test_purge(self, notify, model_mock, queue_notifications_mock, dispatch_notifications_mock):
+        actions.tk.asbool = bool
+        data_dict = {'user_id': 'spammer', 'notify': notify}
+        follower_ids = {'dr1': ['follower1', 'follower2'], 'dr2': ['follower3'], 'dr0': ['follower4']}
+        actions.db.DataRequest.purge_by_user.return_value = (['dr1', 'dr2'], 3, follower_ids)
+        queue_notifications_mock.return_value = ['n1', 'n2']
+
+        result = actions.purge_datarequests(self.context, data_dict)
+
+        assert {'datarequests': 2, 'comments': 3, 'followers': 4} == result
+        actions.tk.check_access.assert_called_once_with(constants.PURGE_DATAREQUESTS, self.context, data_dict)
+        model_mock.User.get.assert_called_once_with('spammer')
+        actions.db.DataRequest.purge_by_user.assert_called_once_with(model_mock.User.get.return_value.id)
+        self.context['session'].commit.assert_called_once_with()
+
+        if notify:
+            # The removed followers are still notified
+            queue_notifications_mock.assert_called_once_with(self.context['session'], 'delete_datarequest', ['dr1', 'dr2'],
+                                                             'Data Request Deletion Email', self.context,
+                                                             follower_ids=follower_ids)
+            dispatch_notifications_mock.assert_called_once_with(['n1', 'n2'], 'Data Request Deletion Email')
+        else:
+            queue_notifications_mock.assert_not_called()
+            dispatch_notifications_mock.assert_called_once_with([], 'Data Request Deletion Email')
@@ -95,6 +95,8 @@ def _generate_basic_datarequest(id=DATAREQUEST_ID, user_id='example_uuidv4_user'
     datarequest.close_time = None
     datarequest.accepted_dataset_id = None
     datarequest.accepted_dataset = {'test': 'test1', 'test2': 'test3'}
+    datarequest.metadata_modified = datarequest.open_time
+    datarequest.state = 'active'
 
     return datarequest
 
@@ -211,17 +213,7 @@ expected_result_1 = {
     'result': [
         dictice_ddbb_response(ddbb_response_1[0])
     ],
-    'facets': {
-        'state': {
-            'items': [
-                {
-                    'name': 'open',
-                    'display_name': 'Open',
-                    'count': 1
-                }
-            ]
-        }
-    }
+    'facets': {}
 }
 
 
@@ -271,20 +263,6 @@ expected_result_2 = {
                 }
 
             ]
-        },
-        'state': {
-            'items': [
-                {
-                    'name': 'open',
-                    'display_name': 'Open',
-                    'count': 3
-                },
-                {
-                    'name': 'closed',
-                    'display_name': 'Closed',
-                    'count': 5
-                }
-            ]
         }
     }
 }
@@ -0,0 +1,181 @@
+# encoding: utf-8
+
+from ckanext.datarequests import db
+import unittest
+
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+
+class FakeQuery(object):
+    '''
+    Stands in for the query of the matching data requests, keeping the rows
+    in memory, in the order of the query. The page is sliced as the database
+    would, and the matches are counted by the window function when it is added.
+    '''
+
+    def __init__(self, rows, with_count=False, page=None):
+        self.rows = rows
+        self.with_count = with_count
+        self.page = rows if page is None else page
+        self.order_by_criteria = None
+        self.count_calls = 0
+
+    def order_by(self, *criteria):
+        if criteria != (None,):
+            self.order_by_criteria = criteria
+        return self
+
+    def add_columns(self, column):
+        return FakeQuery(self.rows, True, self.page)
+
+    def offset(self, offset):
+        return FakeQuery(self.rows, self.with_count, self.page[offset:])
+
+    def limit(self, limit):
+        return FakeQuery(self.rows, self.with_count, self.page[:limit])
+
+    def all(self):
+        if self.with_count:
+            return [(row, len(self.rows)) for row in self.page]
+        return list(self.page)
+
+    def count(self):
+        self.count_calls += 1
+        return len(self.rows)
+
+
+class DataRequestListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.query = FakeQuery(['mine{0}'.format(i) for i in range(3)] + ['other{0}'.format(i) for i in range(4)])
+
+        self.filter_patch = patch.object(db.DataRequest, '_filter_list_query', return_value=self.query)
+        self.filter_patch.start()
+
+        self.model_patch = patch('ckanext.datarequests.db.model')
+        self.model_patch.start()
+
+        self.config_patch = patch('ckanext.datarequests.db.config', {})
+        self.config_patch.start()
+
+        self.current_user_patch = patch('ckanext.datarequests.db.current_user')
+        self.current_user = self.current_user_patch.start()
+        self.current_user.id = 'user1'
+
+    def tearDown(self):
+        self.filter_patch.stop()
+        self.model_patch.stop()
+        self.config_patch.stop()
+        self.current_user_patch.stop()
+
+    def _no_current_user(self):
+        self.current_user_patch.stop()
+        self.current_user_patch = patch('ckanext.datarequests.db.current_user', None)
+        self.current_user_patch.start()
+
+    @parameterized.expand([
+        (0, 2, ['mine0', 'mine1']),
+        (2, 3, ['mine2', 'other0', 'other1']),
+        (4, 2, ['other1', 'other2']),
+        (6, 10, ['other3']),
+        (0, None, ['mine0', 'mine1', 'mine2', 'other0', 'other1', 'other2', 'other3']),
+    ])
+    def test_get_ordered_by_date(self, offset, limit, expected_page):
+        page, count = db.DataRequest.get_ordered_by_date(offset=offset, limit=limit)
+
+        # The page and the matches are read by the same query
+        assert expected_page == page
+        assert 7 == count
+        assert 0 == self.query.count_calls
+
+    def test_get_ordered_by_date_mine_first(self):
+        db.DataRequest.get_ordered_by_date(offset=0, limit=2)
+
+        # The data requests of the current user come first, then by opening time
+        mine_first, by_date = self.query.order_by_criteria
+        assert 'CASE WHEN' in str(mine_first)
+        assert 'user_id' in str(mine_first)
+        assert 'open_time' in str(by_date)
+
+    def test_get_ordered_by_date_past_the_end(self):
+        page, count = db.DataRequest.get_ordered_by_date(offset=10, limit=2)
+
+        assert [] == page
+        assert 7 == count
+        assert 1 == self.query.count_calls
+
+    def test_get_ordered_by_date_no_matches(self):
+        self.query.rows = self.query.page = []
+
+        page, count = db.DataRequest.get_ordered_by_date(offset=0, limit=2)
+
+        # There is nothing to count
+        assert [] == page
+        assert 0 == count
+        assert 0 == self.query.count_calls
+
+    def test_get_ordered_by_date_no_current_user(self):
+        self._no_current_user()
+
+        page, count = db.DataRequest.get_ordered_by_date(offset=5, limit=5)
+
+        assert ['other2', 'other3'] == page
+        assert 7 == count
+        assert 0 == self.query.count_calls
+        assert 1 == len(self.query.order_by_criteria)
+
+    def test_get_ordered_by_date_no_current_user_past_the_end(self):
+        self._no_current_user()
+
+        page, count = db.DataRequest.get_ordered_by_date(offset=10, limit=5)
+
+        assert [] == page
+        assert 7 == count
+        assert 1 == self.query.count_calls
+
+    def test_get_ordered_by_date_estimated(self):
+        with patch.object(db.DataRequest, '_estimate_count', return_value=50000):
+            page, count = db.DataRequest.get_ordered_by_date(offset=2, limit=3)
+
+        # The estimate is returned and nothing is counted
+        assert ['mine2', 'other0', 'other1'] == page
+        assert 50000 == count
+        assert 0 == self.query.count_calls
+
+    @parameterized.expand([
+        ({}, 50000, None),
+        ({'ckanext.datarequests.count_estimate_threshold': '10000'}, 50000, 50000),
+        ({'ckanext.datarequests.count_estimate_threshold': '10000'}, 500, None),
+    ])
+    def test_estimate_count(self, config, planned_rows, expected_estimate):
+        self.config_patch.stop()
+        self.config_patch = patch('ckanext.datarequests.db.config', config)
+        self.config_patch.start()
+        cursor = db.model.Session.connection.return_value.connection.cursor.return_value
+        cursor.fetchone.return_value = ([{'Plan': {'Plan Rows': planned_rows}}],)
+
+        assert expected_estimate == db.DataRequest._estimate_count(MagicMock())
+
+
+class UpdateDBTest(unittest.TestCase):
+
+    @parameterized.expand([
+        (True, ['DELETE FROM "datarequests_followers" WHERE "datarequest_id" IS NULL',
+                'ALTER TABLE "datarequests_followers" ALTER COLUMN "datarequest_id" SET NOT NULL']),
+        (False, []),
+    ])
+    @patch('ckanext.datarequests.db.model')
+    @patch('ckanext.datarequests.db.DDL')
+    def test_require_datarequest_id(self, nullable, expected_statements, ddl_mock, model_mock):
+        inspector = MagicMock()
+        inspector.get_columns.return_value = [
+            {'name': 'id', 'nullable': False},
+            {'name': 'datarequest_id', 'nullable': nullable},
+        ]
+
+        db._require_datarequest_id(inspector, 'datarequests_followers')
+
+        # The rows without data request are removed before the column is made required
+        assert expected_statements == [args[0] for args, _ in ddl_mock.call_args_list]
+        inspector.get_columns.assert_called_once_with('datarequests_followers')
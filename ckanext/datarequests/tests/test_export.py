@@ -0,0 +1,78 @@
+# encoding: utf-8
+
+from ckanext.datarequests import export
+import datetime
+import json
+import unittest
+
+from mock import MagicMock, patch
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tk_patch = patch('ckanext.datarequests.export.tk')
+        self.tk_mock = self.tk_patch.start()
+
+        self.db_patch = patch('ckanext.datarequests.export.db')
+        self.db_mock = self.db_patch.start()
+        self.db_mock.closing_circumstances_enabled = False
+
+        self.model_patch = patch('ckanext.datarequests.export.model')
+        self.model_mock = self.model_patch.start()
+
+        self.validator_patch = patch('ckanext.datarequests.export.validator')
+        self.validator_mock = self.validator_patch.start()
+        self.validator_mock.validate_date_filters.return_value = {'opened_after': None, 'opened_before': None}
+
+        self.context = {'user': 'example_usr', 'auth_user_obj': MagicMock()}
+
+    def tearDown(self):
+        self.tk_patch.stop()
+        self.db_patch.stop()
+        self.model_patch.stop()
+        self.validator_patch.stop()
+
+    def test_iter_datarequests(self):
+        row = tuple('value_{}'.format(field) for field in export.FIELDS)
+        self.db_mock.DataRequest.get_for_export.return_value = iter([row])
+        data_dict = {'organization_id': 'org-name', 'status': 'Assigned'}
+
+        result = list(export.iter_datarequests(self.context, data_dict))
+
+        self.tk_mock.check_access.assert_called_once_with('export_datarequests', self.context, data_dict)
+        self.model_mock.Group.get.assert_called_once_with('org-name')
+        self.db_mock.DataRequest.get_for_export.assert_called_once_with(
+            export.FIELDS, organization_id=self.model_mock.Group.get.return_value.id, status='Assigned', state=None,
+            opened_after=None, opened_before=None, batch_size=export.BATCH_SIZE)
+        assert [dict(zip(export.FIELDS, row))] == result
+
+    def test_iter_datarequests_not_authorized(self):
+        self.tk_mock.check_access.side_effect = Exception('Not authorized')
+
+        with self.assertRaises(Exception):
+            export.iter_datarequests(self.context, {})
+
+        self.db_mock.DataRequest.get_for_export.assert_not_called()
+
+    def test_to_csv(self):
+        datarequests = [
+            {'id': 'dr1', 'open_time': datetime.datetime(2020, 1, 2, 3, 4, 5)},
+            {'id': 'dr2', 'open_time': None}
+        ]
+
+        chunks = list(export.to_csv(iter(datarequests), ['id', 'open_time']))
+
+        assert ['id,open_time\r\ndr1,2020-01-02T03:04:05\r\n', 'dr2,\r\n'] == chunks
+
+    def test_to_csv_empty(self):
+        assert ['id,open_time\r\n'] == list(export.to_csv(iter([]), ['id', 'open_time']))
+
+    def test_to_jsonl(self):
+        datarequests = [{'id': 'dr1', 'closed': False, 'open_time': datetime.datetime(2020, 1, 2)}]
+
+        chunks = list(export.to_jsonl(iter(datarequests)))
+
+        assert 1 == len(chunks)
+        assert chunks[0].endswith('\n')
+        assert {'id': 'dr1', 'closed': False, 'open_time': '2020-01-02T00:00:00'} == json.loads(chunks[0])
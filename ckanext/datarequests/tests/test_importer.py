@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+from ckanext.datarequests import importer
+import io
+import unittest
+
+from mock import MagicMock, call, patch
+
+
+VALID_ROW = {
+    'title': '',
+    'description': 'Purpose of the request',
+    'data_use_type': 'Service delivery',
+    'who_will_access_this_data': 'Our analysts',
+    'requesting_organisation': 'requesting-org',
+    'data_storage_environment': 'Secure storage',
+    'data_outputs_type': 'Report',
+    'data_outputs_description': 'Monthly report',
+    'requested_dataset': 'dataset-name',
+}
+
+
+class ImporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_patch = patch('ckanext.datarequests.importer.model')
+        self.model_mock = self.model_patch.start()
+
+        self.actions_patch = patch('ckanext.datarequests.importer.actions')
+        self.actions_mock = self.actions_patch.start()
+
+        self.search_patch = patch('ckanext.datarequests.importer.search')
+        self.search_mock = self.search_patch.start()
+
+        self.validator_patch = patch('ckanext.datarequests.importer.validator')
+        self.validator_mock = self.validator_patch.start()
+
+        # Only the referenced datasets are resolved, as in the database
+        packages = {'dataset-name': ('Dataset title', 'org-id')}
+        self.packages_patch = patch('ckanext.datarequests.importer._resolve_packages', side_effect=lambda references: {
+            reference: packages[reference] for reference in references if reference in packages})
+        self.packages_mock = self.packages_patch.start()
+
+        self.or_patch = patch('ckanext.datarequests.importer.or_')
+        self.or_patch.start()
+
+        # The organizations are looked up for real, in a database with these ones
+        organizations_query = self.model_mock.Session.query.return_value.filter.return_value
+        organizations_query.__iter__.return_value = [('org-id', 'owner-org'), ('requesting-org-id', 'requesting-org')]
+        self.organizations_patch = patch('ckanext.datarequests.importer._resolve_organizations',
+                                         wraps=importer._resolve_organizations)
+        self.organizations_mock = self.organizations_patch.start()
+
+        self.users_patch = patch('ckanext.datarequests.importer._resolve_users', return_value={'legacy-user': 'user-id'})
+        self.users_mock = self.users_patch.start()
+
+        self.session = MagicMock()
+        self.context = {'session': self.session}
+
+        def validate(context, row, errors, default_title, default_org_id, organization_exists):
+            row.setdefault('title', default_title)
+            row.setdefault('organization_id', default_org_id)
+            row.setdefault('status', 'Assigned')
+            if not organization_exists(row['organization_id']):
+                errors.setdefault('Organization', []).append('Organization is not valid')
+        self.validator_mock.validate_datarequest_fields.side_effect = validate
+
+    def tearDown(self):
+        self.model_patch.stop()
+        self.actions_patch.stop()
+        self.search_patch.stop()
+        self.validator_patch.stop()
+        self.or_patch.stop()
+        self.packages_patch.stop()
+        self.organizations_patch.stop()
+        self.users_patch.stop()
+
+    def test_read_csv(self):
+        source = io.StringIO('title,description\r\nExample,"Multi\nline"\r\nOther,Text\r\n')
+
+        rows = list(importer.read_rows(source, 'csv'))
+
+        assert [(3, {'title': 'Example', 'description': 'Multi\nline'}),
+                (4, {'title': 'Other', 'description': 'Text'})] == rows
+
+    def test_read_jsonl(self):
+        source = io.StringIO('{"title": "Example"}\n\nnot json\n[1]\n')
+
+        rows = list(importer.read_rows(source, 'jsonl'))
+
+        assert [(1, {'title': 'Example'}), (3, None), (4, None)] == rows
+
+    def test_import_datarequests(self):
+        rows = [
+            (2, dict(VALID_ROW)),
+            (3, dict(VALID_ROW, user_id='legacy-user', open_time='2020-01-02T03:04:05')),
+            (4, None),
+        ]
+
+        imported, failures = importer.import_datarequests(self.context, rows, 'site-user-id', batch_size=2)
+
+        assert 2 == imported
+        assert [(4, {'Row': ['Unable to parse the row']})] == failures
+
+        # The references are resolved once per batch. The second batch has no valid rows
+        assert [call({'dataset-name'}), call(set())] == self.packages_mock.call_args_list
+        # The organization of the dataset is looked up for the rows without organization
+        assert [call({'requesting-org', 'org-id'}), call(set())] == self.organizations_mock.call_args_list
+        assert [call({'legacy-user'}), call(set())] == self.users_mock.call_args_list
+
+        # A single INSERT for the valid rows of the first batch, nothing for the second one
+        self.session.execute.assert_called_once()
+        records = self.session.execute.call_args[0][1]
+        assert ['site-user-id', 'user-id'] == [record['user_id'] for record in records]
+        assert ['Dataset title'] * 2 == [record['title'] for record in records]
+        assert ['org-id'] * 2 == [record['organization_id'] for record in records]
+        assert ['requesting-org-id'] * 2 == [record['requesting_organisation'] for record in records]
+        assert '2020-01-02T03:04:05' == records[1]['open_time'].isoformat()
+
+        self.session.commit.assert_called_once_with()
+        self.actions_mock._queue_notifications.assert_not_called()
+        self.search_mock.update_index.assert_called_once_with([record['id'] for record in records])
+
+    def test_import_datarequests_notify(self):
+        self.actions_mock._queue_notifications.return_value = ['notification-id']
+
+        importer.import_datarequests(self.context, [(2, dict(VALID_ROW))], 'site-user-id', notify=True)
+
+        records = self.session.execute.call_args[0][1]
+        self.actions_mock._queue_notifications.assert_called_once_with(
+            self.session, 'new_datarequest', [records[0]['id']], 'Data Request Created Email', self.context)
+        self.actions_mock._dispatch_notifications.assert_called_once_with(
+            ['notification-id'], 'Data Request Created Email')
+
+    def test_import_datarequests_organization(self):
+        rows = [
+            # Without organization, the one of the dataset is used
+            (2, dict(VALID_ROW)),
+            (3, dict(VALID_ROW, organization_id='owner-org')),
+            (4, dict(VALID_ROW, organization_id='unknown-org')),
+        ]
+
+        imported, failures = importer.import_datarequests(self.context, rows, 'site-user-id')
+
+        assert 2 == imported
+        assert [(4, {'Organization': ['Organization is not valid']})] == failures
+        records = self.session.execute.call_args[0][1]
+        assert ['org-id'] * 2 == [record['organization_id'] for record in records]
+
+    def test_import_datarequests_invalid_references(self):
+        rows = [
+            (2, dict(VALID_ROW, requested_dataset='unknown')),
+            (3, dict(VALID_ROW, user_id='unknown')),
+            (4, dict(VALID_ROW, open_time='yesterday')),
+        ]
+
+        imported, failures = importer.import_datarequests(self.context, rows, 'site-user-id')
+
+        assert 0 == imported
+        assert [2, 3, 4] == [line_number for line_number, _ in failures]
+        self.session.execute.assert_not_called()
+
+    def test_write_error_report(self):
+        output = io.StringIO()
+
+        importer.write_error_report([(2, {'Title': ['Title cannot be empty', 'Other']})], output)
+
+        assert 'line,field,error\r\n2,Title,Title cannot be empty\r\n2,Title,Other\r\n' == output.getvalue()
@@ -23,9 +23,11 @@ import unittest
 from mock import MagicMock, patch
 from parameterized import parameterized
 
-TOTAL_ACTIONS = 14
+TOTAL_ACTIONS = 19
 COMMENTS_ACTIONS = 5
 ACTIONS_NO_COMMENTS = TOTAL_ACTIONS - COMMENTS_ACTIONS
+# Auth functions of the features not exposed as actions (export)
+AUTH_ONLY_FUNCTIONS = 1
 
 
 class DataRequestPluginTest(unittest.TestCase):
@@ -107,7 +109,7 @@ class DataRequestPluginTest(unittest.TestCase):
     ])
     def test_get_auth_functions(self, comments_enabled):
 
-        auth_functions_len = TOTAL_ACTIONS if comments_enabled == 'True' else ACTIONS_NO_COMMENTS
+        auth_functions_len = AUTH_ONLY_FUNCTIONS + (TOTAL_ACTIONS if comments_enabled == 'True' else ACTIONS_NO_COMMENTS)
 
         # Configure config and create instance
         common.config.get.return_value = comments_enabled
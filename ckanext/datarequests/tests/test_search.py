@@ -0,0 +1,142 @@
+# encoding: utf-8
+
+from ckanext.datarequests import search
+import datetime
+import unittest
+
+from mock import MagicMock, patch
+
+from . import test_actions_data as test_data
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tk_patch = patch('ckanext.datarequests.search.tk')
+        self.tk_mock = self.tk_patch.start()
+        self.tk_mock.config = {'ckanext.datarequests.solr': 'true', 'ckan.site_id': 'site'}
+        self.tk_mock.asbool = lambda value: str(value).lower() == 'true'
+
+        # The Solr core is replaced by a local stand-in
+        self.connection_patch = patch('ckanext.datarequests.search._make_connection')
+        self.connection = self.connection_patch.start().return_value
+
+        self.model_patch = patch('ckanext.datarequests.search.model')
+        self.model_mock = self.model_patch.start()
+        self.model_mock.State.ACTIVE = 'active'
+
+    def tearDown(self):
+        self.tk_patch.stop()
+        self.connection_patch.stop()
+        self.model_patch.stop()
+
+    def _set_database(self, datarequests):
+        query = self.model_mock.Session.query.return_value.autoflush.return_value
+        query.filter.return_value.all.return_value = datarequests
+
+    def test_to_document(self):
+        datarequest = test_data._generate_basic_datarequest(id='dr1')
+        datarequest.state = 'active'
+        datarequest.open_time = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+        document = search.to_document(datarequest)
+
+        assert 'dr1' == document['id']
+        assert 'datarequest' == document['entity_type']
+        assert 'site' == document['site_id']
+        assert '2020-01-02T03:04:05Z' == document['metadata_created']
+        assert '2020-01' == document['dr_open_month']
+        assert datarequest.title == document['title']
+        assert datarequest.description in document['text']
+        assert 'false' == document['dr_closed']
+        assert 'active' == document['dr_state']
+
+    def test_update_index(self):
+        self._set_database([test_data._generate_basic_datarequest(id='dr1')])
+
+        search.update_index(['dr1', 'dr2', 'dr1'])
+
+        documents = self.connection.add.call_args[0][0]
+        assert ['dr1'] == [document['id'] for document in documents]
+        # The data requests that no longer exist are removed from the index
+        delete_query = self.connection.delete.call_args[1]['q']
+        assert 'id:("dr2")' in delete_query
+        assert 'entity_type:datarequest' in delete_query
+        self.connection.commit.assert_called_once_with(softCommit=True)
+
+    def test_update_index_disabled(self):
+        self.tk_mock.config = {}
+
+        search.update_index(['dr1'])
+
+        assert 0 == self.model_mock.Session.query.call_count
+        assert 0 == self.connection.add.call_count
+
+    def test_update_index_error(self):
+        self._set_database([test_data._generate_basic_datarequest(id='dr1')])
+        self.connection.add.side_effect = Exception('Solr is down')
+
+        # Errors are not raised once the changes have been committed
+        search.update_index(['dr1'])
+
+    def test_rebuild_index(self):
+        datarequests = [test_data._generate_basic_datarequest(id='dr{0}'.format(i)) for i in range(5)]
+        query = self.model_mock.Session.query.return_value.autoflush.return_value.order_by.return_value
+        query.yield_per.return_value = iter(datarequests)
+
+        total = search.rebuild_index(batch_size=2)
+
+        assert 5 == total
+        assert [2, 2, 1] == [len(call[0][0]) for call in self.connection.add.call_args_list]
+        self.connection.delete.assert_called_once_with(q=search._entity_query(), commit=False)
+        self.connection.commit.assert_called_once_with()
+
+    def test_search_datarequests(self):
+        results = MagicMock()
+        results.docs = [{'id': 'dr2'}, {'id': 'dr1'}]
+        results.hits = 12
+        results.facets = {'facet_fields': {
+            'dr_organization_id': ['org1', 10, 'org2', 2],
+            'dr_status': ['Assigned', 12],
+            'dr_open_month': ['2020-01', 12],
+        }}
+        self.connection.search.return_value = results
+
+        ids, hits, facets = search.search_datarequests(
+            q='roads', organization_id='org1', closed=False, data_use_type='Research', requesting_organisation='org2',
+            opened_after=datetime.datetime(2020, 1, 1), opened_before=datetime.datetime(2020, 2, 1), desc=True,
+            offset=10, limit=2,
+            visible_to=('user1', ['org1', 'org2']), pinned_user_id='user1')
+
+        assert ['dr2', 'dr1'] == ids
+        assert 12 == hits
+        # Every facet is returned, even without values
+        assert {'organization': {'org1': 10, 'org2': 2}, 'status': {'Assigned': 12}, 'data_use_type': {},
+                'requesting_organisation': {}, 'open_month': {'2020-01': 12}} == facets
+
+        query, params = self.connection.search.call_args[0][0], self.connection.search.call_args[1]
+        assert 'roads' == query
+        assert 'edismax' == params['defType']
+        assert '+dr_state:"active"' in params['fq']
+        assert '+dr_organization_id:"org1"' in params['fq']
+        assert '+dr_closed:false' in params['fq']
+        assert '+dr_data_use_type:"Research"' in params['fq']
+        assert '+dr_requesting_organisation:"org2"' in params['fq']
+        assert '+metadata_created:[2020-01-01T00:00:00Z TO 2020-02-01T00:00:00Z}' in params['fq']
+        assert '+(dr_user_id:"user1" OR dr_organization_id:("org1" OR "org2"))' in params['fq']
+        assert 'termfreq(dr_user_id,"user1") desc, metadata_created desc' == params['sort']
+        assert 10 == params['start'] and 2 == params['rows']
+        assert sorted(['dr_organization_id', 'dr_status', 'dr_data_use_type', 'dr_requesting_organisation',
+                       'dr_open_month']) == sorted(params['facet.field'])
+
+    def test_search_datarequests_open_range(self):
+        results = MagicMock(docs=[], hits=0, facets={})
+        self.connection.search.return_value = results
+
+        search.search_datarequests(opened_after=datetime.datetime(2020, 1, 15))
+        search.search_datarequests(opened_before=datetime.datetime(2020, 2, 1))
+
+        # A missing end of the range is left open
+        first_params, second_params = [call[1] for call in self.connection.search.call_args_list]
+        assert '+metadata_created:[2020-01-15T00:00:00Z TO *}' in first_params['fq']
+        assert '+metadata_created:[* TO 2020-02-01T00:00:00Z}' in second_params['fq']
@@ -0,0 +1,67 @@
+# encoding: utf-8
+
+from ckanext.datarequests import sla
+import datetime
+import unittest
+
+from mock import MagicMock, patch
+
+
+class SLATest(unittest.TestCase):
+
+    def setUp(self):
+        self.tk_patch = patch('ckanext.datarequests.sla.tk')
+        self.tk_mock = self.tk_patch.start()
+        self.tk_mock.config = {'ckanext.datarequests.sla_days': '14'}
+        self.tk_mock.asint = int
+
+        self.db_patch = patch('ckanext.datarequests.sla.db')
+        self.db_mock = self.db_patch.start()
+
+        self.model_patch = patch('ckanext.datarequests.sla.model')
+        self.model_mock = self.model_patch.start()
+
+        self.mailer_patch = patch('ckanext.datarequests.sla.mailer')
+        self.mailer_mock = self.mailer_patch.start()
+
+        self.actions_patch = patch('ckanext.datarequests.sla.actions')
+        self.actions_mock = self.actions_patch.start()
+        self.actions_mock._get_user.side_effect = lambda user_id, keep_email: {
+            'name': user_id, 'display_name': user_id.title(), 'email': '{0}@example.com'.format(user_id)}
+
+    def tearDown(self):
+        self.tk_patch.stop()
+        self.db_patch.stop()
+        self.model_patch.stop()
+        self.mailer_patch.stop()
+        self.actions_patch.stop()
+
+    def test_update_summary(self):
+        now = datetime.datetime(2020, 3, 1)
+
+        result = sla.update_summary(now=now)
+
+        self.db_mock.DataRequestSLASummary.refresh.assert_called_once_with(sla.SLA_STATUSES, 14, now=now)
+        self.model_mock.Session.commit.assert_called_once_with()
+        assert self.db_mock.DataRequestSLASummary.get_summary.return_value == result
+
+    def test_send_digests(self):
+        now = datetime.datetime(2020, 3, 1)
+        overdue = MagicMock(organization_id='org1', overdue=2)
+        summary = [overdue, MagicMock(organization_id='org2', overdue=0), MagicMock(organization_id='', overdue=5)]
+        organization_show = self.tk_mock.get_action.return_value
+        organization_show.return_value = {'users': [{'id': 'admin', 'capacity': 'admin'},
+                                                    {'id': 'editor', 'capacity': 'editor'}]}
+
+        sent = sla.send_digests(summary, now=now)
+
+        # Only the admins of the organizations with overdue data requests are mailed
+        assert 1 == sent
+        organization_show.assert_called_once_with({'ignore_auth': True}, {'id': 'org1', 'include_users': True})
+        self.db_mock.DataRequestSLASummary.get_overdue.assert_called_once_with(
+            'org1', sla.SLA_STATUSES, datetime.datetime(2020, 2, 16), limit=sla.DIGEST_MAX_DATAREQUESTS)
+        self.mailer_mock.mail_recipient.assert_called_once_with(
+            'Admin', 'admin@example.com', self.tk_mock.render.return_value, self.tk_mock.render.return_value)
+        extra_vars = self.tk_mock.render.call_args[0][1]
+        assert overdue == extra_vars['summary']
+        assert 14 == extra_vars['sla_days']
@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+from ckanext.datarequests import throttle
+import unittest
+
+from mock import MagicMock, patch
+from parameterized import parameterized
+
+
+class ThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        throttle.EXEMPT_CACHE.clear()
+        throttle._local_windows.clear()
+        throttle._redis_retry_time = 0
+
+        self.model_patch = patch('ckanext.datarequests.throttle.model')
+        self.model_mock = self.model_patch.start()
+        self.member_query = self.model_mock.Session.query.return_value.join.return_value.filter.return_value
+
+        self.config_patch = patch('ckanext.datarequests.throttle.config', {'ckan.site_id': 'site'})
+        self.config_patch.start()
+
+        self.script = MagicMock(return_value=0)
+        self.window_patch = patch('ckanext.datarequests.throttle._get_sliding_window', return_value=self.script)
+        self.window_patch.start()
+
+        self.user = MagicMock(id='user-1', sysadmin=False)
+        self.user.name = 'user1'
+
+    def tearDown(self):
+        self.model_patch.stop()
+        self.config_patch.stop()
+        self.window_patch.stop()
+
+    def test_is_exempt_sysadmin(self):
+        self.user.sysadmin = True
+        self.assertTrue(throttle.is_exempt(self.user))
+        self.model_mock.Session.query.assert_not_called()
+
+    def test_is_exempt_cached(self):
+        self.member_query.first.return_value = None
+
+        self.assertFalse(throttle.is_exempt(self.user))
+        self.assertFalse(throttle.is_exempt(self.user))
+
+        self.member_query.first.assert_called_once_with()
+
+    def test_is_exempt_editor(self):
+        self.member_query.first.return_value = ('member-1',)
+        self.assertTrue(throttle.is_exempt(self.user))
+
+    @parameterized.expand([
+        (None, 'comment_datarequest', (5, 60)),
+        ('3/10', 'comment_datarequest', (3, 10)),
+        ('0', 'comment_datarequest', None),
+        ('0/60', 'comment_datarequest', None),
+        ('5/0', 'comment_datarequest', (5, 60)),
+        ('-1/60', 'comment_datarequest', (5, 60)),
+        ('invalid', 'follow_datarequest', (20, 60)),
+        (None, 'unfollow_datarequest', None),
+    ])
+    def test_get_limit(self, value, action, expected):
+        config = {'ckanext.datarequests.throttle.{}'.format(action): value} if value else {}
+        with patch('ckanext.datarequests.throttle.config', config):
+            assert expected == throttle.get_limit(action)
+
+    @patch('ckanext.datarequests.throttle.is_exempt', return_value=True)
+    def test_check_exempt(self, is_exempt_mock):
+        assert 0 == throttle.check('comment_datarequest', self.user)
+        self.script.assert_not_called()
+
+    @patch('ckanext.datarequests.throttle.is_exempt', return_value=False)
+    def test_check(self, is_exempt_mock):
+        self.script.return_value = 30000
+        assert 30 == throttle.check('comment_datarequest', self.user)
+        assert [60000, 5] == self.script.call_args[1]['args'][1:3]
+
+    @patch('ckanext.datarequests.throttle.time')
+    def test_hit_allowed(self, time_mock):
+        time_mock.time.return_value = 10
+
+        assert 0 == throttle.hit('create_datarequest', 'user-1', 1, 300)
+
+        self.script.assert_called_once_with(
+            keys=['site.ckanext.datarequest.throttle.create_datarequest.user-1'],
+            args=[10000, 300000, 1, throttle.MAX_RECORDED_ATTEMPTS])
+
+    def test_hit_rejected(self):
+        self.script.return_value = 120500
+
+        assert 120.5 == throttle.hit('create_datarequest', 'user-1', 1, 300)
+
+    @patch('ckanext.datarequests.throttle.time')
+    def test_hit_redis_unavailable(self, time_mock):
+        self.script.side_effect = throttle.RedisError('Connection refused')
+        time_mock.time.return_value = 100
+
+        assert 0 == throttle.hit('comment_datarequest', 'user-1', 2, 60)
+        assert 0 == throttle.hit('comment_datarequest', 'user-1', 2, 60)
+        assert 60 == throttle.hit('comment_datarequest', 'user-1', 2, 60)
+
+        # The circuit is open, Redis is not tried again until the cool down passes
+        self.script.assert_called_once()
+
+        time_mock.time.return_value = 100 + throttle.CIRCUIT_BREAKER_COOLDOWN
+        self.script.side_effect = None
+        self.script.return_value = 0
+        assert 0 == throttle.hit('comment_datarequest', 'user-1', 2, 60)
+        assert 2 == self.script.call_count
+
+    def test_local_hit_window_slides(self):
+        assert 0 == throttle._local_hit('key', 1, 60, 100)
+        assert 60 == throttle._local_hit('key', 1, 60, 100)
+        assert 0 == throttle._local_hit('key', 1, 60, 161)
+
+    @patch('ckanext.datarequests.throttle.LOCAL_MAX_KEYS', 2)
+    def test_local_hit_bounded(self):
+        for key in ['a', 'b', 'c']:
+            throttle._local_hit(key, 1, 60, 100)
+
+        assert ['b', 'c'] == list(throttle._local_windows.keys())
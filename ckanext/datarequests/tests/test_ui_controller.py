@@ -21,7 +21,7 @@ from ckanext.datarequests import constants, request_helpers
 import ckanext.datarequests.controllers.controller_functions as controller
 import unittest
 
-from mock import MagicMock
+from mock import MagicMock, patch
 from parameterized import parameterized
 
 
@@ -220,6 +220,39 @@ class UIControllerTest(unittest.TestCase):
             controller.tk.abort.assert_called_once_with(403, 'Unauthorized to create a Data Request')
             assert 0 == controller.tk.render.call_count
 
+    ######################################################################
+    ############################### SIMILAR ##############################
+    ######################################################################
+
+    def test_similar_not_authorized(self):
+        controller.tk.check_access.side_effect = controller.tk.NotAuthorized('User not authorized')
+
+        result = controller.similar()
+
+        controller.tk.abort.assert_called_once_with(403, 'Unauthorized to create a Data Request')
+        assert result == 'aborted'
+
+    @patch('ckanext.datarequests.controllers.controller_functions.current_user')
+    @patch('ckanext.datarequests.controllers.controller_functions.jsonify', side_effect=lambda data: data)
+    @patch('ckanext.datarequests.controllers.controller_functions.db')
+    def test_similar(self, db_mock, jsonify_mock, current_user_mock):
+        _patch_GET({'requested_dataset': 'dataset_uuidv4', 'title': ' Example '})
+        current_user_mock.sysadmin = False
+        current_user_mock.id = 'user_uuidv4'
+        controller.h.organizations_available.return_value = [{'id': 'org_uuidv4'}]
+        db_mock.DataRequest.get_similar.return_value = [('dr_uuidv4', 'Example', 'Assigned', 'open_time')]
+
+        result = controller.similar()
+
+        db_mock.DataRequest.get_similar.assert_called_once_with(
+            requested_dataset='dataset_uuidv4', title='Example', user_id='user_uuidv4',
+            organization_ids=['org_uuidv4'], limit=constants.SIMILAR_DATAREQUESTS_LIMIT)
+        controller.tk.url_for.assert_called_once_with('datarequest.show', id='dr_uuidv4')
+        assert {'result': [{
+            'id': 'dr_uuidv4', 'title': 'Example', 'status': 'Assigned', 'open_time': 'open_time',
+            'url': controller.tk.url_for.return_value
+        }]} == result
+
     ######################################################################
     ################################ SHOW ################################
     ######################################################################
@@ -444,13 +477,47 @@ class UIControllerTest(unittest.TestCase):
         result = controller.index()
 
         # Assertions
-        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0, 'sort': 'desc'}
+        expected_data_req = {'organization_id': organization_name, 'limit': 10, 'offset': 0, 'sort': 'desc',
+                             'include_organization': False, 'include_dataset': False, 'include_followers': False}
         controller.tk.check_access.assert_called_once_with(constants.LIST_DATAREQUESTS, self.expected_context, expected_data_req)
         controller.tk.abort.assert_called_once_with(403, 'Unauthorized to list Data Requests')
         assert 0 == controller.tk.get_action.call_count
         assert 0 == controller.tk.render.call_count
         assert result == 'aborted'
 
+    def test_index_facet_filters(self):
+        _patch_GET({'data_use_type': 'Research', 'open_month': '2020-01', 'requesting_organisation': '',
+                    'closed': 'false'})
+        base_url = 'http://someurl.com/somepath/otherpath'
+        controller.tk.url_for.return_value = base_url
+
+        # Call the function
+        controller.index()
+
+        # Assertions
+        expected_data_req = {'limit': 10, 'offset': 0, 'sort': 'desc', 'data_use_type': 'Research',
+                             'open_month': '2020-01', 'closed': 'false', 'include_organization': False,
+                             'include_dataset': False, 'include_followers': False}
+        controller.tk.get_action.return_value.assert_called_once_with(self.expected_context, expected_data_req)
+
+        # The filters are kept when moving through the pages
+        page_arguments = controller.helpers.Page.call_args[1]
+        assert '%s?data_use_type=Research&open_month=2020-01&closed=false&sort=desc&page=2' % base_url \
+            == page_arguments['url'](page=2)
+
+    def test_index_invalid_filter(self):
+        controller.tk.get_action.return_value.side_effect = controller.tk.ValidationError(
+            {'Open month': ['Month must be in format yyyy-mm']})
+        _patch_GET({'open_month': 'January'})
+
+        # Call the function
+        result = controller.index()
+
+        # Assertions
+        controller.tk.abort.assert_called_once_with(400, 'Invalid filter: Month must be in format yyyy-mm')
+        assert 0 == controller.tk.render.call_count
+        assert result == 'aborted'
+
     def test_index_invalid_page(self):
         _patch_GET({'page': '2a'})
 
@@ -508,7 +575,10 @@ class UIControllerTest(unittest.TestCase):
         expected_data_dict = {
             'offset': expected_offset,
             'limit': expected_limit,
-            'sort': expected_sort
+            'sort': expected_sort,
+            'include_organization': False,
+            'include_dataset': False,
+            'include_followers': False
         }
 
         if query:
@@ -620,9 +690,12 @@ class UIControllerTest(unittest.TestCase):
 
         # Check the facets
         expected_facet_titles = {}
-        expected_facet_titles['state'] = controller.tk._('State')
+        expected_facet_titles['status'] = controller.tk._('Status')
         if func != ORGANIZATION_DATAREQUESTS_FUNCTION:
             expected_facet_titles['organization'] = controller.tk._('Organizations')
+        expected_facet_titles['data_use_type'] = controller.tk._('Data use type')
+        expected_facet_titles['requesting_organisation'] = controller.tk._('Requesting organisation')
+        expected_facet_titles['open_month'] = controller.tk._('Month opened')
 
         assert expected_facet_titles == controller.c.facet_titles
 
@@ -710,13 +783,9 @@ class UIControllerTest(unittest.TestCase):
             datarequest['organization_id'] = organization
 
         show_datarequest = MagicMock(return_value=datarequest)
-        packages = [{'name': 'pack1', 'title': 'pack1'}, {'name': 'pack2', 'title': 'pack2'}]
-        package_search = MagicMock(return_value={'results': packages})
 
         def _get_action(action):
-            if action == 'package_search':
-                return package_search
-            elif action == constants.SHOW_DATAREQUEST:
+            if action == constants.SHOW_DATAREQUEST:
                 return show_datarequest
             elif action == constants.CLOSE_DATAREQUEST:
                 return close_datarequest
@@ -730,13 +799,10 @@ class UIControllerTest(unittest.TestCase):
         controller.tk.check_access.assert_called_once_with(constants.CLOSE_DATAREQUEST, self.expected_context, {'id': datarequest_id})
         show_datarequest.assert_called_once_with(self.expected_context, {'id': datarequest_id})
 
-        if organization:
-            package_search.assert_called_once_with({'ignore_auth': True}, {'q': 'owner_org:' + organization, 'rows': 500})
-        else:
-            package_search.assert_called_once_with({'ignore_auth': True}, {'rows': 500})
+        # Datasets are not searched when rendering the page
+        assert 'package_search' not in [call[0][0] for call in controller.tk.get_action.call_args_list]
 
         # Assertions
-        expected_datasets = packages
         controller.tk.render.assert_called_once_with('datarequests/close.html')
         assert result == controller.tk.render.return_value
 
@@ -745,8 +811,7 @@ class UIControllerTest(unittest.TestCase):
         assert errors == controller.c.errors
         assert errors_summary == controller.c.errors_summary
         assert datarequest == controller.c.datarequest
-
-        assert expected_datasets == controller.c.datasets
+        assert (post_content or {}).get('accepted_dataset_id', '') == controller.c.accepted_dataset_id
 
     def test_close_post_no_error(self):
         _patch_POST({'accepted_dataset': 'example_ds'})
@@ -786,6 +851,30 @@ class UIControllerTest(unittest.TestCase):
         self._test_close(organization, post_content, exception.error_dict,
                          {'Accepted Dataset': 'error1, error2'}, close_datarequest)
 
+    def test_dataset_autocomplete_not_authorized(self):
+        controller.tk.check_access.side_effect = controller.tk.NotAuthorized('User not authorized')
+
+        result = controller.dataset_autocomplete('example_uuidv4')
+
+        controller.tk.abort.assert_called_once_with(403, 'You are not authorized to close the Data Request example_uuidv4')
+        assert result == 'aborted'
+
+    @patch('ckanext.datarequests.controllers.controller_functions.jsonify', side_effect=lambda data: data)
+    @patch('ckanext.datarequests.controllers.controller_functions.db')
+    def test_dataset_autocomplete(self, db_mock, jsonify_mock):
+        _patch_GET({'q': ' pack ', 'limit': '2'})
+        controller.tk.get_action.return_value.return_value = {'id': 'example_uuidv4', 'organization_id': 'org_uuidv4'}
+        db_mock.get_dataset_candidates.return_value = [('pack1', 'Pack 1'), ('pack2', None), ('pack3', 'Pack 3')]
+
+        result = controller.dataset_autocomplete('example_uuidv4')
+
+        controller.tk.check_access.assert_called_once_with(constants.CLOSE_DATAREQUEST, self.expected_context, {'id': 'example_uuidv4'})
+        db_mock.get_dataset_candidates.assert_called_once_with('org_uuidv4', 'pack', 0, 3)
+        assert {
+            'ResultSet': {'Result': [{'name': 'pack1', 'title': 'Pack 1'}, {'name': 'pack2', 'title': 'pack2'}]},
+            'has_more': True
+        } == result
+
     ######################################################################
     ############################### COMMENT ##############################
     ######################################################################
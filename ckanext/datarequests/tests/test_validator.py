@@ -18,6 +18,7 @@
 # along with CKAN Data Requests Extension. If not, see <http://www.gnu.org/licenses/>.
 
 from ckanext.datarequests import validator
+import datetime
 import unittest
 import random
 
@@ -173,3 +174,105 @@ class ValidatorTest(unittest.TestCase):
         result = validator.validate_comment({}, request_data)
 
         assert result == show_datarequest.return_value
+
+    def test_changes_params(self):
+        result = validator.validate_changes_params({}, {
+            'since': '2020-01-01T10:00:00', 'cursor': '2020-01-02T00:00:00 dr1', 'limit': '10'})
+
+        assert datetime.datetime(2020, 1, 1, 10) == result['since']
+        assert (datetime.datetime(2020, 1, 2), 'dr1') == result['after']
+        assert 10 == result['limit']
+
+    def test_changes_params_time_zone(self):
+        # Times with a time zone are converted to UTC, like metadata_modified
+        result = validator.validate_changes_params({}, {
+            'since': '2020-01-01T10:00:00+10:00', 'cursor': '2020-01-02T00:00:00+10:00 dr1'})
+
+        assert datetime.datetime(2020, 1, 1, 0) == result['since']
+        assert result['since'].tzinfo is None
+        assert (datetime.datetime(2020, 1, 1, 14), 'dr1') == result['after']
+        assert result['after'][0].tzinfo is None
+
+    @parameterized.expand([
+        ({'since': 'yesterday'}, 'Since'),
+        ({'cursor': 'dr1'}, 'Cursor'),
+        ({'limit': '0'}, 'Limit'),
+        ({'limit': str(validator.constants.DATAREQUEST_CHANGES_MAX_PER_PAGE + 1)}, 'Limit'),
+    ])
+    def test_changes_params_invalid(self, request_data, field):
+        with self.assertRaises(self._tk.ValidationError) as c:
+            validator.validate_changes_params({}, request_data)
+
+        assert [field] == list(c.exception.error_dict.keys())
+
+    def test_date_filters(self):
+        result = validator.validate_date_filters({}, {'opened_after': '2020-01-15', 'opened_before': ''})
+
+        assert {'opened_after': datetime.datetime(2020, 1, 15), 'opened_before': None} == result
+
+    def test_date_filters_time_zone(self):
+        # Dates with a time zone are converted to UTC, like the stored ones
+        result = validator.validate_date_filters({}, {'opened_after': '2020-01-15T10:00:00+02:00'})
+
+        assert datetime.datetime(2020, 1, 15, 8) == result['opened_after']
+        assert result['opened_after'].tzinfo is None
+
+    def test_date_filters_invalid(self):
+        with self.assertRaises(self._tk.ValidationError) as c:
+            validator.validate_date_filters({}, {'opened_after': '15/01/2020'})
+
+        assert ['Opened after'] == list(c.exception.error_dict.keys())
+
+    @parameterized.expand([
+        ('true', True),
+        ('False', False),
+        ('', None),
+        (None, None),
+    ])
+    def test_closed_filter(self, closed, expected):
+        validator.tk.asbool = self._tk.asbool
+
+        assert expected is validator.validate_closed_filter({}, {'closed': closed})
+
+    def test_closed_filter_invalid(self):
+        validator.tk.asbool = self._tk.asbool
+
+        with self.assertRaises(self._tk.ValidationError) as c:
+            validator.validate_closed_filter({}, {'closed': 'maybe'})
+
+        assert ['Closed'] == list(c.exception.error_dict.keys())
+
+    @parameterized.expand([
+        ('2020-01', datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1)),
+        ('2020-12', datetime.datetime(2020, 12, 1), datetime.datetime(2021, 1, 1)),
+        ('', None, None),
+    ])
+    def test_open_month(self, open_month, start, end):
+        assert (start, end) == validator.validate_open_month({}, {'open_month': open_month})
+
+    def test_open_month_invalid(self):
+        with self.assertRaises(self._tk.ValidationError) as c:
+            validator.validate_open_month({}, {'open_month': 'January'})
+
+        assert ['Open month'] == list(c.exception.error_dict.keys())
+
+    def test_stats_params(self):
+        result = validator.validate_stats_params({}, {'since': '2020-01-01', 'until': '2020-01-31'})
+
+        assert {'since': datetime.date(2020, 1, 1), 'until': datetime.date(2020, 1, 31)} == result
+
+    def test_stats_params_default(self):
+        result = validator.validate_stats_params({}, {'until': '2020-01-31'})
+
+        assert datetime.date(2020, 1, 31) - result['since'] == datetime.timedelta(
+            days=validator.constants.DATAREQUEST_STATS_DAYS - 1)
+
+    @parameterized.expand([
+        ({'since': '01/01/2020'}, 'Since'),
+        ({'since': '2020-02-01', 'until': '2020-01-01'}, 'Since'),
+    ])
+    def test_stats_params_invalid(self, request_data, field):
+        with self.assertRaises(self._tk.ValidationError) as c:
+            validator.validate_stats_params({}, request_data)
+
+        assert [field] == list(c.exception.error_dict.keys())
@@ -0,0 +1,224 @@
+# encoding: utf-8
+""" Rate limiting of the actions performed by an account.
+
+Attempts are recorded in Redis as a sliding window log. The window is
+checked and updated by a server side script, so every check takes a single
+round trip and concurrent requests cannot race past the limit.
+
+If Redis cannot be reached, attempts are counted in memory by every worker
+process instead, and Redis is not tried again until a cool down has passed.
+
+Limits can be configured per action with
+'ckanext.datarequests.throttle.<action> = <attempts>/<seconds>', and
+set to 0 (or 0 attempts) to disable throttling of the action.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from ckan import model
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins.toolkit import config
+
+from . import constants
+
+log = logging.getLogger(__name__)
+
+# Attempts allowed per account and the window they are counted over, in seconds
+DEFAULT_LIMITS = {
+    constants.CREATE_DATAREQUEST: (1, 300),
+    constants.COMMENT_DATAREQUEST: (5, 60),
+    constants.UPDATE_DATAREQUEST_COMMENT: (10, 60),
+    constants.FOLLOW_DATAREQUEST: (20, 60),
+}
+
+# Members of an organization with these roles are not throttled
+DEFAULT_EXEMPT_ROLES = 'editor admin'
+
+# Trying again too soon also counts as an attempt, so the attempts kept per
+# account are capped to bound the memory used in Redis
+MAX_RECORDED_ATTEMPTS = 100
+
+# Avoid checking the organization roles of an account on every attempt
+EXEMPT_CACHE = {}
+EXEMPT_CACHE_EXPIRY = 300
+EXEMPT_CACHE_MAX_SIZE = 10000
+
+# Seconds to wait before trying Redis again once it has failed
+CIRCUIT_BREAKER_COOLDOWN = 30
+
+# Accounts tracked in memory per process while Redis is unavailable, the least
+# recently seen ones are forgotten first
+LOCAL_MAX_KEYS = 10000
+
+# KEYS[1]: the attempts of the account
+# ARGV[1]: current time (ms), ARGV[2]: window length (ms),
+# ARGV[3]: attempts allowed within the window, ARGV[4]: max recorded attempts
+# Returns 0 if the attempt is allowed or the milliseconds to wait otherwise
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+redis.call('ZADD', KEYS[1], now, now .. '-' .. count)
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[4]) + 1))
+redis.call('PEXPIRE', KEYS[1], window)
+if count < limit then
+    return 0
+end
+local oldest = redis.call('ZRANGE', KEYS[1], -limit, -limit, 'WITHSCORES')
+return math.max(tonumber(oldest[2]) + window - now, 1)
+"""
+
+_sliding_window = None
+_redis_retry_time = 0
+_local_windows = collections.OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _get_sliding_window():
+    """ Registers the script once per process. The connection pool is
+    shared by every Redis client created by CKAN.
+    """
+    global _sliding_window
+    if _sliding_window is None:
+        _sliding_window = connect_to_redis().register_script(SLIDING_WINDOW_SCRIPT)
+    return _sliding_window
+
+
+def get_key(action, user_id):
+    return '{}.ckanext.datarequest.throttle.{}.{}'.format(config.get('ckan.site_id'), action, user_id)
+
+
+def get_limit(action):
+    """ Returns the (attempts, seconds) allowed for the action, or None if
+    the action is not throttled.
+    """
+    value = config.get('ckanext.datarequests.throttle.{}'.format(action))
+    if value is None:
+        return DEFAULT_LIMITS.get(action)
+
+    value = str(value).strip()
+    if not value or value == '0':
+        return None
+
+    try:
+        limit, period = value.split('/')
+        limit, period = int(limit), int(period)
+    except ValueError:
+        limit = period = -1
+
+    if limit < 0 or period <= 0:
+        log.warning("Invalid throttle limit '%s' for %s, using the default one", value, action)
+        return DEFAULT_LIMITS.get(action)
+
+    # No attempts allowed means the action is not throttled, as with '0'
+    if limit == 0:
+        return None
+
+    return limit, period
+
+
+def is_exempt(user):
+    """ Sysadmins and the organization members with an exempt role skip the
+    throttle.
+    """
+    if user.sysadmin:
+        return True
+
+    now = time.time()
+    cached = EXEMPT_CACHE.get(user.id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    roles = config.get('ckanext.datarequests.throttle.exempt_roles', DEFAULT_EXEMPT_ROLES).split()
+    exempt = bool(roles) and model.Session.query(model.Member.id).join(
+        model.Group, model.Group.id == model.Member.group_id
+    ).filter(
+        model.Member.table_name == 'user',
+        model.Member.table_id == user.id,
+        model.Member.state == 'active',
+        model.Member.capacity.in_(roles),
+        model.Group.is_organization.is_(True),
+        model.Group.state == 'active'
+    ).first() is not None
+
+    if len(EXEMPT_CACHE) >= EXEMPT_CACHE_MAX_SIZE:
+        EXEMPT_CACHE.clear()
+    EXEMPT_CACHE[user.id] = (now + EXEMPT_CACHE_EXPIRY, exempt)
+
+    return exempt
+
+
+def _local_hit(key, limit, period, now):
+    """ Same algorithm as the Redis script, applied to the attempts seen by
+    this process.
+    """
+    with _local_lock:
+        window = _local_windows.pop(key, None)
+        if window is None:
+            window = collections.deque(maxlen=max(limit, MAX_RECORDED_ATTEMPTS))
+
+        while window and window[0] <= now - period:
+            window.popleft()
+
+        count = len(window)
+        window.append(now)
+        _local_windows[key] = window
+
+        while len(_local_windows) > LOCAL_MAX_KEYS:
+            _local_windows.popitem(last=False)
+
+        if count < limit:
+            return 0
+
+        return max(window[-limit] + period - now, 0.001)
+
+
+def hit(action, user_id, limit, period):
+    """ Records an attempt of the account to perform the action.
+
+    :returns: 0 if the account has performed less than limit attempts in the
+        last period seconds, or the seconds to wait before trying again
+    :rtype: float
+    """
+    global _redis_retry_time
+
+    key = get_key(action, user_id)
+    now = time.time()
+
+    if now >= _redis_retry_time:
+        try:
+            retry_after = _get_sliding_window()(
+                keys=[key],
+                args=[int(now * 1000), int(period * 1000), limit, max(limit, MAX_RECORDED_ATTEMPTS)])
+            retry_after = int(retry_after or 0) / 1000.0
+
+            log.debug("Account %s attempted %s, next allowed in %s seconds", user_id, action, retry_after)
+            return retry_after
+        except RedisError as e:
+            log.warning("Unable to throttle %s with Redis, counting attempts locally for %s seconds: %s",
+                        action, CIRCUIT_BREAKER_COOLDOWN, e)
+            _redis_retry_time = now + CIRCUIT_BREAKER_COOLDOWN
+
+    return _local_hit(key, limit, period, now)
+
+
+def check(action, user):
+    """ Records an attempt of the user to perform the action, unless the
+    action is not throttled or the user is exempt.
+
+    :returns: 0 if the attempt is allowed, or the seconds to wait before
+        trying again
+    :rtype: float
+    """
+    limit = get_limit(action)
+    if not limit or is_exempt(user):
+        return 0
+
+    return hit(action, user.id, *limit)
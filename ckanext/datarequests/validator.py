@@ -39,6 +39,16 @@ def _has_alpha_chars(string, min_alpha_chars):
     return alpha_chars >= min_alpha_chars
 
 
+def _group_id_exists(context):
+    def organization_exists(organization_id):
+        try:
+            tk.get_validator('group_id_exists')(organization_id, context)
+            return True
+        except Exception:
+            return False
+    return organization_exists
+
+
 def validate_datarequest(context, request_data):
     errors = {}
 
@@ -62,6 +72,21 @@ def validate_datarequest(context, request_data):
         except Exception:
             _add_error(errors, requested_dataset_field, tk._('Requested dataset not found'))
 
+    validate_datarequest_fields(context, request_data, errors, default_title, default_org_id,
+                                _group_id_exists(context))
+
+    if len(errors) > 0:
+        raise tk.ValidationError(errors)
+
+
+def validate_datarequest_fields(context, request_data, errors, default_title, default_org_id, organization_exists):
+    '''
+    Checks the fields of a data request once its requested dataset has been
+    resolved, adding the problems found to errors. Organizations are checked
+    with the organization_exists function, so callers validating many data
+    requests can resolve them all at once.
+    '''
+
     # Check organization
     organization_id = request_data.get('organization_id', default_org_id)
     request_data['organization_id'] = organization_id
@@ -69,11 +94,8 @@ def validate_datarequest(context, request_data):
     if not organization_id:
         _add_error(errors, organization_field, tk._('Organization cannot be empty'))
 
-    if organization_id:
-        try:
-            tk.get_validator('group_id_exists')(request_data['organization_id'], context)
-        except Exception:
-            _add_error(errors, organization_field, tk._('Organization is not valid'))
+    if organization_id and not organization_exists(organization_id):
+        _add_error(errors, organization_field, tk._('Organization is not valid'))
 
     ###################################
     # Validating visible fields
@@ -131,11 +153,8 @@ def validate_datarequest(context, request_data):
         _add_error(errors, requesting_organisation_field, tk._('Requesting organisation cannot be empty'))
 
     # Check requesting_organisation is a valid organisation in database.
-    if requesting_organisation:
-        try:
-            tk.get_validator('group_id_exists')(requesting_organisation, context)
-        except Exception:
-            _add_error(errors, requesting_organisation_field, tk._('Requesting organisation is not valid'))
+    if requesting_organisation and not organization_exists(requesting_organisation):
+        _add_error(errors, requesting_organisation_field, tk._('Requesting organisation is not valid'))
 
     # Check data_storage_environment, it should not be empty.
     data_storage_environment = request_data.get('data_storage_environment', '')
@@ -172,9 +191,150 @@ def validate_datarequest(context, request_data):
     if status not in [status['value'] for status in valid_statuses]:
         _add_error(errors, status_field, tk._('Status value is not valid'))
 
-    if len(errors) > 0:
+
+def _as_naive_utc(value):
+    # The times are stored in UTC, without time zone
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def validate_date_filters(context, request_data):
+    '''
+    Parses the opened_after and opened_before filters (ISO 8601 dates).
+    Returns a dict with the parsed values, None for the missing ones.
+    '''
+    errors = {}
+    result = {}
+
+    for field_name, label in [('opened_after', tk._('Opened after')), ('opened_before', tk._('Opened before'))]:
+        value = request_data.get(field_name) or None
+        if value is not None and not isinstance(value, datetime.datetime):
+            try:
+                value = datetime.datetime.fromisoformat(str(value))
+            except ValueError:
+                _add_error(errors, label, tk._('Date must be in format yyyy-mm-dd'))
+                value = None
+        result[field_name] = _as_naive_utc(value)
+
+    if errors:
         raise tk.ValidationError(errors)
 
+    return result
+
+
+def validate_closed_filter(context, request_data):
+    '''
+    Parses the closed filter. Returns True or False, or None if the filter is
+    missing.
+    '''
+    closed = request_data.get('closed')
+    if closed is None or closed == '':
+        return None
+
+    try:
+        return tk.asbool(closed)
+    except ValueError:
+        raise tk.ValidationError({tk._('Closed'): [tk._('Closed must be true or false')]})
+
+
+def validate_open_month(context, request_data):
+    '''
+    Parses the open_month filter (yyyy-mm). Returns the (start, end) of the
+    month, or (None, None) if the filter is missing.
+    '''
+    open_month = request_data.get('open_month') or None
+    if open_month is None:
+        return None, None
+
+    try:
+        start = datetime.datetime.strptime(str(open_month), '%Y-%m')
+    except ValueError:
+        raise tk.ValidationError({tk._('Open month'): [tk._('Month must be in format yyyy-mm')]})
+
+    end = datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def validate_changes_params(context, request_data):
+    '''
+    Parses the parameters of the change feed. Returns a dict with since (a
+    datetime or None), after (the (metadata_modified, id) encoded in the
+    cursor, or None) and limit.
+    '''
+    errors = {}
+    result = {'since': None, 'after': None, 'limit': constants.DATAREQUEST_CHANGES_PER_PAGE}
+
+    since = request_data.get('since') or None
+    if since is not None:
+        try:
+            result['since'] = _as_naive_utc(datetime.datetime.fromisoformat(str(since)))
+        except ValueError:
+            _add_error(errors, tk._('Since'), tk._('Date must be in ISO 8601 format'))
+
+    cursor = request_data.get('cursor') or None
+    if cursor is not None:
+        try:
+            modified, datarequest_id = str(cursor).split(' ', 1)
+            result['after'] = (_as_naive_utc(datetime.datetime.fromisoformat(modified)), datarequest_id)
+        except ValueError:
+            _add_error(errors, tk._('Cursor'), tk._('Cursor is not valid'))
+
+    limit = request_data.get('limit')
+    if limit is not None:
+        try:
+            result['limit'] = int(limit)
+            if not 0 < result['limit'] <= constants.DATAREQUEST_CHANGES_MAX_PER_PAGE:
+                raise ValueError
+        except ValueError:
+            _add_error(errors, tk._('Limit'), tk._('Limit must be a number between 1 and %d') % constants.DATAREQUEST_CHANGES_MAX_PER_PAGE)
+
+    if errors:
+        raise tk.ValidationError(errors)
+
+    return result
+
+
+def validate_stats_params(context, request_data):
+    '''
+    Parses the days of the statistics (yyyy-mm-dd, both included). Returns a
+    dict with since and until, by default the last DATAREQUEST_STATS_DAYS days.
+    '''
+    errors = {}
+    result = {}
+
+    for field_name, label in [('since', tk._('Since')), ('until', tk._('Until'))]:
+        value = request_data.get(field_name) or None
+        if value is not None:
+            try:
+                value = datetime.datetime.strptime(str(value), '%Y-%m-%d').date()
+            except ValueError:
+                _add_error(errors, label, tk._('Date must be in format yyyy-mm-dd'))
+        result[field_name] = value
+
+    if errors:
+        raise tk.ValidationError(errors)
+
+    if result['until'] is None:
+        result['until'] = datetime.datetime.utcnow().date()
+    if result['since'] is None:
+        result['since'] = result['until'] - datetime.timedelta(days=constants.DATAREQUEST_STATS_DAYS - 1)
+
+    if result['since'] > result['until']:
+        raise tk.ValidationError({tk._('Since'): [tk._('Since must not be after until')]})
+
+    return result
+
+
+def validate_datarequest_status(context, request_data):
+    status = request_data.get('status', '')
+    status_field = tk._('Status')
+    if not status:
+        raise tk.ValidationError({status_field: [tk._('Status cannot be empty')]})
+
+    if status not in [valid_status['value'] for valid_status in helpers.get_status_list()]:
+        raise tk.ValidationError({status_field: [tk._('Status value is not valid')]})
+
 
 def validate_datarequest_closing(context, request_data):
     if tk.h.closing_circumstances_enabled: